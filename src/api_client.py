@@ -4,17 +4,40 @@ API Client для отправки результатов боев на внеш
 """
 
 import json
-import urllib
-import urllib2
-import threading
 import os
+import zlib
 import codecs
 import BigWorld
-import time
+from json.encoder import encode_basestring_ascii as _escape_ascii
+from http_transport import g_httpTransport, HTTPError, TransportError, BodyError
+from worker_pool import WorkerPool
+from upload_outbox import UploadOutbox, SEND_OK, SEND_REJECTED, SEND_RETRY
+from log_writer import g_logWriter, INFO, ERROR
+from dispatch_queue import g_dispatchQueue
 
 
-# Logging configuration
-LOG_FILE_PATH = os.path.abspath('./mods/logs/WinChanceMod.log')
+# 4xx коды, после которых отправку стоит повторить
+RETRYABLE_CLIENT_ERRORS = (401, 403, 408, 429)
+
+# Пакетная отправка результатов; коды, по которым считаем, что сервер её не поддерживает
+BATCH_ENDPOINT = '/api/BattlesRaw/batch'
+BATCH_UNSUPPORTED_CODES = (404, 405, 501)
+
+# Форматы отправки результатов: gzip с rawJson объектом или старый (rawJson строкой, без сжатия)
+UPLOAD_FORMAT_GZIP = 'gzip'
+UPLOAD_FORMAT_LEGACY = 'legacy'
+# Коды, по которым сервер может не понимать сжатый формат. 400 учитывается, только
+# пока формат не подтверждён: старый формат принимается, лишь если сервер его принял
+FORMAT_UNSUPPORTED_CODES = (415,)
+FORMAT_UNCONFIRMED_CODES = (400, 415)
+RAW_JSON_FIELD = ',"rawJson":'
+
+# Состояния подключения к API (проверка сервера и регистрация идут в фоне)
+BOOTSTRAP_UNKNOWN = 'unknown'
+BOOTSTRAP_PROBING = 'probing'
+BOOTSTRAP_REGISTERING = 'registering'
+BOOTSTRAP_READY = 'ready'
+BOOTSTRAP_FAILED = 'failed'
 
 class BattleAPIClient(object):
     """Клиент для отправки данных боев на API"""
@@ -35,137 +58,421 @@ class BattleAPIClient(object):
         self.timeout = 10
         self.api_config = api_config  # Ссылка на глобальный конфиг
         
-        # Create log directory if it doesn't exist
-        try:
-            log_dir = os.path.dirname(LOG_FILE_PATH)
-            if not os.path.exists(log_dir):
-                os.makedirs(log_dir)
-        except:
-            pass
+        # Фиксированный пул отправки: количество потоков и память не растут
+        # вместе с количеством накопившихся результатов
+        self.upload_pool = WorkerPool(2, name='BattleAPIClient', max_queue=32)
+        
+        # Журнал неотправленных результатов: переживает падение клиента и
+        # недоступность сервера, отправляется в фоне в том числе в следующих сессиях
+        self.batch_supported = None  # None - ещё не проверяли
+        self.upload_format = None  # None - ещё не согласован
+        self.chunked_supported = None  # False - сервер ответил 411, тело отправляется целиком
+        self.outbox = UploadOutbox(self._send_outbox_batch, log=self.log, log_error=self.err)
+        
+        # Отправка ждёт, пока сервер не ответит и токен не будет получен
+        self.bootstrap_state = BOOTSTRAP_UNKNOWN
+        self.bootstrap_attempts = 0
+        self.bootstrap_base_delay = 30.0  # Задержка перед повтором после первой неудачи (сек)
+        self.bootstrap_max_delay = 1800.0
+        self._bootstrap_retry = None  # BigWorld.callback повторной попытки
+        self.outbox.set_paused(True, 'bootstrap')
+        self.outbox.start()
     
-    def _write_log(self, msg):
-        try:
-            import datetime
-            timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            with open(LOG_FILE_PATH, 'a') as f:
-                f.write("[{}] {}\n".format(timestamp, msg))
-        except:
-            pass
-
     def log(self, msg):
-        """Логирование"""
-        formatted = "[WinChanceMod] [API] {}".format(msg)
-        print(formatted)
-        self._write_log(formatted)
+        """Логирование (через общий буферизованный лог мода)"""
+        g_logWriter.write(INFO, "[WinChanceMod] [API] {}".format(msg))
     
     def err(self, msg):
         """Логирование ошибок"""
-        formatted = "[WinChanceMod] [API] ERROR: {}".format(msg)
-        print(formatted)
-        self._write_log(formatted)
+        g_logWriter.write(ERROR, "[WinChanceMod] [API] ERROR: {}".format(msg))
     
     def send_raw_battle_result(self, battle_id, account_id, battle_time, raw_json):
         """
-        Отправка сырых результатов боя на API
+        Ставит сырые результаты боя в outbox для отправки на API
         
         Args:
             battle_id (int): ID боя (arenaUniqueID)
             account_id (int): ID аккаунта игрока
             battle_time (str): Время боя в формате ISO 8601
-            raw_json (str): Сырой JSON с результатами боя
+            raw_json (str|callable): Сырой JSON с результатами боя (UTF-8), либо
+                                     функция raw_json(write), пишущая его кусками -
+                                     тогда результаты не собираются в памяти целиком
         
         Returns:
-            bool: True если отправка запущена успешно
+            bool: True если результаты сохранены в outbox
         """
         try:
-            api_data = {
+            meta = json.dumps({
                 'battleId': battle_id,
                 'accountId': account_id,
-                'battleTime': battle_time,
-                'rawJson': raw_json
-            }
-            self._send_async('POST', '/api/BattlesRaw', api_data)
+                'battleTime': battle_time
+            }, separators=(',', ':'))
+            # rawJson встраивается объектом, а не строкой - без повторной сериализации
+            prefix = meta[:-1] + RAW_JSON_FIELD
+            if callable(raw_json):
+                def _produce(write):
+                    write(prefix)
+                    raw_json(write)
+                    write('}')
+                self.outbox.enqueue_stream(battle_id, _produce)
+            else:
+                if isinstance(raw_json, unicode):
+                    raw_json = raw_json.encode('utf-8')
+                self.outbox.enqueue(battle_id, prefix + raw_json + '}')
             return True
         except Exception as e:
             self.err("Failed to send raw battle result: {}".format(e))
             return False
     
-    def _send_async(self, method, endpoint, data, retries=3, delay=5):
+    @staticmethod
+    def _iter_legacy(chunks):
+        """
+        Потоковое преобразование записи outbox в старый формат, где rawJson - JSON строка
+        (то же, что json.dumps(raw_json.decode('utf-8'), ensure_ascii=True))
+        """
+        chunks = iter(chunks)
+        head = ''
+        for chunk in chunks:
+            head += chunk
+            pos = head.find(RAW_JSON_FIELD)
+            if pos >= 0 and len(head) > pos + len(RAW_JSON_FIELD):
+                break
+        pos = head.find(RAW_JSON_FIELD)
+        start = pos + len(RAW_JSON_FIELD)
+        if pos < 0 or head[start:start + 1] == '"':
+            # Запись в старом формате (сохранена прошлой версией мода)
+            yield head
+            for chunk in chunks:
+                yield chunk
+            return
+        
+        yield head[:start] + '"'
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        # Последний байт записи - закрывающая '}' объекта, а не часть rawJson
+        held = head[start:]
+        for chunk in chunks:
+            if not chunk:
+                continue
+            data, held = held + chunk[:-1], chunk[-1:]
+            text = decoder.decode(data)
+            if text:
+                yield _escape_ascii(text)[1:-1]
+        text = decoder.decode(held[:-1], True)
+        yield _escape_ascii(text)[1:-1] + '"' + held[-1:]
+    
+    @staticmethod
+    def _iter_gzip(chunks, counters):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            counters['raw'] += len(chunk)
+            data = compressor.compress(chunk)
+            if data:
+                counters['sent'] += len(data)
+                yield data
+        data = compressor.flush()
+        counters['sent'] += len(data)
+        yield data
+    
+    def _iter_body(self, readers, upload_format, batch):
+        if batch:
+            yield '['
+        for i, reader in enumerate(readers):
+            if i:
+                yield ','
+            chunks = reader()
+            if upload_format == UPLOAD_FORMAT_LEGACY:
+                chunks = self._iter_legacy(chunks)
+            for chunk in chunks:
+                yield chunk
+        if batch:
+            yield ']'
+    
+    def _encode_upload(self, readers, upload_format, batch, counters):
+        """
+        Returns:
+            tuple: (body, headers) для указанного формата; body - функция,
+                   возвращающая итератор кусков тела (повторяемая при переподключении)
+        """
+        headers = {}
+        
+        def _body():
+            counters['raw'] = counters['sent'] = 0
+            chunks = self._iter_body(readers, upload_format, batch)
+            if upload_format == UPLOAD_FORMAT_GZIP:
+                return self._iter_gzip(chunks, counters)
+            return chunks
+        
+        if upload_format == UPLOAD_FORMAT_GZIP:
+            headers['Content-Encoding'] = 'gzip'
+        if self.chunked_supported is False:
+            # Сервер не принимает chunked - тело собирается в памяти
+            return ''.join(_body()), headers
+        return _body, headers
+    
+    def _post_upload(self, endpoint, readers, batch=False):
         """
-        Асинхронная отправка данных на сервер
+        Отправка результатов с согласованием формата: сначала сжатый gzip с rawJson
+        объектом, при 415 (или 400, пока формат не подтверждён) - повтор в старом
+        формате, который используется до конца сессии, только если сервер его принял. Тело читается из outbox и отправляется
+        потоком (chunked), при 411 - повтор с Content-Length.
         
         Args:
-            method (str): HTTP метод (GET, POST, PUT)
-            endpoint (str): API endpoint
-            data (dict): Данные для отправки
-            retries (int): Количество повторных попыток
-            delay (int): Задержка между попытками (сек)
+            readers (list): функции, возвращающие итератор кусков записи outbox
+        
+        Returns:
+            HttpResponse: ответ сервера
+        
+        Raises:
+            HTTPError, TransportError, BodyError
+        """
+        upload_format = self.upload_format or UPLOAD_FORMAT_GZIP
+        counters = {'raw': 0, 'sent': 0}
+        try:
+            response = self._post_encoded(endpoint, readers, upload_format, batch, counters)
+        except HTTPError as e:
+            fallback_codes = FORMAT_UNCONFIRMED_CODES if self.upload_format is None else FORMAT_UNSUPPORTED_CODES
+            if upload_format == UPLOAD_FORMAT_LEGACY or e.code not in fallback_codes:
+                raise
+            self.log("Server rejected compressed upload (HTTP {}), retrying in legacy format".format(e.code))
+            # Если и старый формат не принят - формат не меняем, следующая попытка снова начнётся с gzip
+            response = self._post_encoded(endpoint, readers, UPLOAD_FORMAT_LEGACY, batch, counters)
+            self.log("Legacy format accepted, using it for this session")
+            self.upload_format = UPLOAD_FORMAT_LEGACY
+            return response
+        
+        if self.upload_format is None:
+            self.log("Compressed uploads accepted ({} -> {} bytes)".format(counters['raw'], counters['sent']))
+        self.upload_format = upload_format
+        return response
+    
+    def _post_encoded(self, endpoint, readers, upload_format, batch, counters):
+        body, headers = self._encode_upload(readers, upload_format, batch, counters)
+        try:
+            return self._request('POST', endpoint, body, headers)
+        except HTTPError as e:
+            if e.code != 411 or not callable(body):
+                raise
+            self.log("Server requires Content-Length (HTTP 411), disabling streamed uploads")
+            self.chunked_supported = False
+            body, headers = self._encode_upload(readers, upload_format, batch, counters)
+            return self._request('POST', endpoint, body, headers)
+    
+    def _send_outbox_batch(self, entries):
+        """
+        Отправка пакета записей outbox через пул
+        
+        Args:
+            entries (list): [(entry_id, reader), ...], entry_id = str(battleId)
+        
+        Returns:
+            Future: dict entry_id -> SEND_*
+        """
+        if len(entries) == 1 or self.batch_supported is False:
+            return self.upload_pool.submit(self._send_each, entries)
+        return self.upload_pool.submit(self._send_batch, entries)
+    
+    def _send_each(self, entries):
+        """Отправка каждой записи отдельным запросом (синхронно, в пуле)"""
+        return dict((entry_id, self._attempt(lambda: self._post_upload('/api/BattlesRaw', [reader])))
+                    for entry_id, reader in entries)
+    
+    def _send_batch(self, entries):
+        """
+        Отправка пакета одним запросом POST /api/BattlesRaw/batch (синхронно, в пуле).
+        Тело - JSON массив записей, ответ содержит статус каждой:
+        {"results": [{"battleId": ..., "status": "ok"|"duplicate"|"error", "retryable": bool}]}
+        
+        Returns:
+            dict: entry_id -> SEND_*
+        """
+        try:
+            response = self._post_upload(BATCH_ENDPOINT, [reader for _, reader in entries], batch=True)
+            self.batch_supported = True
+        except HTTPError as e:
+            if e.code in BATCH_UNSUPPORTED_CODES:
+                # Старый сервер без пакетного endpoint - дальше отправляем по одной
+                self.log("Batch upload not supported (HTTP {}), falling back to single sends".format(e.code))
+                self.batch_supported = False
+                return self._send_each(entries)
+            self.err("Batch HTTP Error {}: {}".format(e.code, e.reason))
+            if 400 <= e.code < 500 and e.code not in RETRYABLE_CLIENT_ERRORS:
+                return dict((entry_id, SEND_REJECTED) for entry_id, _ in entries)
+            return {}
+        except TransportError as e:
+            self.err("Batch URL Error: {}".format(e.reason))
+            return {}
+        except BodyError as e:
+            # Повреждённая запись в пакете - отправляем по одной, чтобы отбросить только её
+            self.err("Batch body error: {}".format(e))
+            return self._send_each(entries)
+        
+        statuses = {}
+        try:
+            for item in response.json().get('results', []):
+                status = item.get('status')
+                if status in ('ok', 'duplicate'):
+                    statuses[str(item.get('battleId'))] = SEND_OK
+                elif not item.get('retryable', True):
+                    self.err("Battle {} rejected: {}".format(item.get('battleId'), item.get('message')))
+                    statuses[str(item.get('battleId'))] = SEND_REJECTED
+        except Exception as e:
+            self.err("Invalid batch response: {}".format(e))
+        
+        # Записи без статуса в ответе outbox повторит позже
+        self.log("Batch response: {}/{} accepted".format(
+            sum(1 for status in statuses.values() if status == SEND_OK), len(entries)))
+        return statuses
+    
+    def _request(self, method, endpoint, body, extra_headers=None):
+        """
+        Запрос к API с авторизацией (синхронно)
+        
+        Returns:
+            HttpResponse: ответ сервера
+        
+        Raises:
+            HTTPError, TransportError
+        """
+        # Хедеры собираем каждый раз, на случай если токен обновится
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+        if extra_headers:
+            headers.update(extra_headers)
+        
+        if self.api_token:
+            headers['Authorization'] = 'Bearer {}'.format(self.api_token)
+        
+        # Отправка (через общий пул keep-alive соединений)
+        return g_httpTransport.request(method, self.api_url + endpoint, body, headers, timeout=self.timeout)
+    
+    def _attempt(self, request_fn):
+        """
+        Выполняет request_fn() и классифицирует результат
+        
+        Returns:
+            str: SEND_OK, SEND_REJECTED (не повторять) или SEND_RETRY
         """
-        def _worker():
+        try:
+            response = request_fn()
+            
+            # Обработка ответа
+            response_data = response.json()
+            self.log("Response: {}".format(response_data.get('message', 'unknown')))
+            return SEND_OK
+            
+        except HTTPError as e:
+            self.err("HTTP Error {}: {}".format(e.code, e.reason))
             try:
-                # Подготовка данных (делаем один раз)
-                url = self.api_url + endpoint 
-                # ensure_ascii=True - безопасная сериализация, экранирует не-ASCII символы
-                json_data = json.dumps(data, ensure_ascii=True)
-                
-                current_try = 0
-                while current_try <= retries:
-                    try:
-                      
-                        # Создание запроса (каждый раз новый, на случай если хедеры/токен обновятся)
-                        req = urllib2.Request(url, json_data)
-                        req.add_header('Content-Type', 'application/json')
-                        
-                        if self.api_token:
-                            req.add_header('Authorization', 'Bearer {}'.format(self.api_token))
-                        
-                        # Отправка
-                        response = urllib2.urlopen(req, timeout=self.timeout)
-                        
-                        # Обработка ответа
-                        response_data = json.load(response)
-                        self.log("Response: {}".format(response_data.get('message', 'unknown')))
-                        
-                        # Если успешно - выходим
-                        return
-                        
-                    except urllib2.HTTPError as e:
-                        self.err("HTTP Error {}: {}".format(e.code, e.reason))
-                        try:
-                            error_data = json.load(e)
-                            self.err("Error details: {}".format(error_data))
-                        except:
-                            pass
-                        
-                        # Если ошибка клиента (4xx), не ретраим (кроме таймаута мб, но пока так)
-                        if 400 <= e.code < 500:
-                            self.err("Client error (4xx), aborting retries.")
-                            break
+                error_data = e.json()
+                self.err("Error details: {}".format(error_data))
+            except:
+                pass
+            
+            # Ошибка клиента (4xx) не ретраится, кроме авторизации (токен ещё не получен),
+            # таймаута запроса и rate limit
+            if 400 <= e.code < 500 and e.code not in RETRYABLE_CLIENT_ERRORS:
+                self.err("Client error (4xx), aborting retries.")
+                return SEND_REJECTED
 
-                    except urllib2.URLError as e:
-                        self.err("URL Error: {}".format(e.reason))
-                        
-                    except Exception as e:
-                        self.err("Send error: {}".format(e))
-                        import traceback
-                        self.err(traceback.format_exc())
-                    
-                    # Логика ретрая
-                    current_try += 1
-                    if current_try <= retries:
-                        time.sleep(delay)
-                
-                self.err("Failed to send data after {} attempts".format(retries + 1))
-                
-            except Exception as e:
-                self.err("Critical error in _worker: {}".format(e))
-                import traceback
-                self.err(traceback.format_exc())
+        except TransportError as e:
+            self.err("URL Error: {}".format(e.reason))
+            
+        except BodyError as e:
+            # Запись в outbox повреждена - повтор не поможет
+            self.err("Upload body is unreadable, dropping: {}".format(e))
+            return SEND_REJECTED
+            
+        except Exception as e:
+            self.err("Send error: {}".format(e))
+            import traceback
+            self.err(traceback.format_exc())
+        
+        return SEND_RETRY
+    
+    def set_uploads_paused(self, paused):
+        """Пауза фоновой отправки (в бою сжатие и сеть не конкурируют с игрой)"""
+        self.outbox.set_paused(paused, 'battle')
+    
+    def fini(self, timeout=3.0):
+        """Дожидается отправки поставленных в очередь данных (не дольше timeout) и останавливает пул"""
+        if self._bootstrap_retry is not None:
+            BigWorld.cancelCallback(self._bootstrap_retry)
+            self._bootstrap_retry = None
+        # Outbox больше не берёт новые записи; оставшиеся отправятся в следующей сессии
+        self.outbox.stop()
+        stats = self.upload_pool.get_stats()
+        self.log("Draining upload pool: queued={}, in_flight={}".format(
+            stats['queued'], stats['in_flight']))
+        lost = self.upload_pool.drain(timeout)
+        if lost:
+            self.err("{} uploads were not sent before shutdown".format(lost))
+        outbox_stats = self.outbox.get_stats()
+        if outbox_stats['pending']:
+            self.log("{} uploads remain in outbox for the next session".format(outbox_stats['pending']))
+        self.outbox.close()
+    
+    def start_bootstrap(self):
+        """
+        Запускает проверку сервера и регистрацию в фоне (вызывать из основного потока).
+        Повторный вызов ничего не делает, пока попытка идёт, уже успешна или
+        запланирован повтор (задержка между попытками не сбрасывается при входе в ангар).
+        """
+        if self.bootstrap_state not in (BOOTSTRAP_UNKNOWN, BOOTSTRAP_FAILED):
+            return
+        if self._bootstrap_retry is not None:
+            return
         
-        # Запускаем в отдельном потоке
-        t = threading.Thread(target=_worker)
-        t.daemon = True
-        t.start()
+        # BigWorld.player() доступен только из основного потока - данные игрока берём здесь
+        player_info = self.get_player_info()
+        self.bootstrap_state = BOOTSTRAP_PROBING
+        future = self.upload_pool.submit(self._run_bootstrap, player_info)
+        future.add_done_callback(g_dispatchQueue.wrap(self._on_bootstrap_done))
+    
+    def _run_bootstrap(self, player_info):
+        """
+        Проверка сервера и регистрация (в потоке пула отправки)
+        
+        Returns:
+            bool: True если сервер доступен и токен есть
+        """
+        if not self.test_connection():
+            return False
+        if self.api_token or (self.api_config and self.api_config.get('token')):
+            return True
+        # Состояние меняется только в основном потоке
+        g_dispatchQueue.call(self._set_bootstrap_state, BOOTSTRAP_REGISTERING)
+        # Токен применяется в основном потоке (apply_registration) до _on_bootstrap_done
+        return bool(self.register_in_api(player_info))
+    
+    def _set_bootstrap_state(self, state):
+        if self.bootstrap_state == BOOTSTRAP_PROBING:
+            self.bootstrap_state = state
+    
+    def _on_bootstrap_done(self, future):
+        """Результат фоновой попытки (в основном потоке)"""
+        if future.error() is None and future.result():
+            if self.api_config and self.api_config.get('token'):
+                # Обновляем локальные переменные из конфига
+                self.api_token = self.api_config.get('token')
+                self.api_account_id = self.api_config.get('account_id')
+                self.api_nickname = self.api_config.get('nickname')
+            self.bootstrap_state = BOOTSTRAP_READY
+            self.bootstrap_attempts = 0
+            self.outbox.set_paused(False, 'bootstrap')
+            self.log("API ready")
+            return
+        
+        if future.error() is not None:
+            self.err("API bootstrap error: {}".format(future.error()))
+        self.bootstrap_state = BOOTSTRAP_FAILED
+        self.bootstrap_attempts += 1
+        delay = min(self.bootstrap_max_delay, self.bootstrap_base_delay * (2 ** (self.bootstrap_attempts - 1)))
+        self.log("API not ready (attempt {}), retrying in {:.0f}s - uploads wait in outbox".format(
+            self.bootstrap_attempts, delay))
+        self._bootstrap_retry = BigWorld.callback(delay, self._on_bootstrap_retry)
+    
+    def _on_bootstrap_retry(self):
+        self._bootstrap_retry = None
+        self.start_bootstrap()
     
     def test_connection(self):
         """
@@ -178,9 +485,9 @@ class BattleAPIClient(object):
             url = self.api_url + '/api/health'
             
             try:
-                response = urllib2.urlopen(url, timeout=5)
+                g_httpTransport.request('GET', url, timeout=5)
                 return True
-            except urllib2.HTTPError as e:
+            except HTTPError as e:
                 # Если 401 - сервер отвечает, просто требует авторизацию
                 if e.code == 401:
                     return True
@@ -223,16 +530,21 @@ class BattleAPIClient(object):
         
         return None
     
-    def register_in_api(self):
+    def register_in_api(self, player_info=None):
         """
         Автоматически регистрирует мод в API и получает токен
         
+        Args:
+            player_info (dict): Данные игрока (get_player_info) - из рабочего потока
+                                их нужно передать, BigWorld.player() там недоступен
+        
         Returns:
             str: Токен или None при ошибке
         """
         try:
             # Получаем информацию об игроке
-            player_info = self.get_player_info()
+            if player_info is None:
+                player_info = self.get_player_info()
             if not player_info:
                 return None
             
@@ -248,42 +560,29 @@ class BattleAPIClient(object):
             self.log("Registering: {} ({})".format(player_info['nickname'], player_info['account_id']))
             
             # Отправляем запрос
-            request = urllib2.Request(url)
-            request.add_header('Content-Type', 'application/json; charset=utf-8')
+            headers = {'Content-Type': 'application/json; charset=utf-8'}
             data = json.dumps(register_data, ensure_ascii=False).encode('utf-8')
             
-            response = urllib2.urlopen(request, data, timeout=10)
-            response_data = json.loads(response.read())
+            response = g_httpTransport.request('POST', url, data, headers, timeout=10)
+            response_data = response.json()
             
             token = response_data.get('Token')
             
             if token:
                 self.log("Registration successful!")
                 
-                # Обновляем локальные переменные
-                self.api_token = token
-                self.api_account_id = player_info['account_id']
-                self.api_nickname = player_info['nickname']
-                
-                # Обновляем конфиг через ссылку
-                if self.api_config:
-                    self.api_config['token'] = token
-                    self.api_config['account_id'] = player_info['account_id']
-                    self.api_config['nickname'] = player_info['nickname']
-                    self.api_config['region'] = player_info['region']
-                    
-                    # Сохраняем конфиг
-                    self.save_api_config()
+                # Конфиг общий с модом - обновляем и сохраняем в основном потоке
+                g_dispatchQueue.call(self.apply_registration, token, player_info)
                 
                 return token
             else:
                 self.err("Registration failed: no token in response")
                 return None
                 
-        except urllib2.HTTPError as e:
-            self.err("HTTP Error during registration: {} - {}".format(e.code, e.read()))
+        except HTTPError as e:
+            self.err("HTTP Error during registration: {} - {}".format(e.code, e.body))
             return None
-        except urllib2.URLError as e:
+        except TransportError as e:
             self.err("URL Error during registration: {}".format(e.reason))
             return None
         except Exception as e:
@@ -292,6 +591,23 @@ class BattleAPIClient(object):
             self.err(traceback.format_exc())
             return None
     
+    def apply_registration(self, token, player_info):
+        """Сохраняет полученный токен в клиенте и конфиге (в основном потоке)"""
+        # Обновляем локальные переменные
+        self.api_token = token
+        self.api_account_id = player_info['account_id']
+        self.api_nickname = player_info['nickname']
+        
+        # Обновляем конфиг через ссылку
+        if self.api_config:
+            self.api_config['token'] = token
+            self.api_config['account_id'] = player_info['account_id']
+            self.api_config['nickname'] = player_info['nickname']
+            self.api_config['region'] = player_info['region']
+            
+            # Сохраняем конфиг
+            self.save_api_config()
+    
     def save_api_config(self):
         """Сохраняет конфигурацию API"""
         try:
@@ -310,36 +626,3 @@ class BattleAPIClient(object):
         except Exception as e:
             self.err("Error saving API config: {}".format(e))
             return False
-    
-    def check_and_register_if_needed(self):
-        """
-        Проверяет наличие токена и регистрируется если нужно
-        
-        Returns:
-            bool: True если токен есть или получен успешно
-        """
-        try:
-            # Если интеграция отключена - не регистрируемся
-            if not self.api_config or not self.api_config.get('enabled'):
-                return False
-            
-            # Проверяем наличие токена
-            if self.api_config.get('token'):
-                # Обновляем локальные переменные из конфига
-                self.api_token = self.api_config.get('token')
-                self.api_account_id = self.api_config.get('account_id')
-                self.api_nickname = self.api_config.get('nickname')
-                return True
-            
-            # Пытаемся зарегистрироваться
-            token = self.register_in_api()
-            
-            if token:
-                self.log("Automatic registration successful!")
-                return True
-            else:
-                return False
-                
-        except Exception as e:
-            self.err("Error in check_and_register_if_needed: {}".format(e))
-            return False
\ No newline at end of file
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Планировщик фоновой работы с учётом GUI space поверх очереди основного потока
+(DispatchQueue): своего насоса нет, задачи выполняются насосом очереди в общем
+бюджете на кадр. В ангаре задачи выполняются сразу, на загрузке и в бою:
+  URGENT - выполняются как в ангаре
+  NORMAL - выполняются понемногу (battle_budget раз в battle_interval)
+  IDLE   - откладываются до возвращения в ангар
+Рабочие потоки (отправка результатов) не ставят задачи, а проверяют allows()
+и подписываются на смену режима.
+
+Все методы, кроме allows(), вызываются из основного потока.
+"""
+
+import time
+from collections import deque
+
+import BigWorld
+
+from dispatch_queue import g_dispatchQueue, perf_timer
+
+
+# Классы приоритета
+URGENT = 0
+NORMAL = 1
+IDLE = 2
+
+PRIORITY_NAMES = {URGENT: 'urgent', NORMAL: 'normal', IDLE: 'idle'}
+
+# Режимы
+MODE_HANGAR = 'hangar'
+MODE_BATTLE = 'battle'  # загрузка боя и бой
+
+
+class BackgroundScheduler(object):
+    """Очереди задач по приоритетам с паузой/ограничением в бою"""
+
+    def __init__(self, dispatch, battle_budget=0.001, battle_interval=1.0, log=None, log_error=None):
+        """
+        Args:
+            dispatch (DispatchQueue): Очередь основного потока, насос которой выполняет задачи
+            battle_budget (float): Время на NORMAL задачи за один проход в бою (сек)
+            battle_interval (float): Интервал проходов по NORMAL задачам в бою (сек)
+            log (callable): Функция логирования
+            log_error (callable): Функция логирования ошибок задач
+        """
+        self.dispatch = dispatch
+        self.battle_budget = battle_budget
+        self.battle_interval = battle_interval
+        self._log = log
+        self._log_error = log_error
+        self.mode = MODE_HANGAR
+        self._queues = dict((priority, deque()) for priority in PRIORITY_NAMES)  # (key, fn, args, submitted)
+        self._keys = {}  # key -> priority задачи, ожидающей в очереди
+        self._listeners = []
+        self._posted = False  # _run_next уже стоит в очереди основного потока
+        self._battle_timer = None  # проход по NORMAL задачам в бою
+        self._running = False
+        self._stats = dict((priority, {'run': 0, 'deferred': 0, 'deferred_time': 0.0, 'max_wait': 0.0})
+                           for priority in PRIORITY_NAMES)
+
+    def set_logger(self, log, log_error):
+        """Функции логирования (глобальный планировщик создаётся до логгера мода)"""
+        self._log = log
+        self._log_error = log_error
+
+    def log(self, msg):
+        if self._log:
+            self._log("[Scheduler] {}".format(msg))
+
+    def err(self, msg):
+        if self._log_error:
+            self._log_error("[Scheduler] {}".format(msg))
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._wake()
+
+    def flush(self):
+        """Выполняет все ожидающие задачи сразу, без бюджета (выход из игры)"""
+        for priority in (URGENT, NORMAL, IDLE):
+            while self._queues[priority]:
+                self._run_one(priority)
+
+    def stop(self):
+        """Останавливает выполнение; невыполненные задачи отбрасываются"""
+        self._running = False
+        self._posted = False
+        self._cancel_battle_timer()
+        for queue in self._queues.values():
+            queue.clear()
+        self._keys.clear()
+
+    def add_mode_listener(self, listener):
+        """listener(mode) вызывается при смене режима"""
+        self._listeners.append(listener)
+
+    def set_mode(self, mode):
+        if mode == self.mode:
+            return
+        self.mode = mode
+        for listener in self._listeners:
+            try:
+                listener(mode)
+            except Exception as e:
+                self.err("Mode listener failed: {}".format(e))
+        if mode == MODE_HANGAR:
+            self._cancel_battle_timer()
+            deferred = sum(len(self._queues[priority]) for priority in (NORMAL, IDLE))
+            if deferred:
+                self.log("Back in hangar - running {} deferred tasks".format(deferred))
+        self._wake()
+
+    def allows(self, priority):
+        """Можно ли сейчас выполнять работу этого класса (безопасно из любого потока)"""
+        return self.mode == MODE_HANGAR or priority == URGENT
+
+    def submit(self, fn, args=(), priority=NORMAL, key=None):
+        """
+        Ставит задачу в очередь
+
+        Args:
+            fn (callable): Задача
+            args (tuple): Аргументы
+            priority (int): URGENT / NORMAL / IDLE
+            key: Если задача с таким ключом уже ждёт - новая не добавляется
+
+        Returns:
+            bool: True если задача добавлена
+        """
+        if key is not None:
+            if key in self._keys:
+                return False
+            self._keys[key] = priority
+        self._queues[priority].append((key, fn, args, time.time()))
+        if not self.allows(priority):
+            self._stats[priority]['deferred'] += 1
+        self._wake()
+        return True
+
+    def pending_count(self, priority=None):
+        if priority is not None:
+            return len(self._queues[priority])
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _runnable(self):
+        """Приоритет первой задачи, которую можно выполнить сейчас (None - нечего)"""
+        for priority in (URGENT, NORMAL, IDLE):
+            if self._queues[priority] and self.allows(priority):
+                return priority
+        return None
+
+    def _wake(self):
+        """Ставит выполнение задач в очередь основного потока / взводит проход в бою"""
+        if not self._running:
+            return
+        if not self._posted and self._runnable() is not None:
+            self._posted = True
+            self.dispatch.post(self._run_next)
+        if self.mode == MODE_BATTLE and self._queues[NORMAL] and self._battle_timer is None:
+            self._battle_timer = BigWorld.callback(self.battle_interval, self._on_battle_timer)
+
+    def _run_next(self):
+        """
+        Одна задача за вызов: насос очереди основного потока продолжает, пока не
+        исчерпан его бюджет на кадр, остаток переходит на следующий кадр
+        """
+        self._posted = False
+        if not self._running:
+            return
+        priority = self._runnable()
+        if priority is not None:
+            self._run_one(priority)
+        self._wake()
+
+    def _on_battle_timer(self):
+        """В бою NORMAL задачи выполняются не дольше battle_budget раз в battle_interval"""
+        self._battle_timer = None
+        if not self._running or self.mode != MODE_BATTLE:
+            return
+        started = perf_timer()
+        while self._queues[NORMAL]:
+            self._run_one(NORMAL)
+            if perf_timer() - started >= self.battle_budget:
+                break
+        self._wake()
+
+    def _cancel_battle_timer(self):
+        if self._battle_timer is not None:
+            try:
+                BigWorld.cancelCallback(self._battle_timer)
+            except Exception:
+                pass
+            self._battle_timer = None
+
+    def _run_one(self, priority):
+        key, fn, args, submitted = self._queues[priority].popleft()
+        if key is not None:
+            self._keys.pop(key, None)
+        stats = self._stats[priority]
+        waited = time.time() - submitted
+        if waited > 1.0:
+            stats['deferred_time'] += waited
+            stats['max_wait'] = max(stats['max_wait'], waited)
+        try:
+            fn(*args)
+        except Exception as e:
+            import traceback
+            self.err("Task {} failed: {}\n{}".format(getattr(fn, '__name__', fn), e, traceback.format_exc()))
+        stats['run'] += 1
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: имя приоритета -> run, deferred (поставлено, пока класс был на паузе/ограничен),
+                  deferred_time (суммарное ожидание, сек), max_wait, pending
+        """
+        return dict((PRIORITY_NAMES[priority], dict(stats, pending=len(self._queues[priority])))
+                    for priority, stats in self._stats.items())
+
+
+# Общий планировщик фоновой работы мода
+g_backgroundScheduler = BackgroundScheduler(g_dispatchQueue)
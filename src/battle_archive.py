@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Локальный архив сырых результатов боёв: append-only сегменты со сжатыми
+(zlib) JSON результатами и индексом arenaUniqueID -> смещение.
+
+Сегмент - файл seg_NNNNNN.dat из записей <arena_id:8><data_len:4><crc32:4>
+(little-endian) + сжатые данные. Закрытый сегмент получает файл индекса
+seg_NNNNNN.idx из записей <arena_id:8><offset:4><data_len:4>; индекс активного
+сегмента восстанавливается при открытии чтением заголовков (недописанный хвост
+отбрасывается). Старые сегменты удаляются целиком по сроку и общему размеру.
+"""
+
+import os
+import re
+import time
+import zlib
+import struct
+import threading
+
+from journal_store import replace_file, normalize_arena_id
+
+
+ARCHIVE_DIR = os.path.abspath('./mods/configs/mod_winchance/battle_archive/')
+
+_RECORD = struct.Struct('<QII')  # arena_id, data_len, crc32 сжатых данных
+_INDEX = struct.Struct('<QII')   # arena_id, offset записи, data_len
+_SEGMENT_RE = re.compile(r'^seg_(\d{6})\.dat$')
+
+
+def _segment_name(number, ext):
+    return 'seg_{:06d}.{}'.format(number, ext)
+
+
+class BattleArchive(object):
+    """Сегментированный сжатый архив результатов боёв"""
+
+    def __init__(self, path=ARCHIVE_DIR, segment_max_bytes=8 * 1024 * 1024, segment_max_battles=500,
+                 max_total_bytes=200 * 1024 * 1024, max_age_days=90, compress_level=6, read_only=False,
+                 log_error=None):
+        """
+        Args:
+            path (str): Папка архива
+            segment_max_bytes (int): Размер сегмента, после которого начинается новый
+            segment_max_battles (int): Максимум боёв в одном сегменте
+            max_total_bytes (int): Предел размера архива (0 - без ограничения)
+            max_age_days (float): Сколько дней хранить сегменты (0 - без ограничения)
+            compress_level (int): Уровень сжатия zlib (1-9)
+            read_only (bool): Только чтение (инструменты вне клиента) - файлы не изменяются
+            log_error (callable): Функция логирования ошибок
+        """
+        self.path = path
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_battles = segment_max_battles
+        self.max_total_bytes = max_total_bytes
+        self.max_age_days = max_age_days
+        self.compress_level = compress_level
+        self.read_only = read_only
+        self._log_error = log_error
+        self._lock = threading.RLock()
+        self._index = {}      # arena_id -> (segment, offset, data_len)
+        self._segments = {}   # segment -> [размер файла, количество боёв]
+        self._active = None   # номер активного сегмента
+        self._file = None
+        self.dropped_bytes = 0  # сколько байт повреждённого хвоста отброшено при открытии
+        self._open()
+
+    def err(self, msg):
+        if self._log_error:
+            self._log_error(msg)
+
+    def _segment_path(self, number, ext='dat'):
+        return os.path.join(self.path, _segment_name(number, ext))
+
+    def _open(self):
+        if not os.path.exists(self.path):
+            if self.read_only:
+                return
+            os.makedirs(self.path)
+        numbers = sorted(int(m.group(1)) for m in (_SEGMENT_RE.match(name) for name in os.listdir(self.path)) if m)
+        for number in numbers:
+            if number != numbers[-1] and self._load_index(number):
+                continue
+            self._scan_segment(number, active=number == numbers[-1])
+        if self.read_only:
+            self._active = numbers[-1] if numbers else None
+        elif numbers:
+            self._active = numbers[-1]
+            self._file = open(self._segment_path(self._active), 'r+b')
+        else:
+            self._start_segment(1)
+
+    def _load_index(self, number):
+        """Загружает индекс закрытого сегмента (False если его нет или он не совпадает с сегментом)"""
+        idx_path = self._segment_path(number, 'idx')
+        if not os.path.exists(idx_path):
+            return False
+        try:
+            with open(idx_path, 'rb') as f:
+                data = f.read()
+            if len(data) % _INDEX.size:
+                return False
+            entries = [_INDEX.unpack_from(data, pos) for pos in range(0, len(data), _INDEX.size)]
+            size = os.path.getsize(self._segment_path(number))
+            if entries and entries[-1][1] + _RECORD.size + entries[-1][2] != size:
+                return False
+        except (IOError, OSError):
+            return False
+        for arena_id, offset, data_len in entries:
+            self._index[arena_id] = (number, offset, data_len)
+        self._segments[number] = [size, len(entries)]
+        return True
+
+    def _scan_segment(self, number, active):
+        """Строит индекс сегмента по заголовкам записей (последовательное чтение)"""
+        seg_path = self._segment_path(number)
+        offset = count = 0
+        with open(seg_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            file_size = f.tell()
+            while offset + _RECORD.size <= file_size:
+                f.seek(offset)
+                arena_id, data_len, crc = _RECORD.unpack(f.read(_RECORD.size))
+                if not arena_id or offset + _RECORD.size + data_len > file_size:
+                    break
+                if active and zlib.crc32(f.read(data_len)) & 0xffffffff != crc:
+                    # CRC проверяем только в активном сегменте - закрытые уже были целыми
+                    break
+                self._index[arena_id] = (number, offset, data_len)
+                offset += _RECORD.size + data_len
+                count += 1
+        if offset < file_size:
+            self.dropped_bytes += file_size - offset
+            if active and not self.read_only:
+                with open(seg_path, 'r+b') as f:
+                    f.truncate(offset)
+        self._segments[number] = [offset, count]
+
+    def _start_segment(self, number):
+        self._active = number
+        self._segments[number] = [0, 0]
+        self._file = open(self._segment_path(number), 'w+b')
+
+    def _seal_active(self):
+        """Закрывает активный сегмент и пишет его индекс"""
+        number = self._active
+        entries = sorted((offset, arena_id, data_len) for arena_id, (segment, offset, data_len)
+                         in self._index.items() if segment == number)
+        idx_path = self._segment_path(number, 'idx')
+        tmp_path = idx_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(''.join(_INDEX.pack(arena_id, offset, data_len) for offset, arena_id, data_len in entries))
+        replace_file(tmp_path, idx_path)
+        self._file.close()
+        self._file = None
+
+    def _rotate_if_full(self):
+        size, count = self._segments[self._active]
+        if size >= self.segment_max_bytes or count >= self.segment_max_battles:
+            self._seal_active()
+            self._start_segment(self._active + 1)
+            self.enforce_retention()
+
+    def __contains__(self, arena_id):
+        return normalize_arena_id(arena_id, strict=True) in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def append(self, arena_id, produce):
+        """
+        Сжимает и дописывает результаты боя в активный сегмент (потоково)
+
+        Args:
+            arena_id: arenaUniqueID
+            produce (callable): produce(write) - вызывает write(data) для каждого куска JSON
+
+        Returns:
+            bool: True если бой добавлен (False - уже в архиве или некорректный ID)
+        """
+        arena_id = normalize_arena_id(arena_id, strict=True)
+        if arena_id is None:
+            return False
+        with self._lock:
+            if arena_id in self._index:
+                return False
+            if self._file is None:
+                raise IOError("battle archive is closed or read-only")
+            f = self._file
+            start = self._segments[self._active][0]
+            f.seek(start)
+            # Нулевой arena_id в заголовке: при падении до исправления запись отбросится
+            f.write(_RECORD.pack(0, 0, 0))
+            compressor = zlib.compressobj(self.compress_level)
+            state = {'len': 0, 'crc': 0}
+
+            def _emit(data):
+                if data:
+                    f.write(data)
+                    state['len'] += len(data)
+                    state['crc'] = zlib.crc32(data, state['crc'])
+
+            def _write(data):
+                if isinstance(data, unicode):
+                    data = data.encode('utf-8')
+                _emit(compressor.compress(data))
+
+            try:
+                produce(_write)
+                _emit(compressor.flush())
+                f.seek(start)
+                f.write(_RECORD.pack(arena_id, state['len'], state['crc'] & 0xffffffff))
+                f.flush()
+            except Exception:
+                f.seek(start)
+                f.truncate()
+                raise
+
+            self._index[arena_id] = (self._active, start, state['len'])
+            segment = self._segments[self._active]
+            segment[0] = start + _RECORD.size + state['len']
+            segment[1] += 1
+            self._rotate_if_full()
+            return True
+
+    def iter_json(self, arena_id, chunk_size=64 * 1024):
+        """
+        Распакованный JSON результатов боя кусками (отдельный дескриптор файла)
+
+        Returns:
+            iterator: куски JSON; None если боя нет в архиве
+
+        Raises:
+            IOError: запись повреждена
+        """
+        with self._lock:
+            location = self._index.get(normalize_arena_id(arena_id, strict=True))
+            if location is None:
+                return None
+            if self._file is not None:
+                self._file.flush()
+            reader = open(self._segment_path(location[0]), 'rb')
+        return self._iter_record(reader, location[1], chunk_size)
+
+    @staticmethod
+    def _iter_record(reader, offset, chunk_size):
+        try:
+            reader.seek(offset)
+            _, data_len, expected_crc = _RECORD.unpack(reader.read(_RECORD.size))
+            decompressor = zlib.decompressobj()
+            crc = 0
+            remaining = data_len
+            while remaining > 0:
+                chunk = reader.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise IOError("archive record at {} is truncated".format(offset))
+                remaining -= len(chunk)
+                crc = zlib.crc32(chunk, crc)
+                if remaining <= 0 and crc & 0xffffffff != expected_crc:
+                    raise IOError("archive record at {} is corrupt".format(offset))
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+            data = decompressor.flush()
+            if data:
+                yield data
+        finally:
+            reader.close()
+
+    def get(self, arena_id):
+        """JSON результатов боя строкой (None если боя нет в архиве)"""
+        chunks = self.iter_json(arena_id)
+        return ''.join(chunks) if chunks is not None else None
+
+    def scan(self):
+        """
+        Все бои архива в порядке записи, сегмент за сегментом (последовательное чтение)
+
+        Returns:
+            iterator: (arena_id, json_str)
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            by_segment = {}
+            for arena_id, (segment, offset, data_len) in self._index.items():
+                by_segment.setdefault(segment, []).append((offset, arena_id))
+        for segment in sorted(by_segment):
+            try:
+                reader = open(self._segment_path(segment), 'rb')
+            except IOError:
+                continue  # сегмент удалён по сроку хранения
+            try:
+                for offset, arena_id in sorted(by_segment[segment]):
+                    reader.seek(offset)
+                    _, data_len, crc = _RECORD.unpack(reader.read(_RECORD.size))
+                    data = reader.read(data_len)
+                    if len(data) != data_len or zlib.crc32(data) & 0xffffffff != crc:
+                        self.err("Corrupt archive record {} in segment {}".format(arena_id, segment))
+                        continue
+                    yield arena_id, zlib.decompress(data)
+            finally:
+                reader.close()
+
+    def total_bytes(self):
+        return sum(size for size, _ in self._segments.values())
+
+    def enforce_retention(self, now=None):
+        """
+        Удаляет самые старые закрытые сегменты по сроку хранения и общему размеру
+
+        Returns:
+            int: Количество удалённых сегментов
+        """
+        now = now or time.time()
+        removed = 0
+        if self.read_only:
+            return removed
+        with self._lock:
+            total = self.total_bytes()
+            for number in sorted(self._segments):
+                if number == self._active:
+                    break
+                seg_path = self._segment_path(number)
+                try:
+                    age_days = (now - os.path.getmtime(seg_path)) / 86400.0
+                except OSError:
+                    age_days = 0
+                too_old = self.max_age_days and age_days > self.max_age_days
+                too_big = self.max_total_bytes and total > self.max_total_bytes
+                if not too_old and not too_big:
+                    break
+                try:
+                    for ext in ('dat', 'idx'):
+                        path = self._segment_path(number, ext)
+                        if os.path.exists(path):
+                            os.remove(path)
+                except OSError as e:
+                    # Сегмент может быть открыт читателем (Windows) - удалим в следующий раз
+                    self.err("Error removing archive segment {}: {}".format(number, e))
+                    break
+                total -= self._segments.pop(number)[0]
+                for arena_id in [arena_id for arena_id, location in self._index.items() if location[0] == number]:
+                    del self._index[arena_id]
+                removed += 1
+        return removed
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
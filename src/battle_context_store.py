@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Контекст боёв (состав команд, WGR, шанс победы, карта) в одном журнале
+(JournalStore) вместо отдельного JSON файла на каждый бой.
+
+Время сохранения и обработки результатов каждого боя держится в памяти, поэтому
+сборка мусора не читает значения с диска: контекст удаляется через processed_ttl
+после обработки результатов боя или через max_age, если результатов так и не было.
+Сборка мусора и компактизация журнала выполняются в фоновом потоке.
+"""
+
+import os
+import json
+import time
+import threading
+
+from journal_store import JournalStore, normalize_arena_id
+
+
+CONTEXT_PATH = os.path.abspath('./mods/configs/mod_winchance/battle_context.journal')
+LEGACY_CONTEXT_DIR = os.path.abspath('./mods/configs/mod_winchance/battle_context/')
+
+
+class BattleContextStore(object):
+    """Хранилище контекста боёв arena_id -> dict"""
+
+    def __init__(self, path=CONTEXT_PATH, processed_ttl=24 * 3600, max_age=7 * 24 * 3600,
+                 legacy_dir=LEGACY_CONTEXT_DIR, log_error=None):
+        """
+        Args:
+            path (str): Путь к файлу журнала
+            processed_ttl (float): Сколько хранить контекст после обработки результатов боя (сек)
+            max_age (float): Сколько хранить контекст боя без результатов (сек)
+            legacy_dir (str): Папка со старыми {arena_id}.json - переносятся в журнал
+            log_error (callable): Функция логирования ошибок
+        """
+        self.processed_ttl = processed_ttl
+        self.max_age = max_age
+        self._log_error = log_error
+        self._lock = threading.RLock()  # основной поток и фоновая сборка мусора
+        self._meta = {}  # key -> (saved_at, processed_at или None)
+        self._maintenance = None
+        # Контекст не критичен - без fsync на каждую запись (запись идёт из основного потока)
+        self.store = JournalStore(path, sync=False, compact_min_bytes=256 * 1024)
+        if self.store.dropped_bytes:
+            self.err("Battle context journal had {} corrupt trailing bytes, truncated".format(
+                self.store.dropped_bytes))
+        for key in self.store.keys():
+            context = self._read(key)
+            if context is None:
+                self.store.delete(key)
+                continue
+            self._meta[key] = (context.get('savedAt', 0), context.get('processedAt'))
+        if legacy_dir:
+            self._import_legacy(legacy_dir)
+
+    def err(self, msg):
+        if self._log_error:
+            self._log_error(msg)
+
+    @staticmethod
+    def _key(arena_id):
+        """Ключ журнала - arenaUniqueID строкой (None для некорректного ID)"""
+        arena_id = normalize_arena_id(arena_id, strict=True)
+        return str(arena_id) if arena_id is not None else None
+
+    def _read(self, key):
+        try:
+            return json.loads(self.store.get(key))
+        except Exception as e:
+            self.err("Corrupt battle context {}: {}".format(key, e))
+            return None
+
+    def _write(self, key, context):
+        self.store.put(key, json.dumps(context, separators=(',', ':')))
+        self._meta[key] = (context.get('savedAt', 0), context.get('processedAt'))
+
+    def _import_legacy(self, legacy_dir):
+        """Переносит контексты из файлов {arena_id}.json в журнал и удаляет файлы"""
+        if not os.path.isdir(legacy_dir):
+            return
+        for name in os.listdir(legacy_dir):
+            file_path = os.path.join(legacy_dir, name)
+            key = self._key(name[:-5]) if name.endswith('.json') else None
+            try:
+                if key is not None and key not in self._meta:
+                    with open(file_path, 'r') as f:
+                        context = json.load(f)
+                    if isinstance(context, dict):
+                        context.setdefault('savedAt', os.path.getmtime(file_path))
+                        self._write(key, context)
+                os.remove(file_path)
+            except Exception as e:
+                self.err("Error importing battle context {}: {}".format(name, e))
+        try:
+            os.rmdir(legacy_dir)
+        except OSError:
+            pass
+
+    def __contains__(self, arena_id):
+        return self._key(arena_id) in self._meta
+
+    def __len__(self):
+        return len(self._meta)
+
+    def get(self, arena_id):
+        """
+        Returns:
+            dict: Контекст боя ({} если его нет)
+        """
+        key = self._key(arena_id)
+        if key is None or key not in self._meta:
+            return {}
+        return self._read(key) or {}
+
+    def put(self, arena_id, context):
+        """Сохраняет контекст боя (заменяет предыдущий)"""
+        key = self._key(arena_id)
+        if key is None:
+            return False
+        context = dict(context)
+        context.setdefault('savedAt', time.time())
+        context.pop('processedAt', None)
+        with self._lock:
+            self._write(key, context)
+        return True
+
+    def mark_processed(self, arena_id, now=None):
+        """Результаты боя обработаны - контекст удалится через processed_ttl"""
+        key = self._key(arena_id)
+        with self._lock:
+            meta = self._meta.get(key)
+            if meta is None or meta[1] is not None:
+                return False
+            context = self._read(key)
+            if context is None:
+                return self.delete(arena_id)
+            context['processedAt'] = now or time.time()
+            self._write(key, context)
+            return True
+
+    def delete(self, arena_id):
+        key = self._key(arena_id)
+        with self._lock:
+            if key is None or self._meta.pop(key, None) is None:
+                return False
+            self.store.delete(key)
+            return True
+
+    def collect_garbage(self, now=None):
+        """
+        Удаляет контексты обработанных боёв старше processed_ttl и любые старше max_age
+
+        Returns:
+            int: Количество удалённых контекстов
+        """
+        now = now or time.time()
+        with self._lock:
+            expired = [key for key, (saved_at, processed_at) in self._meta.items()
+                       if (processed_at is not None and now - processed_at > self.processed_ttl) or
+                       now - saved_at > self.max_age]
+            for key in expired:
+                self.delete(key)
+        return len(expired)
+
+    def maintain(self):
+        """Сборка мусора и компактизация журнала"""
+        try:
+            self.collect_garbage()
+            self.store.maybe_compact()
+        except Exception as e:
+            self.err("Battle context maintenance failed: {}".format(e))
+
+    def maintain_async(self):
+        """maintain() в фоновом потоке (если он ещё не запущен)"""
+        if self._maintenance is not None and self._maintenance.is_alive():
+            return
+        self._maintenance = threading.Thread(target=self.maintain, name='BattleContextGC')
+        self._maintenance.daemon = True
+        self._maintenance.start()
+
+    def close(self):
+        thread, self._maintenance = self._maintenance, None
+        if thread is not None:
+            thread.join(2.0)
+        self.store.close()
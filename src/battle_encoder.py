@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Однопроходный JSON-кодировщик результатов боя.
+
+Обходит структуру результатов один раз, выбирая обработчик по типу из таблицы,
+и пишет UTF-8 JSON сразу в выходной буфер без промежуточной копии дерева.
+Повторяющиеся строки (ключи, имена техники и игроков) декодируются и
+экранируются один раз и берутся из кэша.
+
+Формат совместим с прежним make_serializable + json.dumps:
+  - ключи словарей приводятся к строке через str() (кортежи -> "(1, 2)");
+  - байтовые строки декодируются как utf-8, затем cp1251, затем latin-1;
+  - set/frozenset/tuple -> массив;
+  - long (в т.ч. arenaUniqueID на Windows) -> строка, как и раньше.
+"""
+
+import json
+
+# Экранирование без ensure_ascii (кириллица пишется как есть в UTF-8)
+_escape = json.encoder.encode_basestring
+
+
+def _decode_bytes(value):
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        try:
+            return value.decode('cp1251')
+        except UnicodeDecodeError:
+            return value.decode('latin-1')
+
+
+def _float_repr(value):
+    if value != value:
+        return 'NaN'
+    if value == float('inf'):
+        return 'Infinity'
+    if value == -float('inf'):
+        return '-Infinity'
+    return repr(value)
+
+
+class BattleResultsEncoder(object):
+    """Кодировщик с кэшем закодированных строк, переиспользуется между боями"""
+
+    def __init__(self, max_cached_strings=50000):
+        """
+        Args:
+            max_cached_strings (int): Предел кэша строк (при превышении кэш очищается)
+        """
+        self.max_cached_strings = max_cached_strings
+        self._strings = {}  # str/unicode -> закодированный JSON литерал (UTF-8)
+        self._dispatch = {
+            dict: self._encode_dict,
+            list: self._encode_sequence,
+            tuple: self._encode_sequence,
+            set: self._encode_sequence,
+            frozenset: self._encode_sequence,
+            str: self._encode_string,
+            unicode: self._encode_string,
+            bool: self._encode_bool,
+            int: self._encode_int,
+            long: self._encode_long,
+            float: self._encode_float,
+            type(None): self._encode_none,
+        }
+
+    def encode(self, obj):
+        """
+        Returns:
+            str: UTF-8 JSON
+        """
+        out = []
+        self._encode(obj, out.append)
+        return ''.join(out)
+
+    def encode_to(self, obj, sink, flush_fragments=4096):
+        """
+        Кодирует obj, передавая UTF-8 JSON в sink(data) кусками.
+        В памяти держится не больше flush_fragments фрагментов (~десятки КБ),
+        а не весь результат.
+        """
+        pending = []
+        append = pending.append
+
+        def _write(data):
+            append(data)
+            if len(pending) >= flush_fragments:
+                sink(''.join(pending))
+                del pending[:]
+
+        self._encode(obj, _write)
+        if pending:
+            sink(''.join(pending))
+
+    def _encode(self, obj, write):
+        handler = self._dispatch.get(type(obj))
+        if handler is None:
+            handler = self._resolve_handler(type(obj))
+        handler(obj, write)
+
+    def _resolve_handler(self, obj_type):
+        """Обработчик для подкласса (OrderedDict, namedtuple, ...) - определяется один раз"""
+        for base, handler in ((bool, self._encode_bool), (dict, self._encode_dict),
+                              (basestring, self._encode_string), (int, self._encode_int),
+                              (long, self._encode_long), (float, self._encode_float),
+                              (list, self._encode_sequence), (tuple, self._encode_sequence),
+                              (set, self._encode_sequence), (frozenset, self._encode_sequence)):
+            if issubclass(obj_type, base):
+                break
+        else:
+            handler = self._encode_other
+        self._dispatch[obj_type] = handler
+        return handler
+
+    def _cached_string(self, value):
+        encoded = self._strings.get(value)
+        if encoded is None:
+            text = _decode_bytes(value) if isinstance(value, str) else value
+            encoded = _escape(text).encode('utf-8')
+            if len(self._strings) >= self.max_cached_strings:
+                self._strings.clear()
+            self._strings[value] = encoded
+        return encoded
+
+    def _encode_string(self, value, write):
+        write(self._cached_string(value))
+
+    def _encode_dict(self, obj, write):
+        if not obj:
+            write('{}')
+            return
+        write('{')
+        first = True
+        cached_string = self._cached_string
+        dispatch = self._dispatch
+        for key, value in obj.iteritems():
+            if first:
+                first = False
+            else:
+                write(',')
+            if isinstance(key, basestring):
+                write(cached_string(key))
+            else:
+                write(cached_string(str(key)))
+            write(':')
+            handler = dispatch.get(type(value))
+            if handler is None:
+                handler = self._resolve_handler(type(value))
+            handler(value, write)
+        write('}')
+
+    def _encode_sequence(self, obj, write):
+        if not obj:
+            write('[]')
+            return
+        write('[')
+        first = True
+        dispatch = self._dispatch
+        for item in obj:
+            if first:
+                first = False
+            else:
+                write(',')
+            handler = dispatch.get(type(item))
+            if handler is None:
+                handler = self._resolve_handler(type(item))
+            handler(item, write)
+        write(']')
+
+    @staticmethod
+    def _encode_bool(value, write):
+        write('true' if value else 'false')
+
+    @staticmethod
+    def _encode_int(value, write):
+        write(int.__str__(value))
+
+    def _encode_long(self, value, write):
+        # Прежний конвертер не знал long и отдавал его строкой - сохраняем формат
+        write('"' + str(value) + '"')
+
+    @staticmethod
+    def _encode_float(value, write):
+        write(_float_repr(value))
+
+    @staticmethod
+    def _encode_none(value, write):
+        write('null')
+
+    def _encode_other(self, value, write):
+        try:
+            text = str(value).decode('utf-8')
+        except Exception:
+            text = repr(value)
+        write(_escape(text).encode('utf-8'))
+
+
+# Общий кодировщик: кэш строк переиспользуется между боями
+g_battleEncoder = BattleResultsEncoder()
+
+
+def encode_battle_results(results):
+    """
+    Кодирует результаты боя в UTF-8 JSON за один проход
+
+    Returns:
+        str: UTF-8 JSON
+    """
+    return g_battleEncoder.encode(results)
+
+
+def encode_battle_results_to(results, sink):
+    """
+    Кодирует результаты боя в UTF-8 JSON, передавая его в sink(data) кусками
+    """
+    g_battleEncoder.encode_to(results, sink)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Журнал обработанных боёв: последние N arenaUniqueID, результаты которых уже
+закодированы и поставлены в отправку. Нужен, чтобы один бой, пришедший и через
+onBattleResultsReceived, и через battleResultsCache, обрабатывался один раз.
+
+Файл фиксированного размера: заголовок <capacity:4><next_slot:4>, затем
+capacity слотов по 8 байт (0 - пустой слот). Добавление перезаписывает один слот.
+"""
+
+import os
+import struct
+import threading
+from collections import deque
+
+from journal_store import replace_file, normalize_arena_id
+
+
+LEDGER_PATH = os.path.abspath('./mods/configs/mod_winchance/processed_battles.ledger')
+
+_HEADER = struct.Struct('<II')
+_SLOT = struct.Struct('<Q')
+
+
+class BattleLedger(object):
+    """Кольцевое множество последних обработанных arenaUniqueID"""
+
+    def __init__(self, path=LEDGER_PATH, capacity=4096, log_error=None):
+        """
+        Args:
+            path (str): Путь к файлу
+            capacity (int): Сколько последних боёв помнить
+            log_error (callable): Функция логирования ошибок
+        """
+        self.path = path
+        self.capacity = capacity
+        self._log_error = log_error
+        self._lock = threading.Lock()
+        self._ids = set()
+        self._ring = deque()  # arena_id в порядке добавления (для вытеснения)
+        self._next_slot = 0
+        self._file = None
+        try:
+            self._open()
+        except Exception as e:
+            # Без файла работаем только в памяти - дубли между сессиями возможны
+            self._file = None
+            self.err("Error opening battle ledger: {}".format(e))
+
+    def err(self, msg):
+        if self._log_error:
+            self._log_error(msg)
+
+    def _open(self):
+        ledger_dir = os.path.dirname(self.path)
+        if ledger_dir and not os.path.exists(ledger_dir):
+            os.makedirs(ledger_dir)
+
+        data = ''
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        capacity = next_slot = 0
+        if len(data) >= _HEADER.size:
+            capacity, next_slot = _HEADER.unpack_from(data)
+        if capacity != self.capacity or len(data) != _HEADER.size + capacity * _SLOT.size:
+            # Нет файла, повреждён или изменён размер - переносим что можно в новый
+            self._rewrite(self._read_slots(data, capacity, next_slot))
+            return
+
+        for arena_id in self._read_slots(data, capacity, next_slot):
+            self._remember(arena_id)
+        self._next_slot = next_slot % capacity
+        self._file = open(self.path, 'r+b')
+
+    @staticmethod
+    def _read_slots(data, capacity, next_slot):
+        """arena_id из слотов в порядке добавления (от самого старого)"""
+        slots = []
+        count = min(capacity, max(0, (len(data) - _HEADER.size) // _SLOT.size))
+        for i in range(count):
+            slot = (next_slot + i) % count if next_slot < count else i
+            arena_id = _SLOT.unpack_from(data, _HEADER.size + slot * _SLOT.size)[0]
+            if arena_id:
+                slots.append(arena_id)
+        return slots
+
+    def _rewrite(self, arena_ids):
+        arena_ids = arena_ids[-self.capacity:]
+        slots = arena_ids + [0] * (self.capacity - len(arena_ids))
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(self.capacity, len(arena_ids) % self.capacity))
+            f.write(''.join(_SLOT.pack(arena_id) for arena_id in slots))
+        replace_file(tmp_path, self.path)
+        for arena_id in arena_ids:
+            self._remember(arena_id)
+        self._next_slot = len(arena_ids) % self.capacity
+        self._file = open(self.path, 'r+b')
+
+    def _remember(self, arena_id):
+        if arena_id in self._ids:
+            return
+        if len(self._ring) >= self.capacity:
+            self._ids.discard(self._ring.popleft())
+        self._ring.append(arena_id)
+        self._ids.add(arena_id)
+
+    def __contains__(self, arena_id):
+        return normalize_arena_id(arena_id, strict=True) in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, arena_id):
+        """
+        Отмечает бой как обработанный
+
+        Returns:
+            bool: True если бой добавлен (False - уже был или некорректный ID)
+        """
+        arena_id = normalize_arena_id(arena_id, strict=True)
+        if arena_id is None:
+            return False
+        with self._lock:
+            if arena_id in self._ids:
+                return False
+            self._remember(arena_id)
+            slot = self._next_slot
+            self._next_slot = (slot + 1) % self.capacity
+            if self._file is None:
+                return True
+            try:
+                # Сначала слот, затем заголовок: при падении между ними теряется
+                # только эта отметка
+                self._file.seek(_HEADER.size + slot * _SLOT.size)
+                self._file.write(_SLOT.pack(arena_id))
+                self._file.seek(0)
+                self._file.write(_HEADER.pack(self.capacity, self._next_slot))
+                self._file.flush()
+            except Exception as e:
+                self.err("Error writing battle ledger: {}".format(e))
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Отслеживание состава команд в бою: агрегаты по командам (суммы рейтингов,
+количество живых, веса) обновляются за O(1) при уничтожении техники,
+появлении опоздавших игроков и получении их рейтингов, без повторной загрузки
+рейтингов всего состава.
+"""
+
+
+class TeamAggregate(object):
+    """Агрегаты команды по живой технике"""
+
+    __slots__ = ('total', 'total_weight', 'alive', 'rated', 'rating_sum',
+                 'weight_sum', 'rated_weight', 'weighted_sum')
+
+    def __init__(self):
+        self.total = 0          # всего техники в команде
+        self.total_weight = 0.0  # сумма весов всей техники команды
+        self.alive = 0          # живой техники
+        self.rated = 0          # живых игроков с рейтингом > 0
+        self.rating_sum = 0.0   # сумма рейтингов живых игроков с рейтингом
+        self.weight_sum = 0.0   # сумма весов живой техники
+        self.rated_weight = 0.0  # сумма весов живых игроков с рейтингом
+        self.weighted_sum = 0.0  # сумма рейтинг * вес живых игроков с рейтингом
+
+    def add(self, rating, weight=1.0, alive=True):
+        self.total += 1
+        self.total_weight += weight
+        if alive:
+            self._apply(rating, weight, 1)
+
+    def set_alive(self, rating, weight, alive):
+        """Техника ожила (alive=True) или уничтожена (alive=False)"""
+        self._apply(rating, weight, 1 if alive else -1)
+
+    def set_rating(self, old_rating, new_rating, weight, alive):
+        """Рейтинг игрока загружен/обновлён"""
+        if alive:
+            self._apply(old_rating, weight, -1)
+            self._apply(new_rating, weight, 1)
+
+    def _apply(self, rating, weight, sign):
+        self.alive += sign
+        self.weight_sum += sign * weight
+        if rating > 0:
+            self.rated += sign
+            self.rating_sum += sign * rating
+            self.rated_weight += sign * weight
+            self.weighted_sum += sign * rating * weight
+
+    def avg_rating(self):
+        """Средний рейтинг живых игроков с рейтингом (0 если таких нет)"""
+        return self.rating_sum / self.rated if self.rated else 0.0
+
+    def alive_fraction(self):
+        return float(self.alive) / self.total if self.total else 0.0
+
+    def weighted_avg_rating(self):
+        """Средний рейтинг живых игроков с учётом весов техники"""
+        return self.weighted_sum / self.rated_weight if self.rated_weight > 0 else 0.0
+
+    def alive_weight_fraction(self):
+        return self.weight_sum / self.total_weight if self.total_weight > 0 else 0.0
+
+
+class LiveBattleTracker(object):
+    """Подписка на события арены и пересчёт агрегатов команд"""
+
+    def __init__(self, arena, vehicles, on_change=None):
+        """
+        Args:
+            arena: BigWorld arena (onVehicleKilled / onVehicleUpdated)
+            vehicles (list): [(vehicle_id, is_ally, rating, weight, alive), ...]
+            on_change (callable): on_change(tracker) после изменения состава
+        """
+        self.arena = arena
+        self.on_change = on_change
+        self.ally = TeamAggregate()
+        self.enemy = TeamAggregate()
+        self._vehicles = {}  # vehicle_id -> [team, rating, weight, alive]
+        for vehicle_id, is_ally, rating, weight, alive in vehicles:
+            self._add(vehicle_id, is_ally, rating, weight, alive)
+        self._attached = False
+
+    def _add(self, vehicle_id, is_ally, rating, weight, alive):
+        team = self.ally if is_ally else self.enemy
+        team.add(rating, weight, alive)
+        self._vehicles[vehicle_id] = [team, rating, weight, alive]
+
+    def __contains__(self, vehicle_id):
+        return vehicle_id in self._vehicles
+
+    def __len__(self):
+        return len(self._vehicles)
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def add_vehicle(self, vehicle_id, is_ally, rating, weight, alive=True):
+        """
+        Опоздавшая техника (появилась после начала отслеживания)
+
+        Returns:
+            bool: True если техника добавлена
+        """
+        if vehicle_id in self._vehicles:
+            return False
+        self._add(vehicle_id, is_ally, rating, weight, alive)
+        self._changed()
+        return True
+
+    def update_ratings(self, ratings):
+        """
+        Args:
+            ratings (dict): vehicle_id -> рейтинг (одно on_change на всю пачку)
+
+        Returns:
+            bool: True если хотя бы один рейтинг изменился
+        """
+        changed = False
+        for vehicle_id, rating in ratings.items():
+            entry = self._vehicles.get(vehicle_id)
+            if entry is None or entry[1] == rating:
+                continue
+            team, old_rating, weight, alive = entry
+            team.set_rating(old_rating, rating, weight, alive)
+            entry[1] = rating
+            changed = True
+        if changed:
+            self._changed()
+        return changed
+
+    def attach(self):
+        if self._attached or self.arena is None:
+            return
+        self.arena.onVehicleKilled += self._on_vehicle_killed
+        self.arena.onVehicleUpdated += self._on_vehicle_updated
+        self._attached = True
+
+    def detach(self):
+        if not self._attached:
+            return
+        self._attached = False
+        try:
+            self.arena.onVehicleKilled -= self._on_vehicle_killed
+            self.arena.onVehicleUpdated -= self._on_vehicle_updated
+        except Exception:
+            pass
+
+    def set_alive(self, vehicle_id, alive):
+        """
+        Returns:
+            bool: True если состояние изменилось
+        """
+        entry = self._vehicles.get(vehicle_id)
+        if entry is None or entry[3] == alive:
+            return False
+        team, rating, weight, _ = entry
+        team.set_alive(rating, weight, alive)
+        entry[3] = alive
+        self._changed()
+        return True
+
+    def _on_vehicle_killed(self, target_id, *args):
+        self.set_alive(target_id, False)
+
+    def _on_vehicle_updated(self, vehicle_id, *args):
+        info = self.arena.vehicles.get(vehicle_id)
+        if info is not None and 'isAlive' in info:
+            self.set_alive(vehicle_id, bool(info['isAlive']))
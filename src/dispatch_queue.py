@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Очередь задач для основного потока игры. Рабочие потоки (рейтинги, API) не
+трогают GUI и состояние мода напрямую, а ставят замыкания в очередь
+(deque.append атомарен); насос на BigWorld.callback выполняет их в основном
+потоке, не дольше frame_budget за кадр - остаток переходит на следующий кадр.
+
+BigWorld.callback можно вызывать только из основного потока, поэтому насос
+взводит только он: post() из основного потока взводит насос на следующий кадр,
+а из рабочего потока лишь добавляет задачу в очередь. Пока есть callback'и,
+выданные wrap() и ещё не вернувшиеся, насос опрашивает очередь раз в
+poll_interval; когда ждать нечего и очередь пуста, насос не перевзводится.
+"""
+
+import time
+import threading
+from collections import deque
+
+import BigWorld
+
+
+# Таймер высокого разрешения (time.time на Windows ~15 мс), общий для модулей мода
+perf_timer = getattr(time, 'perf_counter', None) or time.clock
+
+
+class DispatchQueue(object):
+    """Выполнение задач рабочих потоков в основном потоке с бюджетом на кадр"""
+
+    def __init__(self, frame_budget=0.004, poll_interval=0.1, log_error=None):
+        """
+        Args:
+            frame_budget (float): Сколько времени за кадр можно тратить на задачи (сек)
+            poll_interval (float): Как часто насос проверяет очередь, пока рабочие потоки
+                                   могут вернуть результат (сек); задачи от них
+                                   подхватываются не позже этого
+            log_error (callable): Функция логирования ошибок задач
+        """
+        self.frame_budget = frame_budget
+        self.poll_interval = poll_interval
+        self.log_error = log_error
+        self._queue = deque()
+        self._main_thread = threading.current_thread()
+        self._waiting = 0  # callback'и wrap(), ещё не вернувшиеся из рабочих потоков
+        self._callback = None
+        self._callback_delay = None
+        self._running = False
+        self._stats = {'tasks': 0, 'frames': 0, 'carried_over': 0, 'max_queue': 0, 'max_frame_time': 0.0}
+
+    def is_main_thread(self):
+        return threading.current_thread() is self._main_thread
+
+    def start(self):
+        """Запускает насос (вызывать из основного потока)"""
+        self._main_thread = threading.current_thread()
+        if self._running:
+            return
+        self._running = True
+        self._arm()
+
+    def stop(self):
+        """Останавливает насос; невыполненные задачи отбрасываются"""
+        self._running = False
+        self._cancel()
+        self._queue.clear()
+
+    def post(self, fn, *args):
+        """
+        Ставит fn(*args) в очередь основного потока (можно вызывать из любого потока).
+        Из рабочего потока задача только добавляется в очередь - её подхватит насос,
+        взведённый основным потоком (см. wrap)
+        """
+        self._queue.append((fn, args))
+        if self.is_main_thread():
+            self._arm()
+
+    def call(self, fn, *args):
+        """Выполняет fn(*args) сразу, если это основной поток, иначе ставит в очередь"""
+        if self.is_main_thread():
+            return fn(*args)
+        self.post(fn, *args)
+
+    def wrap(self, fn):
+        """
+        Callback для рабочего потока, который выполнит fn в основном потоке.
+        Вызывать из основного потока: пока callback не вызван, насос опрашивает
+        очередь раз в poll_interval, подхватывая и задачи, поставленные рабочим
+        потоком через post/call до его вызова
+        """
+        self._waiting += 1
+        self._arm()
+        returned = []
+
+        def _done(*args):
+            if not returned:
+                returned.append(True)
+                self._waiting -= 1
+            fn(*args)
+
+        def _dispatch(*args):
+            self.call(_done, *args)
+        return _dispatch
+
+    def _arm(self):
+        """
+        Взводит насос (только из основного потока): на следующий кадр, если в
+        очереди есть работа, раз в poll_interval - если ждём рабочие потоки
+        """
+        if not self._running:
+            return
+        if self._queue:
+            delay = 0
+        elif self._waiting > 0:
+            delay = self.poll_interval
+        else:
+            return
+        if self._callback is not None:
+            if self._callback_delay <= delay:
+                return
+            self._cancel()
+        self._callback_delay = delay
+        self._callback = BigWorld.callback(delay, self._pump)
+
+    def _cancel(self):
+        callback, self._callback = self._callback, None
+        if callback is not None:
+            try:
+                BigWorld.cancelCallback(callback)
+            except Exception:
+                pass
+
+    def _pump(self):
+        self._callback = None
+        if not self._running:
+            return
+        self.run_pending()
+        # Остаток - на следующий кадр; пустая очередь без ожидаемых
+        # результатов рабочих потоков насос не перевзводит
+        self._arm()
+
+    def run_pending(self, budget=None):
+        """
+        Выполняет задачи из очереди, пока не исчерпан бюджет времени (минимум одну)
+
+        Returns:
+            int: Количество выполненных задач
+        """
+        queue = self._queue
+        if not queue:
+            return 0
+        stats = self._stats
+        stats['max_queue'] = max(stats['max_queue'], len(queue))
+        budget = self.frame_budget if budget is None else budget
+        started = perf_timer()
+        done = 0
+        while queue:
+            try:
+                fn, args = queue.popleft()
+            except IndexError:
+                break
+            try:
+                fn(*args)
+            except Exception as e:
+                if self.log_error:
+                    import traceback
+                    self.log_error("Dispatched task {} failed: {}\n{}".format(
+                        getattr(fn, '__name__', fn), e, traceback.format_exc()))
+            done += 1
+            if perf_timer() - started >= budget:
+                break
+        elapsed = perf_timer() - started
+        stats['tasks'] += done
+        stats['frames'] += 1
+        stats['max_frame_time'] = max(stats['max_frame_time'], elapsed)
+        if queue:
+            stats['carried_over'] += 1
+        return done
+
+    def pending_count(self):
+        return len(self._queue)
+
+    def get_stats(self):
+        return dict(self._stats, pending=len(self._queue))
+
+
+# Общая очередь основного потока для всех модулей мода
+g_dispatchQueue = DispatchQueue()
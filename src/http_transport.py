@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Общий HTTP транспорт с keep-alive соединениями для StatsFetcher и BattleAPIClient
+"""
+
+import json
+import time
+import socket
+import httplib
+import urlparse
+import threading
+
+
+class TransportError(Exception):
+    """Ошибка соединения (DNS, TCP, TLS, таймаут)"""
+
+    def __init__(self, reason):
+        Exception.__init__(self, reason)
+        self.reason = reason
+
+
+class BodyError(Exception):
+    """Ошибка источника потокового тела запроса (запрос прерван, повторять бессмысленно)"""
+
+    def __init__(self, error):
+        Exception.__init__(self, str(error))
+        self.error = error
+
+
+class HTTPError(Exception):
+    """Ответ сервера с кодом >= 400"""
+
+    def __init__(self, code, reason, body='', headers=None):
+        Exception.__init__(self, "HTTP {} {}".format(code, reason))
+        self.code = code
+        self.reason = reason
+        self.body = body
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class HttpResponse(object):
+    """Полностью прочитанный ответ сервера"""
+
+    def __init__(self, status, reason, headers, body, elapsed):
+        self.status = status
+        self.reason = reason
+        self.headers = headers  # имена заголовков в нижнем регистре
+        self.body = body
+        self.elapsed = elapsed
+
+    def json(self):
+        return json.loads(self.body)
+
+
+# Ошибки, при которых переиспользованное соединение считаем мёртвым и переподключаемся
+_STALE_CONNECTION_ERRORS = (httplib.BadStatusLine, httplib.CannotSendRequest,
+                            httplib.ResponseNotReady, socket.error)
+
+
+class _HostPool(object):
+    """Пул соединений к одному хосту"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.idle = []  # [(connection, released_at)]
+        self.open_count = 0
+        self.cond = threading.Condition(threading.Lock())
+        self.stats = {
+            'requests': 0,
+            'errors': 0,
+            'connects': 0,
+            'reused': 0,
+            'reconnects': 0,
+            'total_time': 0.0,
+            'max_time': 0.0,
+        }
+
+
+class HttpTransport(object):
+    """Пул постоянных HTTP(S) соединений с ограничением на хост и замером времени запросов"""
+
+    def __init__(self, max_per_host=4, timeout=10, idle_timeout=50.0):
+        """
+        Args:
+            max_per_host (int): Максимум одновременно открытых соединений к одному хосту
+            timeout (float): Таймаут по умолчанию (сек)
+            idle_timeout (float): Через сколько секунд простоя соединение закрывается,
+                                  не дожидаясь, пока его закроет сервер
+        """
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _get_pool(self, key):
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pools[key] = _HostPool(self.max_per_host)
+            return pool
+
+    def _acquire(self, pool, key, timeout):
+        """
+        Returns:
+            tuple: (connection, reused)
+        """
+        scheme, host, port = key
+        deadline = time.time() + timeout
+        with pool.cond:
+            while True:
+                now = time.time()
+                while pool.idle:
+                    conn, released_at = pool.idle.pop()
+                    if now - released_at < self.idle_timeout:
+                        return conn, True
+                    pool.open_count -= 1
+                    conn.close()
+                if pool.open_count < pool.max_size:
+                    pool.open_count += 1
+                    pool.stats['connects'] += 1
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise TransportError("connection pool for {} exhausted".format(host))
+                pool.cond.wait(remaining)
+
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=timeout)
+        return conn, False
+
+    def _drop_idle(self, pool):
+        with pool.cond:
+            for conn, _ in pool.idle:
+                pool.open_count -= 1
+                conn.close()
+            pool.idle = []
+            pool.cond.notify_all()
+
+    def _release(self, pool, conn, reusable):
+        with pool.cond:
+            if reusable:
+                pool.idle.append((conn, time.time()))
+            else:
+                pool.open_count -= 1
+                conn.close()
+            pool.cond.notify()
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        """
+        Выполняет запрос через пул соединений
+
+        Args:
+            method (str): HTTP метод
+            url (str): Полный URL
+            body (str|callable): Тело запроса, либо функция, возвращающая итератор
+                                 кусков тела - тогда тело передаётся потоком
+                                 (Transfer-Encoding: chunked) без сборки в памяти
+            headers (dict): Заголовки
+            timeout (float): Таймаут (сек)
+
+        Returns:
+            HttpResponse: ответ с кодом < 400
+
+        Raises:
+            HTTPError: сервер вернул код >= 400
+            TransportError: ошибка соединения
+            BodyError: ошибка при чтении потокового тела
+        """
+        if timeout is None:
+            timeout = self.timeout
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme or 'http'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers or {})
+        headers.setdefault('Connection', 'keep-alive')
+
+        pool = self._get_pool(key)
+        started = time.time()
+        attempt = 0
+        while True:
+            conn, reused = self._acquire(pool, key, timeout)
+            try:
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                if callable(body):
+                    self._send_chunked(conn, method, path, body(), headers)
+                else:
+                    conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                data = response.read()
+            except _STALE_CONNECTION_ERRORS as e:
+                self._release(pool, conn, False)
+                # Сервер закрыл простаивающее соединение - остальные простаивающие,
+                # скорее всего, тоже мертвы; одна попытка с новым соединением
+                if reused and attempt == 0 and not isinstance(e, socket.timeout):
+                    attempt += 1
+                    self._drop_idle(pool)
+                    continue
+                self._record(pool, None, started, reused, attempt)
+                raise TransportError(str(e) or e.__class__.__name__)
+            except BodyError:
+                self._release(pool, conn, False)
+                self._record(pool, None, started, reused, attempt)
+                raise
+            except Exception as e:
+                self._release(pool, conn, False)
+                self._record(pool, None, started, reused, attempt)
+                raise TransportError(str(e) or e.__class__.__name__)
+            break
+
+        self._release(pool, conn, not response.will_close)
+        elapsed = self._record(pool, response.status, started, reused, attempt)
+
+        response_headers = dict((k.lower(), v) for k, v in response.getheaders())
+        if response.status >= 400:
+            raise HTTPError(response.status, response.reason, data, response_headers)
+        return HttpResponse(response.status, response.reason, response_headers, data, elapsed)
+
+    @staticmethod
+    def _send_chunked(conn, method, path, chunks, headers):
+        """Отправка тела кусками по мере их готовности (HTTP/1.1 chunked)"""
+        conn.putrequest(method, path, skip_accept_encoding=True)
+        for name, value in headers.items():
+            conn.putheader(name, value)
+        conn.putheader('Transfer-Encoding', 'chunked')
+        conn.endheaders()
+        while True:
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            except Exception as e:
+                raise BodyError(e)
+            if chunk:
+                conn.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+        conn.send('0\r\n\r\n')
+
+    def _record(self, pool, status, started, reused, reconnects):
+        elapsed = time.time() - started
+        with pool.cond:
+            stats = pool.stats
+            stats['requests'] += 1
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+            stats['reconnects'] += reconnects
+            if reused:
+                stats['reused'] += 1
+            if status is None or status >= 400:
+                stats['errors'] += 1
+        return elapsed
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: host -> статистика запросов (avg_time, reused, connects, ...)
+        """
+        result = {}
+        with self._lock:
+            pools = list(self._pools.items())
+        for (scheme, host, port), pool in pools:
+            with pool.cond:
+                stats = dict(pool.stats)
+            stats['avg_time'] = stats['total_time'] / stats['requests'] if stats['requests'] else 0.0
+            stats['open'] = pool.open_count
+            stats['idle'] = len(pool.idle)
+            result["{}://{}:{}".format(scheme, host, port)] = stats
+        return result
+
+    def close(self):
+        """Закрывает все простаивающие соединения"""
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            self._drop_idle(pool)
+
+
+# Общий транспорт для всех модулей мода
+g_httpTransport = HttpTransport()
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only журнал ключ -> значение с контрольными суммами и компактизацией.
+
+Формат записи: заголовок <op:1><key_len:4><value_len:4><crc32:4> (little-endian),
+затем ключ и значение. CRC считается по op + ключу + значению. Недописанный или
+повреждённый хвост (падение клиента во время записи) отбрасывается при открытии.
+"""
+
+import os
+import struct
+import zlib
+import threading
+
+
+OP_PUT = 1
+OP_DELETE = 2
+
+_HEADER = struct.Struct('<BIII')
+
+
+def _crc(op, key, value):
+    return zlib.crc32(value, zlib.crc32(key, zlib.crc32(chr(op)))) & 0xffffffff
+
+
+def replace_file(src, dst):
+    """Атомарная замена файла (на Windows os.rename не перезаписывает существующий файл)"""
+    try:
+        os.rename(src, dst)
+    except OSError:
+        backup = dst + '.bak'
+        if os.path.exists(backup):
+            os.remove(backup)
+        os.rename(dst, backup)
+        os.rename(src, dst)
+        os.remove(backup)
+
+
+def normalize_arena_id(arena_id, strict=False):
+    """
+    arenaUniqueID приходит как int/long или строка - приводим к числу
+
+    Args:
+        strict (bool): None вместо некорректного ID (не число или вне 1..2^64-1 -
+                       ID хранится в 8-байтовых полях файлов)
+    """
+    try:
+        arena_id = int(arena_id)
+    except (ValueError, TypeError):
+        return None if strict else arena_id
+    if strict and not 0 < arena_id < 2 ** 64:
+        return None
+    return arena_id
+
+
+class JournalStore(object):
+    """
+    Персистентное хранилище ключ -> значение поверх append-only журнала.
+    В памяти хранится только индекс ключ -> (смещение, длина), значения читаются с диска.
+    """
+
+    def __init__(self, path, sync=True, compact_min_bytes=1024 * 1024, compact_ratio=0.5):
+        """
+        Args:
+            path (str): Путь к файлу журнала
+            sync (bool): Вызывать fsync после каждой записи (устойчивость к падениям)
+            compact_min_bytes (int): Минимальный объём мёртвых записей для компактизации
+            compact_ratio (float): Доля мёртвых записей, после которой нужна компактизация
+        """
+        self.path = path
+        self.sync = sync
+        self.compact_min_bytes = compact_min_bytes
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        self._index = {}  # key -> (value_offset, value_len)
+        self._file = None
+        self._size = 0
+        self._dead_bytes = 0
+        self.dropped_bytes = 0  # сколько байт повреждённого хвоста отброшено при открытии
+        self._open()
+
+    def _open(self):
+        journal_dir = os.path.dirname(self.path)
+        if journal_dir and not os.path.exists(journal_dir):
+            os.makedirs(journal_dir)
+
+        # Компактизация могла прерваться - старый журнал остался в .bak
+        backup = self.path + '.bak'
+        if not os.path.exists(self.path) and os.path.exists(backup):
+            os.rename(backup, self.path)
+
+        self._file = self._open_file()
+        self._replay()
+
+    def _open_file(self):
+        # 'r+b' вместо 'a+b': потоковая запись дописывает заголовок в начало записи,
+        # а в режиме append запись всегда идёт в конец файла
+        if not os.path.exists(self.path):
+            open(self.path, 'wb').close()
+        return open(self.path, 'r+b')
+
+    def _replay(self):
+        f = self._file
+        f.seek(0, os.SEEK_END)
+        file_size = f.tell()
+        f.seek(0)
+        offset = 0
+        while offset + _HEADER.size <= file_size:
+            op, key_len, value_len, crc = _HEADER.unpack(f.read(_HEADER.size))
+            record_end = offset + _HEADER.size + key_len + value_len
+            if op not in (OP_PUT, OP_DELETE) or record_end > file_size:
+                break
+            key = f.read(key_len)
+            value = f.read(value_len)
+            if _crc(op, key, value) != crc:
+                break
+
+            previous = self._index.pop(key, None)
+            if previous is not None:
+                self._dead_bytes += _HEADER.size + len(key) + previous[1]
+            if op == OP_PUT:
+                self._index[key] = (offset + _HEADER.size + key_len, value_len)
+            else:
+                self._dead_bytes += record_end - offset
+            offset = record_end
+
+        if offset < file_size:
+            # Обрезаем недописанный/повреждённый хвост, чтобы новые записи шли после целых
+            self.dropped_bytes = file_size - offset
+            f.seek(offset)
+            f.truncate()
+        self._size = offset
+
+    def _append(self, op, key, value):
+        record = _HEADER.pack(op, len(key), len(value), _crc(op, key, value)) + key + value
+        f = self._file
+        f.seek(0, os.SEEK_END)
+        f.write(record)
+        f.flush()
+        if self.sync:
+            os.fsync(f.fileno())
+        offset = self._size
+        self._size += len(record)
+        return offset
+
+    def put(self, key, value):
+        """Записывает значение (bytes) по ключу (bytes)"""
+        with self._lock:
+            offset = self._append(OP_PUT, key, value)
+            previous = self._index.get(key)
+            if previous is not None:
+                self._dead_bytes += _HEADER.size + len(key) + previous[1]
+            self._index[key] = (offset + _HEADER.size + len(key), len(value))
+
+    def put_stream(self, key, produce):
+        """
+        Записывает значение кусками, не собирая его в памяти целиком
+
+        Args:
+            key (str): Ключ
+            produce (callable): produce(write) - вызывает write(data) для каждого куска значения
+        """
+        with self._lock:
+            f = self._file
+            start = self._size
+            f.seek(start)
+            # Заголовок с нулевой длиной/CRC: если клиент упадёт до его исправления,
+            # запись не пройдёт проверку CRC и будет отброшена при открытии
+            f.write(_HEADER.pack(OP_PUT, len(key), 0, 0))
+            f.write(key)
+            state = {'len': 0, 'crc': zlib.crc32(key, zlib.crc32(chr(OP_PUT)))}
+
+            def _write(data):
+                f.write(data)
+                state['len'] += len(data)
+                state['crc'] = zlib.crc32(data, state['crc'])
+
+            try:
+                produce(_write)
+                f.seek(start)
+                f.write(_HEADER.pack(OP_PUT, len(key), state['len'], state['crc'] & 0xffffffff))
+                f.flush()
+                if self.sync:
+                    os.fsync(f.fileno())
+            except Exception:
+                f.seek(start)
+                f.truncate()
+                raise
+
+            previous = self._index.get(key)
+            if previous is not None:
+                self._dead_bytes += _HEADER.size + len(key) + previous[1]
+            self._index[key] = (start + _HEADER.size + len(key), state['len'])
+            self._size = start + _HEADER.size + len(key) + state['len']
+
+    def iter_value(self, key, chunk_size=64 * 1024):
+        """
+        Читает значение кусками через отдельный дескриптор файла (запись и
+        компактизация журнала не мешают чтению). CRC проверяется в конце.
+
+        Returns:
+            iterator: куски значения; None если ключа нет
+
+        Raises:
+            IOError: значение повреждено (при чтении последнего куска)
+        """
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                return None
+            reader = open(self.path, 'rb')
+        return self._iter_chunks(reader, key, location, chunk_size)
+
+    @staticmethod
+    def _iter_chunks(reader, key, location, chunk_size):
+        value_offset, value_len = location
+        try:
+            reader.seek(value_offset - len(key) - _HEADER.size)
+            op, _, _, expected_crc = _HEADER.unpack(reader.read(_HEADER.size))
+            crc = zlib.crc32(reader.read(len(key)), zlib.crc32(chr(op)))
+            remaining = value_len
+            while remaining > 0:
+                chunk = reader.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                crc = zlib.crc32(chunk, crc)
+                if remaining <= 0 and crc & 0xffffffff != expected_crc:
+                    raise IOError("journal record {} is corrupt".format(key))
+                yield chunk
+            if remaining > 0:
+                raise IOError("journal record {} is truncated".format(key))
+        finally:
+            reader.close()
+
+    def delete(self, key):
+        """Удаляет ключ (запись-надгробие в журнал)"""
+        with self._lock:
+            previous = self._index.pop(key, None)
+            if previous is None:
+                return False
+            self._append(OP_DELETE, key, '')
+            self._dead_bytes += 2 * (_HEADER.size + len(key)) + previous[1]
+            return True
+
+    def get(self, key, default=None):
+        """Читает значение с диска (None если ключа нет)"""
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                return default
+            value_offset, value_len = location
+            self._file.seek(value_offset)
+            return self._file.read(value_len)
+
+    def size_of(self, key):
+        """Размер значения в байтах без чтения с диска (0 если ключа нет)"""
+        location = self._index.get(key)
+        return location[1] if location is not None else 0
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def keys(self):
+        with self._lock:
+            return list(self._index.keys())
+
+    def needs_compaction(self):
+        return (self._dead_bytes >= self.compact_min_bytes and
+                self._dead_bytes >= self._size * self.compact_ratio)
+
+    def compact(self):
+        """Переписывает журнал, оставляя только живые записи"""
+        with self._lock:
+            tmp_path = self.path + '.tmp'
+            new_index = {}
+            offset = 0
+            with open(tmp_path, 'wb') as out:
+                for key, (value_offset, value_len) in self._index.items():
+                    self._file.seek(value_offset)
+                    value = self._file.read(value_len)
+                    out.write(_HEADER.pack(OP_PUT, len(key), value_len, _crc(OP_PUT, key, value)))
+                    out.write(key)
+                    out.write(value)
+                    new_index[key] = (offset + _HEADER.size + len(key), value_len)
+                    offset += _HEADER.size + len(key) + value_len
+                out.flush()
+                os.fsync(out.fileno())
+
+            self._file.close()
+            try:
+                replace_file(tmp_path, self.path)
+            except Exception:
+                # На Windows файл, открытый читателем, нельзя переименовать -
+                # оставляем старый журнал, компактизация повторится позже
+                backup = self.path + '.bak'
+                if not os.path.exists(self.path) and os.path.exists(backup):
+                    os.rename(backup, self.path)
+                self._file = self._open_file()
+                os.remove(tmp_path)
+                raise
+            self._file = self._open_file()
+            self._index = new_index
+            self._size = offset
+            self._dead_bytes = 0
+
+    def maybe_compact(self):
+        """Компактизирует журнал, если мёртвых записей слишком много"""
+        with self._lock:
+            if self.needs_compaction():
+                self.compact()
+                return True
+        return False
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
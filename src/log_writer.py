@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Общий лог мода: сообщения с уровнем кладутся в очередь без блокировок
+(deque.append атомарен), фоновый поток пачками пишет их в файл и консоль.
+Файл ротируется по размеру; close() дописывает всё, что осталось в очереди.
+"""
+
+import os
+import sys
+import time
+import datetime
+import threading
+from collections import deque
+
+
+LOG_FILE_PATH = os.path.abspath('./mods/logs/WinChanceMod.log')
+
+# Уровни
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+
+
+def parse_level(name, default=INFO):
+    """'debug'/'info'/'warning'/'error' (или число) -> уровень"""
+    if isinstance(name, (int, long)):
+        return name
+    return LEVEL_NAMES.get(str(name).lower(), default)
+
+
+class LogWriter(object):
+    """Буферизованная запись лога в фоновом потоке"""
+
+    def __init__(self, path=LOG_FILE_PATH, level=INFO, max_bytes=2 * 1024 * 1024, backup_count=3,
+                 flush_interval=0.5, max_queue=20000, echo=True):
+        """
+        Args:
+            path (str): Путь к файлу лога
+            level (int): Минимальный записываемый уровень
+            max_bytes (int): Размер файла, после которого он ротируется (0 - без ротации)
+            backup_count (int): Сколько старых файлов хранить (.1, .2, ...)
+            flush_interval (float): Как часто фоновый поток сбрасывает очередь (сек)
+            max_queue (int): Предел очереди - при переполнении теряются самые старые сообщения
+            echo (bool): Дублировать сообщения в консоль (python.log)
+        """
+        self.path = path
+        self.level = level
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.echo = echo
+        self._queue = deque(maxlen=max_queue)  # (time, message)
+        self._write_lock = threading.Lock()    # только между писателями файла, не вызывающими
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._closed = False
+        self._file = None
+        self._size = 0
+
+    def set_level(self, level):
+        self.level = parse_level(level, self.level)
+
+    def is_enabled(self, level):
+        return level >= self.level
+
+    def write(self, level, msg):
+        """Ставит сообщение в очередь (не блокирует вызывающий поток)"""
+        if level < self.level:
+            return
+        self._queue.append((time.time(), msg))
+        if self._closed:
+            # После close() фонового потока нет - пишем сразу
+            self.flush()
+            return
+        if self._thread is None:
+            self._start()
+        if level >= ERROR:
+            self._wakeup.set()
+
+    def _start(self):
+        with self._write_lock:
+            if self._thread is not None or self._closed:
+                return
+            self._thread = threading.Thread(target=self._writer_loop, name='LogWriter')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _writer_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Записывает всё, что накопилось в очереди"""
+        with self._write_lock:
+            lines = []
+            queue = self._queue
+            while queue:
+                try:
+                    created, msg = queue.popleft()
+                except IndexError:
+                    break
+                timestamp = datetime.datetime.fromtimestamp(created).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+                if isinstance(msg, unicode):
+                    msg = msg.encode('utf-8')
+                lines.append("[{}] {}\n".format(timestamp, msg))
+            if not lines:
+                return
+            if self.echo:
+                for line in lines:
+                    sys.stdout.write(line.split('] ', 1)[1])
+            self._write_lines(''.join(lines))
+
+    def _write_lines(self, data):
+        try:
+            if self._file is None:
+                self._open()
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+            if self.max_bytes and self._size >= self.max_bytes:
+                # Следующая пачка пойдёт в новый файл
+                self._rotate()
+        except Exception as e:
+            sys.stdout.write("[WinChanceMod] Logging error: {}\n".format(e))
+            self._close_file()
+
+    def _open(self):
+        log_dir = os.path.dirname(self.path)
+        if log_dir and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        self._file = open(self.path, 'a')
+        self._file.seek(0, os.SEEK_END)
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        """WinChanceMod.log -> .1 -> .2 ... (самый старый удаляется)"""
+        self._close_file()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = "{}.{}".format(self.path, i)
+            if os.path.exists(src):
+                dst = "{}.{}".format(self.path, i + 1)
+                if os.path.exists(dst):
+                    os.remove(dst)
+                os.rename(src, dst)
+        if self.backup_count > 0:
+            dst = self.path + '.1'
+            if os.path.exists(dst):
+                os.remove(dst)
+            os.rename(self.path, dst)
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
+
+    def close(self, timeout=2.0):
+        """Останавливает фоновый поток и дописывает очередь в файл"""
+        self._closed = True
+        self._wakeup.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+        with self._write_lock:
+            self._close_file()
+
+
+# Общий лог для всех модулей мода
+g_logWriter = LogWriter()
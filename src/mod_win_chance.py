@@ -3,9 +3,9 @@ import json
 import os
 import threading
 import urllib
-import urllib2
 import time
 import datetime
+from collections import OrderedDict
 from helpers import dependency
 from skeletons.gui.app_loader import IAppLoader
 from PlayerEvents import g_playerEvents
@@ -14,6 +14,21 @@ import ArenaType
 from constants import ARENA_BONUS_TYPE
 import Account
 from api_client import BattleAPIClient
+from player_index import PlayerIndex
+from worker_pool import WorkerPool, when_all
+from http_transport import g_httpTransport, HTTPError, TransportError
+from battle_encoder import encode_battle_results_to
+from pending_store import PendingBattleStore
+from pending_scheduler import PendingPollScheduler
+from battle_ledger import BattleLedger
+from battle_archive import BattleArchive
+from battle_context_store import BattleContextStore
+from log_writer import g_logWriter, DEBUG, INFO, ERROR
+from dispatch_queue import g_dispatchQueue, perf_timer
+from background_scheduler import g_backgroundScheduler, NORMAL, IDLE, MODE_HANGAR, MODE_BATTLE
+from battle_tracker import LiveBattleTracker
+from win_models import (create_model, load_model_params, load_vehicle_types, save_vehicle_types,
+                        MODEL_REGISTRY, DEFAULT_MODEL, VEHICLE_CLASSES)
 from helpers import i18n
 
 
@@ -32,104 +47,348 @@ API_CONFIG = {
     'account_id': None
 }
 
-# Logging configuration
-LOG_FILE_PATH = os.path.abspath('./mods/logs/WinChanceMod.log')
+# Опрос результатов pending боёв
+PENDING_CONFIG = {
+    'base_delay': 5.0,  # Задержка после первой неудачной попытки (сек), дальше удваивается
+    'max_delay': 600.0,  # Максимальная задержка между попытками (сек)
+    'max_age': 3 * 24 * 3600,  # Через сколько секунд перестаём ждать результаты боя
+    'max_in_flight': 2,  # Максимум одновременных запросов battleResultsCache.get
+}
 
-def _write_to_logfile(msg):
-    try:
-        log_dir = os.path.dirname(LOG_FILE_PATH)
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
-            
-        import datetime
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-        
-        with open(LOG_FILE_PATH, 'a') as f:
-            f.write("[{}] {}\n".format(timestamp, msg))
-    except Exception as e:
-        print("[WinChanceMod] Logging error: {}".format(e))
+# Локальный архив сырых результатов боёв (battle_archive/)
+ARCHIVE_CONFIG = {
+    'enabled': True,
+    'segment_max_bytes': 8 * 1024 * 1024,  # Размер сегмента, после которого начинается новый
+    'max_total_bytes': 200 * 1024 * 1024,  # Предел размера архива, старые сегменты удаляются
+    'max_age_days': 90,  # Сколько дней хранить результаты
+}
+
+# Очередь задач основного потока: результаты рабочих потоков применяются к GUI
+# и состоянию мода в основном потоке, не дольше frame_budget за кадр
+DISPATCH_CONFIG = {
+    'frame_budget': 0.004,  # Время на задачи за кадр (сек), остаток - в следующем кадре
+    'poll_interval': 0.1,   # Опрос очереди, пока ждём результаты рабочих потоков (сек)
+}
+
+# Фоновая работа на загрузке и в бою (Space 4/5): обработка результатов, сборка
+# мусора и отправка на API откладываются до ангара, запись файлов - ограничивается
+BACKGROUND_CONFIG = {
+    'battle_budget': 0.001,  # Время на задачи за один проход в бою (сек)
+    'battle_interval': 1.0,  # Интервал проходов в бою (сек)
+    'battle_log_flush_interval': 2.0,  # Как часто сбрасывать лог в файл в бою (ошибки - сразу)
+}
+
+# Logging configuration
+LOG_CONFIG = {
+    'level': 'info',  # debug / info / warning / error
+    'max_bytes': 2 * 1024 * 1024,  # Размер WinChanceMod.log, после которого он ротируется
+    'backup_count': 3,  # Сколько старых логов хранить (.1, .2, .3)
+}
+g_logWriter.set_level(LOG_CONFIG['level'])
+g_logWriter.max_bytes = LOG_CONFIG['max_bytes']
+g_logWriter.backup_count = LOG_CONFIG['backup_count']
 
 def log(msg):
-    formatted = "[{}] {}".format(MOD_NAME, msg)
-    print(formatted)
-    _write_to_logfile(formatted)
+    g_logWriter.write(INFO, "[{}] {}".format(MOD_NAME, msg))
 
 def err(msg):
-    formatted = "[{}] ERROR: {}".format(MOD_NAME, msg)
-    print(formatted)
-    _write_to_logfile(formatted)
+    g_logWriter.write(ERROR, "[{}] ERROR: {}".format(MOD_NAME, msg))
 
 def debug(msg):
-    formatted = "[{}] DEBUG: {}".format(MOD_NAME, msg)
-    print(formatted)
-    _write_to_logfile(formatted)
+    if g_logWriter.is_enabled(DEBUG):
+        g_logWriter.write(DEBUG, "[{}] DEBUG: {}".format(MOD_NAME, msg))
+
+g_dispatchQueue.frame_budget = DISPATCH_CONFIG['frame_budget']
+g_dispatchQueue.poll_interval = DISPATCH_CONFIG['poll_interval']
+g_dispatchQueue.log_error = err
+
+g_backgroundScheduler.battle_budget = BACKGROUND_CONFIG['battle_budget']
+g_backgroundScheduler.battle_interval = BACKGROUND_CONFIG['battle_interval']
+g_backgroundScheduler.set_logger(log, err)
+
+
+class RatingCache(object):
+    """LRU-кэш рейтингов игроков с TTL на каждую запись (потокобезопасный)"""
+
+    def __init__(self, max_size=5000, ttl=3600.0):
+        """
+        Args:
+            max_size (int): Максимальное количество игроков в кэше
+            ttl (float): Время жизни записи (сек), после которого она считается устаревшей
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # str(acc_id) -> (data, stored_at)
+        self._lock = threading.Lock()
+
+    def lookup(self, account_ids):
+        """
+        Разбирает список ID на свежие, устаревшие и отсутствующие записи
+
+        Returns:
+            tuple: (fresh, stale, missing) - fresh/stale это dict str(acc_id) -> data,
+                   missing - список ID, которых нет в кэше
+        """
+        fresh = {}
+        stale = {}
+        missing = []
+        now = time.time()
+        with self._lock:
+            for acc_id in account_ids:
+                key = str(acc_id)
+                entry = self._entries.pop(key, None)
+                if entry is None:
+                    missing.append(acc_id)
+                    continue
+                # Переставляем в конец - самая свежая по использованию
+                self._entries[key] = entry
+                data, stored_at = entry
+                if now - stored_at < self.ttl:
+                    fresh[key] = data
+                else:
+                    stale[key] = data
+        return fresh, stale, missing
+
+    def put_many(self, data_by_id, stored_at=None):
+        """Сохраняет рейтинги (dict str(acc_id) -> data) и вытесняет самые старые записи"""
+        if stored_at is None:
+            stored_at = time.time()
+        with self._lock:
+            for key, data in data_by_id.items():
+                key = str(key)
+                self._entries.pop(key, None)
+                self._entries[key] = (data, stored_at)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
 
 
 class StatsFetcher(object):
+    # Лимит WG API на количество account_id в одном запросе
+    MAX_IDS_PER_REQUEST = 100
+
     def __init__(self, app_id):
         self.app_id = app_id
         self.base_url = "https://api.worldoftanks.eu/wot/account/info/"
+        self.cache = RatingCache()
+        self.index = PlayerIndex(log_error=err)
+        self.pool = WorkerPool(4, name='StatsFetcher')
+        self._inflight = {}  # str(acc_id) -> Future запроса, который сейчас загружает этого игрока
+        self._inflight_lock = threading.Lock()
+
+    def _request_ratings(self, account_ids):
+        """
+        Синхронный запрос рейтингов к WG API
+
+        Returns:
+            dict: str(acc_id) -> data для каждого запрошенного ID (None если данных нет)
+        """
+        ids_str = ",".join(map(str, account_ids))
+        url = "{}?application_id={}&account_id={}&fields=global_rating".format(
+            self.base_url, self.app_id, ids_str)
+
+        data = g_httpTransport.request('GET', url, timeout=10).json()
+
+        if data.get('status') != 'ok':
+            err("API Error: {}".format(data.get('error', 'unknown')))
+            return {}
+
+        result_data = data.get('data') or {}
+        # Кэшируем и отсутствующих игроков, чтобы не запрашивать их каждый бой
+        ratings = dict((str(acc_id), result_data.get(str(acc_id))) for acc_id in account_ids)
+        self.cache.put_many(ratings)
+        self.index.store_many(ratings)
+        return ratings
+
+    def _fetch_remote(self, account_ids):
+        """
+        Запрашивает рейтинги частями параллельно в пуле потоков.
+        ID, которые уже загружаются другим запросом, присоединяются к его Future.
+
+        Returns:
+            list: Future, результаты которых покрывают все account_ids
+        """
+        futures = []
+        started = []
+        with self._inflight_lock:
+            new_ids = []
+            for acc_id in account_ids:
+                future = self._inflight.get(str(acc_id))
+                if future is None:
+                    new_ids.append(acc_id)
+                elif future not in futures:
+                    futures.append(future)
+
+            for start in range(0, len(new_ids), self.MAX_IDS_PER_REQUEST):
+                chunk = new_ids[start:start + self.MAX_IDS_PER_REQUEST]
+                keys = [str(acc_id) for acc_id in chunk]
+                future = self.pool.submit(self._request_ratings, chunk)
+                for key in keys:
+                    self._inflight[key] = future
+                futures.append(future)
+                started.append((future, keys))
+
+        # Callback добавляем вне блокировки - он может выполниться сразу
+        for future, keys in started:
+            future.add_done_callback(lambda f, keys=keys: self._release_inflight(f, keys))
+        return futures
+
+    def _release_inflight(self, future, keys):
+        with self._inflight_lock:
+            for key in keys:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+    def _lookup_index(self, account_ids, result_data):
+        """
+        Дополняет result_data рейтингами из локального индекса
+
+        Returns:
+            list: ID, которых нет и в индексе
+        """
+        indexed = self.index.lookup_many(account_ids)
+        if not indexed:
+            return account_ids
+
+        now = time.time()
+        stale_keys = []
+        for key, (data, fetched_at) in indexed.items():
+            result_data[key] = data
+            self.cache.put_many({key: data}, stored_at=fetched_at)
+            if now - fetched_at >= self.cache.ttl:
+                stale_keys.append(key)
+
+        # Данные из индекса показываем сразу, а устаревшие обновляем в фоне
+        if stale_keys:
+            self._refresh_async(stale_keys)
+
+        return [acc_id for acc_id in account_ids if str(acc_id) not in indexed]
+
+    def _refresh_async(self, keys):
+        """Фоновое обновление устаревших записей кэша (без вызова callback)"""
+        def _on_done(future):
+            if future.error() is not None:
+                debug("Background rating refresh failed: {}".format(future.error()))
+
+        for future in self._fetch_remote(keys):
+            future.add_done_callback(_on_done)
+
+    def _log_fetch_error(self, e):
+        if isinstance(e, HTTPError):
+            err("HTTP Error {}: {}".format(e.code, e.reason))
+        elif isinstance(e, TransportError):
+            err("URL Error: {}".format(e.reason))
+        else:
+            err("Fetch Error: {}".format(e))
 
     def fetch_stats(self, account_ids, callback):
-        def _worker():
-            try:
-                if not account_ids:
-                    callback({})
-                    return
-                
-                ids_str = ",".join(map(str, account_ids))
-                url = "{}?application_id={}&account_id={}&fields=global_rating".format(
-                    self.base_url, self.app_id, ids_str)
-                
-                response = urllib2.urlopen(url, timeout=10)
-                data = json.load(response)
-                
-                if data.get('status') == 'ok':
-                    result_data = data.get('data', {})
-                    callback(result_data)
-                else:
-                    err("API Error: {}".format(data.get('error', 'unknown')))
-                    callback({})
-                    
-            except urllib2.HTTPError as e:
-                err("HTTP Error {}: {}".format(e.code, e.reason))
-                callback({})
-            except urllib2.URLError as e:
-                err("URL Error: {}".format(e.reason))
-                callback({})
-            except Exception as e:
-                err("Fetch Error: {}".format(e))
-                import traceback
-                err(traceback.format_exc())
-                callback({})
+        if not account_ids:
+            callback({})
+            return
 
-        t = threading.Thread(target=_worker)
-        t.daemon = True
-        t.start()
+        fresh, stale, missing = self.cache.lookup(account_ids)
+        cached = dict(fresh)
+        cached.update(stale)
+
+        # Устаревшие записи показываем сразу, а обновляем в фоне
+        if stale:
+            self._refresh_async(list(stale.keys()))
+
+        # Весь состав известен - отдаём результат без сетевого запроса
+        if not missing:
+            callback(cached)
+            return
+
+        wanted = set(str(acc_id) for acc_id in account_ids)
+
+        def _on_remote_done(futures):
+            result_data = dict(cached)
+            for future in futures:
+                if future.error() is not None:
+                    self._log_fetch_error(future.error())
+                    continue
+                # Присоединённый запрос мог загружать и чужих игроков
+                for key, data in future.result().items():
+                    if key in wanted:
+                        result_data[key] = data
+            callback(result_data)
+
+        def _resolve_missing():
+            result_data = dict(cached)
+            pending = self._lookup_index(missing, result_data)
+            if not pending:
+                callback(result_data)
+                return
+            cached.update(result_data)
+            when_all(self._fetch_remote(pending), _on_remote_done)
+
+        def _on_resolve_done(future):
+            if future.error() is not None:
+                err("Fetch Error: {}".format(future.error()))
+                callback(cached)
+
+        self.pool.submit(_resolve_missing).add_done_callback(_on_resolve_done)
+
+    def close(self):
+        """Останавливает пул и сохраняет накопленные рейтинги в индекс"""
+        self.pool.stop()
+        self.index.close()
 
 
 class WinChanceCalculator(object):
+    # Активная модель (см. win_models), выбирается в load_model_config()
+    model = create_model(DEFAULT_MODEL)
+
     @staticmethod
-    def calculate_win_chance(team_ratings, enemy_ratings):
-        # Simple logic: Compare average ratings
-        def get_avg(ratings):
-            valid_ratings = [r for r in ratings if r > 0]
-            if not valid_ratings:
-                return 0
-            return sum(valid_ratings) / float(len(valid_ratings))
-
-        avg_team = get_avg(team_ratings)
-        avg_enemy = get_avg(enemy_ratings)
-
-        if avg_team == 0 and avg_enemy == 0:
-            return 50.0
-
-        total = avg_team + avg_enemy
-        if total == 0:
-            return 50.0
-            
-        chance = (avg_team / total) * 100.0
-        return max(0.0, min(100.0, chance))
+    def calculate_live_win_chance(ally, enemy):
+        """Шанс по агрегатам живой техники (TeamAggregate) активной моделью"""
+        return WinChanceCalculator.model.predict(ally, enemy)
+
+
+MOD_CONFIG_PATH = './mods/configs/mod_winchance/mod_winchance.json'
+
+def load_model_config():
+    """Выбирает модель шанса по ключу 'model' в mod_winchance.json (параметры - из model_params.json)"""
+    name = DEFAULT_MODEL
+    try:
+        if os.path.exists(MOD_CONFIG_PATH):
+            with open(MOD_CONFIG_PATH, 'r') as f:
+                name = json.load(f).get('model', DEFAULT_MODEL)
+        if name not in MODEL_REGISTRY:
+            err("Unknown win chance model '{}', using '{}'".format(name, DEFAULT_MODEL))
+            name = DEFAULT_MODEL
+        params = load_model_params().get(name)
+        WinChanceCalculator.model = create_model(name, params)
+        log("Win chance model: {}{}".format(name, " (calibrated)" if params else ""))
+    except Exception as e:
+        err("Error loading model config: {}".format(e))
+
+
+def get_vehicle_tier_class(vehicle_type):
+    """Уровень и класс техники из дескриптора arena.vehicles[...]['vehicleType']"""
+    try:
+        tier = getattr(vehicle_type, 'level', None) or vehicle_type.type.level
+        tags = vehicle_type.type.tags
+        for vehicle_class in VEHICLE_CLASSES:
+            if vehicle_class in tags:
+                return tier, vehicle_class
+        return tier, None
+    except Exception:
+        return None, None
+
+
+def get_type_tier_class(type_descr):
+    """Уровень и класс техники по typeCompDescr из результатов боя"""
+    try:
+        vehicle_type = vehiclesWG.getVehicleType(type_descr)
+        for vehicle_class in VEHICLE_CLASSES:
+            if vehicle_class in vehicle_type.tags:
+                return vehicle_type.level, vehicle_class
+        return vehicle_type.level, None
+    except Exception:
+        return None, None
 
 
 # Main Mod Controller
@@ -146,15 +405,56 @@ class WinChanceMod(object):
         self.ally_wgr = 0.0
         self.enemy_wgr = 0.0
         self.player_vehicle_info = None
-        self.api_initialized = False  # Флаг инициализации API
         self.current_space_id = 0  # Текущий Space ID (3=ангар, 4=загрузка, 5=бой)
         self.pending_loop_active = False  # Флаг активности цикла проверки pending боёв
+        self.live_tracker = None  # Пересчёт шанса по ходу боя (LiveBattleTracker)
+        self.roster_retry_callback = None  # Ожидание создания арены на экране загрузки
+        self.roster_team = None
+        self.roster_accounts = {}
+        self.roster_ratings = {}
+        self.roster_context = {}
+        self.unsaved_context = None  # (arena_id, context), ещё не записанный в журнал
+        self.pending_battles = PendingBattleStore(scheduler=g_backgroundScheduler, log_error=err)  # Бои без полученных результатов
+        self.pending_scheduler = PendingPollScheduler(
+            self.pending_battles,
+            base_delay=PENDING_CONFIG['base_delay'],
+            max_delay=PENDING_CONFIG['max_delay'],
+            max_age=PENDING_CONFIG['max_age'],
+            max_in_flight=PENDING_CONFIG['max_in_flight'])
+        self.processed_battles = BattleLedger(log_error=err)  # Уже обработанные бои (arenaUniqueID)
+        self.battle_contexts = BattleContextStore(log_error=err)  # Контекст боёв (состав, WGR, карта)
+        self.battle_archive = None  # Сжатый архив сырых результатов (BattleArchive)
+        if ARCHIVE_CONFIG['enabled']:
+            try:
+                self.battle_archive = BattleArchive(
+                    segment_max_bytes=ARCHIVE_CONFIG['segment_max_bytes'],
+                    max_total_bytes=ARCHIVE_CONFIG['max_total_bytes'],
+                    max_age_days=ARCHIVE_CONFIG['max_age_days'],
+                    log_error=err)
+                if self.battle_archive.dropped_bytes:
+                    err("Battle archive had {} corrupt trailing bytes, truncated".format(
+                        self.battle_archive.dropped_bytes))
+                self.battle_archive.enforce_retention()
+            except Exception as e:
+                err("Error opening battle archive: {}".format(e))
+                self.battle_archive = None
+        # Уровень и класс техники из архивированных боёв - для калибровки модели вне игры
+        self.vehicle_types = {}
+        if self.battle_archive is not None:
+            try:
+                self.vehicle_types = load_vehicle_types()
+            except Exception as e:
+                err("Error loading vehicle types: {}".format(e))
         
     def start(self):
         if self.started: 
             return
         self.started = True
         log("Started v{}".format(MOD_VERSION))
+        g_dispatchQueue.start()
+        self.hangar_log_flush_interval = g_logWriter.flush_interval
+        g_backgroundScheduler.add_mode_listener(self.on_background_mode)
+        g_backgroundScheduler.start()
         
         self.appLoader.onGUISpaceEntered += self.on_gui_space_entered
         self.appLoader.onGUISpaceLeft += self.on_gui_space_left
@@ -162,53 +462,36 @@ class WinChanceMod(object):
         
 
     # Persistence Logic
-    PENDING_BATTLES_FILE = os.path.abspath('./mods/configs/mod_winchance/pending_battles.json')
-    BATTLE_CONTEXT_DIR = os.path.abspath('./mods/configs/mod_winchance/battle_context/')
-
     def load_battle_context(self, arena_id):
-        """Loads context for specific arena from its file"""
+        """Контекст боя из журнала ({} если его нет)"""
         if not arena_id: return {}
         try:
-            file_path = os.path.join(self.BATTLE_CONTEXT_DIR, '{}.json'.format(arena_id))
-            if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    return json.load(f)
+            return self.battle_contexts.get(arena_id)
         except Exception as e:
             err("Error loading battle context for {}: {}".format(arena_id, e))
         return {}
-            
 
-    def load_pending_battles(self):
-        """Loads list of pending battle arena IDs"""
+    def save_battle_context(self, arena_id, context):
+        if not arena_id: return
         try:
-            if os.path.exists(self.PENDING_BATTLES_FILE):
-                with open(self.PENDING_BATTLES_FILE, 'r') as f:
-                    return json.load(f)
+            self.battle_contexts.put(arena_id, context)
         except Exception as e:
-            err("Error loading pending battles: {}".format(e))
-        return []
+            err("Error saving battle context for {}: {}".format(arena_id, e))
 
-    def save_pending_battles(self, battles):
+    def delete_battle_context(self, arena_id):
         try:
-            config_dir = os.path.dirname(self.PENDING_BATTLES_FILE)
-            if not os.path.exists(config_dir):
-                os.makedirs(config_dir)
-            with open(self.PENDING_BATTLES_FILE, 'w') as f:
-                json.dump(battles, f)
+            self.battle_contexts.delete(arena_id)
         except Exception as e:
-            err("Error saving pending battles: {}".format(e))
+            err("Error deleting battle context for {}: {}".format(arena_id, e))
 
     def add_pending_battle(self, arena_id):
-        battles = self.load_pending_battles()
-        if arena_id not in battles:
-            battles.append(arena_id)
-            self.save_pending_battles(battles)
+        # Проверка в памяти; файл перезаписывается с задержкой и только при изменении
+        if self.pending_battles.add(arena_id):
+            self.pending_scheduler.track(arena_id)
 
     def remove_pending_battle(self, arena_id):
-        battles = self.load_pending_battles()
-        if arena_id in battles:
-            battles.remove(arena_id)
-            self.save_pending_battles(battles)
+        self.pending_battles.remove(arena_id)
+        self.pending_scheduler.forget(arena_id)
 
     def check_pending_battles_loop(self):
         # Не запрашиваем результаты если игрок не в ангаре (Space 3)
@@ -217,38 +500,58 @@ class WinChanceMod(object):
             self.pending_loop_active = False
             return
         
-        battles = self.load_pending_battles()
-        if not battles:
+        if not len(self.pending_battles):
             self.pending_loop_active = False
             return
         
         self.pending_loop_active = True
-        for arena_id in battles:
+        # Запрашиваем только бои, для которых наступило время попытки (с учётом
+        # лимита одновременных запросов), а не весь список каждый раз
+        due, expired = self.pending_scheduler.take_due()
+        for arena_id in expired:
+            log("No battle results for {} after {:.0f}h - giving up".format(
+                arena_id, PENDING_CONFIG['max_age'] / 3600.0))
+            self.remove_pending_battle(arena_id)
+            self.delete_battle_context(arena_id)
+        for arena_id in due:
+            self.pending_battles.note_attempt(arena_id)
             self.request_battle_results(arena_id)
             
         # Schedule next check только если всё ещё в ангаре
         if self.current_space_id == 3:
-            BigWorld.callback(5.0, self.check_pending_battles_loop)
+            delay = self.pending_scheduler.next_delay()
+            BigWorld.callback(min(max(delay if delay is not None else 5.0, 1.0), 30.0),
+                              self.check_pending_battles_loop)
         else:
             self.pending_loop_active = False
 
     def on_gui_space_entered(self, spaceID):
         self.current_space_id = spaceID  # Сохраняем текущий Space ID
+        # Загрузка боя и бой - фоновая работа откладывается/ограничивается
+        g_backgroundScheduler.set_mode(MODE_BATTLE if spaceID in (4, 5) else MODE_HANGAR)
         
         # Space ID 15/3 = Hangar 
         # Note: 3 is Lobby (Hangar). 
         if spaceID == 3:
+            # Бой мог закончиться/отмениться без выхода из Space 5 (загрузка -> ангар)
+            self.stop_live_tracking()
+
             # Check pending battles (только если цикл ещё не активен)
             if not self.pending_loop_active:
                 self.check_pending_battles_loop()
 
-            # Initialize API
-            if not self.api_initialized and self.api_client:
-                self.api_initialized = True
-                if self.api_client.test_connection():
-                    self.api_client.check_and_register_if_needed()
-                else:
-                    self.api_initialized = False 
+            # Удаляем старые контексты боёв и компактизируем журнал (в фоне)
+            g_backgroundScheduler.submit(self.battle_contexts.maintain_async, priority=IDLE,
+                                         key='battle_context_gc')
+
+            # Initialize API: проверка сервера и регистрация в фоне, не блокируя ангар;
+            # до готовности результаты ждут в outbox
+            if self.api_client:
+                self.api_client.start_bootstrap()
+        
+        # Space ID 4 = загрузка боя: состав уже известен - сразу запрашиваем рейтинги
+        if spaceID == 4:
+            self.start_roster_tracking()
         
         # Space ID 5 = Battle
         if spaceID == 5:
@@ -267,8 +570,8 @@ class WinChanceMod(object):
             if self.overlay is None:
                 self.overlay = DraggableWinChanceWindow()
                 self.overlay.create()
-            # Delay slightly to ensure player is ready
-            BigWorld.callback(15.0, self.calculate_battle_stats)
+            # Состав и рейтинги обычно уже загружены на экране загрузки
+            self.start_roster_tracking()
 
     def retry_add_pending_battle(self):
         try:
@@ -281,106 +584,160 @@ class WinChanceMod(object):
     def on_gui_space_left(self, spaceID):
         # Space ID 5 = Battle
         if spaceID == 5:
+            self.stop_live_tracking()
             # Уничтожаем overlay при выходе из боя
             if self.overlay:
                 self.overlay.destroy()
                 self.overlay = None
 
-    def calculate_battle_stats(self):
+    ROSTER_RETRY_DELAY = 0.5  # Повтор, пока арена ещё не создана (сек)
+
+    def start_roster_tracking(self):
+        """
+        Отслеживание состава арены с экрана загрузки (Space 4): рейтинги запрашиваются,
+        как только известны accountDBID, опоздавшие игроки добавляются по событиям арены
+        """
+        if self.roster_retry_callback is not None:
+            BigWorld.cancelCallback(self.roster_retry_callback)
+            self.roster_retry_callback = None
+        if self.current_space_id not in (4, 5):
+            return
         player = BigWorld.player()
-        if not player or not hasattr(player, 'arena'):
-            BigWorld.callback(1.0, self.calculate_battle_stats)
+        arena = getattr(player, 'arena', None) if player else None
+        if arena is None:
+            self.roster_retry_callback = BigWorld.callback(self.ROSTER_RETRY_DELAY, self.on_roster_retry)
             return
-        
-        # Ensure we captured the ID (redundant check)
-        try:
-             if hasattr(player, 'arenaUniqueID'):
-                 self.add_pending_battle(player.arenaUniqueID)
-        except: pass
 
-        arena = player.arena
-        if not arena:
-            return
+        tracker = self.live_tracker
+        if tracker is None or tracker.arena is not arena:
+            self.stop_live_tracking()
+            tracker = LiveBattleTracker(arena, [], on_change=self.on_live_change)
+            self.live_tracker = tracker
+            self.roster_team = player.team
+            self.roster_accounts = {}  # vehicle_id -> accountDBID
+            self.roster_ratings = {}   # accountDBID -> WGR (0 если нет)
+            self.roster_context = {
+                'arena_id': getattr(player, 'arenaUniqueID', None),
+                'map': getattr(getattr(arena, 'arenaType', None), 'geometryName', None) or 'Unknown',
+                'player_vehicle_id': getattr(player, 'playerVehicleID', None),
+                'vehicle': None,
+            }
+            arena.onNewVehicleListReceived += self.on_roster_changed
+            arena.onVehicleAdded += self.on_roster_changed
+            self.on_roster_changed()
+        else:
+            self.push_live_chance(tracker)
 
-        vehicles = arena.vehicles
-        
-        player_team = player.team
-        
-        team_ids = []
-        enemy_ids = []
-        
-        for v_id, v_info in vehicles.items():
+        if self.current_space_id == 5:
+            tracker.attach()
+
+    def on_roster_retry(self):
+        self.roster_retry_callback = None
+        self.start_roster_tracking()
+
+    def on_roster_changed(self, *args):
+        """Список техники получен / техника добавлена - добавляем новых игроков и запрашиваем их рейтинги"""
+        tracker = self.live_tracker
+        if tracker is None:
+            return
+        model = WinChanceCalculator.model
+        new_ids = []
+        for v_id, v_info in tracker.arena.vehicles.items():
             acc_id = v_info.get('accountDBID')
-            if not acc_id: 
+            if not acc_id or v_id in tracker:
                 continue
-         
-            if v_info['team'] == player_team:
-                team_ids.append(acc_id)
-            else:
-                enemy_ids.append(acc_id)
-        
-        all_ids = team_ids + enemy_ids
-        
-        # =======================================================================
-        # ВАЖНО: Захватываем ВСЕ данные ДО асинхронного вызова!
-        # К моменту callback'а игрок может уже быть в другом бою!
-        # =======================================================================
-        current_arena_id = None
-        captured_vehicle_info = None
-        captured_map_name = 'Unknown'
-        
-        try:
-            if player and hasattr(player, 'arenaUniqueID'):
-                current_arena_id = player.arenaUniqueID
-        except Exception as e:
-            err("Failed to capture arena_id: {}".format(e))
-        
-       
-       
-        def on_stats_received(data):
-            team_ratings = []
-            enemy_ratings = []
-            team_wgr_xvm = []
-            enemy_wgr_xvm = []
-            
-            for acc_id in team_ids:
-            #    debug("Team ID: {}".format(acc_id))
-                p_data = data.get(str(acc_id))
-                if p_data:
-                    wgr = p_data.get('global_rating', 0)
-            #    debug("Player WGR: {}".format(wgr))
-                    team_ratings.append(wgr)
-                    if wgr > 0:
-                        team_wgr_xvm.append(wgr)
- 
-            for acc_id in enemy_ids:
-            #    debug("Enemy ID: {}".format(acc_id))
-                p_data = data.get(str(acc_id))
-                if p_data:
-                    wgr = p_data.get('global_rating', 0)
-            #    debug("Enemy WGR: {}".format(wgr))
-                    enemy_ratings.append(wgr)
-                    if wgr > 0:
-                        enemy_wgr_xvm.append(wgr)
-            
-            chance = WinChanceCalculator.calculate_win_chance(team_ratings, enemy_ratings)
-            
-            # Calculate average WGR on XVM scale
-            avg_team_wgr = sum(team_wgr_xvm) / float(len(team_wgr_xvm)) if team_wgr_xvm else 0
-            avg_enemy_wgr = sum(enemy_wgr_xvm) / float(len(enemy_wgr_xvm)) if enemy_wgr_xvm else 0
-            
-           
-            log("Win Chance: {:.1f}% | Team WGR: {:.0f} | Enemy WGR: {:.0f}".format(chance, avg_team_wgr, avg_enemy_wgr))
-            
-            display_text = "Win Chance: {:.1f}%\nTeam WGR: {:.0f} | Enemy WGR: {:.0f}".format(
-                    chance, avg_team_wgr, avg_enemy_wgr)
- 
-            # Используем overlay вместо show_text
-            if self.overlay:
-                self.overlay.update_text(display_text)
-        
-        # ВАЖНО: Вызываем fetch_stats здесь, а не в stop()!
-        self.stats_fetcher.fetch_stats(all_ids, on_stats_received)
+            tier, vehicle_class = get_vehicle_tier_class(v_info.get('vehicleType'))
+            if v_id == self.roster_context['player_vehicle_id']:
+                self.roster_context['vehicle'] = {
+                    'name': getattr(getattr(v_info.get('vehicleType'), 'type', None), 'name', None),
+                    'tier': tier,
+                    'class': vehicle_class,
+                }
+            self.roster_accounts[v_id] = acc_id
+            if acc_id not in self.roster_ratings:
+                self.roster_ratings[acc_id] = 0
+                new_ids.append(acc_id)
+            tracker.add_vehicle(v_id, v_info['team'] == self.roster_team, self.roster_ratings[acc_id],
+                                model.vehicle_weight(tier, vehicle_class), v_info.get('isAlive', True))
+        if new_ids:
+            debug("Roster: {} new players, requesting ratings".format(len(new_ids)))
+            # Callback приходит из потока StatsFetcher - применяем в основном потоке
+            self.stats_fetcher.fetch_stats(new_ids, g_dispatchQueue.wrap(
+                lambda data: self.on_roster_ratings(tracker, data)))
+
+    def on_roster_ratings(self, tracker, data):
+        """Рейтинги части состава загружены - обновляем агрегаты команд без полного пересчёта"""
+        if tracker is not self.live_tracker:
+            return  # игрок уже в другом бою
+        for key, p_data in data.items():
+            wgr = p_data.get('global_rating', 0) if p_data else 0
+            self.roster_ratings[int(key)] = wgr or 0
+        tracker.update_ratings(dict((v_id, self.roster_ratings.get(acc_id, 0))
+                                    for v_id, acc_id in self.roster_accounts.items()))
+
+        chance = WinChanceCalculator.calculate_live_win_chance(tracker.ally, tracker.enemy)
+        avg_team_wgr = tracker.ally.avg_rating()
+        avg_enemy_wgr = tracker.enemy.avg_rating()
+        log("Win Chance: {:.1f}% | Team WGR: {:.0f} | Enemy WGR: {:.0f}".format(chance, avg_team_wgr, avg_enemy_wgr))
+        self.push_live_chance(tracker)
+
+        context = self.roster_context
+        self.win_chance = chance
+        self.ally_wgr = avg_team_wgr
+        self.enemy_wgr = avg_enemy_wgr
+        self.player_vehicle_info = context['vehicle']
+        if context['arena_id']:
+            # Рейтинги приходят частями - в журнал пишется только последний снимок,
+            # в бою с ограничением по времени (NORMAL)
+            self.unsaved_context = (context['arena_id'], {
+                'map': context['map'],
+                'vehicle': context['vehicle'],
+                'allyIds': [acc_id for v_id, acc_id in self.roster_accounts.items()
+                            if tracker.arena.vehicles.get(v_id, {}).get('team') == self.roster_team],
+                'enemyIds': [acc_id for v_id, acc_id in self.roster_accounts.items()
+                             if tracker.arena.vehicles.get(v_id, {}).get('team') != self.roster_team],
+                'allyWgr': avg_team_wgr,
+                'enemyWgr': avg_enemy_wgr,
+                'winChance': chance,
+            })
+            g_backgroundScheduler.submit(self.flush_battle_context, priority=NORMAL, key='battle_context_save')
+
+    def flush_battle_context(self):
+        """Сохраняет последний снимок контекста боя (фоновая задача)"""
+        unsaved, self.unsaved_context = self.unsaved_context, None
+        if unsaved is not None:
+            self.save_battle_context(*unsaved)
+
+    def on_live_change(self, tracker):
+        """Техника уничтожена/обновлена/добавлена - пересчёт шанса из агрегатов (O(1))"""
+        if tracker is not self.live_tracker:
+            return
+        if g_logWriter.is_enabled(DEBUG):
+            debug("Live Win Chance: {:.1f}% (alive {}/{} vs {}/{})".format(
+                WinChanceCalculator.calculate_live_win_chance(tracker.ally, tracker.enemy),
+                tracker.ally.alive, tracker.ally.total, tracker.enemy.alive, tracker.enemy.total))
+        self.push_live_chance(tracker)
+
+    def push_live_chance(self, tracker):
+        """Текущий шанс в overlay (до загрузки рейтингов шанс не показываем)"""
+        if not self.overlay or not (tracker.ally.rated or tracker.enemy.rated):
+            return
+        chance = WinChanceCalculator.calculate_live_win_chance(tracker.ally, tracker.enemy)
+        self.overlay.update(chance=chance, ally_wgr=tracker.ally.avg_rating(),
+                            enemy_wgr=tracker.enemy.avg_rating())
+
+    def stop_live_tracking(self):
+        if self.roster_retry_callback is not None:
+            BigWorld.cancelCallback(self.roster_retry_callback)
+            self.roster_retry_callback = None
+        tracker, self.live_tracker = self.live_tracker, None
+        if tracker is not None:
+            tracker.detach()
+            try:
+                tracker.arena.onNewVehicleListReceived -= self.on_roster_changed
+                tracker.arena.onVehicleAdded -= self.on_roster_changed
+            except Exception:
+                pass
 
     def request_battle_results(self, arena_id):
         """Request battle results from cache/server"""
@@ -401,6 +758,7 @@ class WinChanceMod(object):
         
         # Не запрашиваем если не в ангаре
         if self.current_space_id != 3:
+            self.pending_scheduler.cancel(arena_id)
             return
         
         try:
@@ -419,66 +777,48 @@ class WinChanceMod(object):
                          # Это может быть из-за загрузки боя или других временных проблем
                          err("BattleResultsCache.get failed: {} - will retry later".format(e))
                          # НЕ вызываем remove_pending_battle и delete_battle_context!
+                         self.pending_scheduler.on_result(arena_id, False)
                  else:
                      log("BattleResultsCache is None - will retry later")
+                     self.pending_scheduler.cancel(arena_id)
             else:
                 log("AccountRepository is None - will retry later")
+                self.pending_scheduler.cancel(arena_id)
         except Exception as e:
             err("Error requesting battle results: {} - will retry later".format(e))
+            self.pending_scheduler.on_result(arena_id, False)
             import traceback
             err(traceback.format_exc())
 
     def save_raw_battle_results(self, arena_id, results):
-        """Сохраняет сырые результаты боя из callback в JSON для анализа"""
+        """
+        Сохраняет сырые результаты боя в локальный архив и ставит их в отправку на API
+        
+        Returns:
+            bool: True если результаты поставлены в отправку на API
+        """
         try:
-        #    save_dir = os.path.abspath('./mods/configs/mod_winchance/raw_battle_results/')
-        #    if not os.path.exists(save_dir):
-        #        os.makedirs(save_dir)
-            
-        #    file_path = os.path.join(save_dir, '{}.json'.format(arena_id))
-            
-            # Конвертируем данные в JSON-совместимый формат
-            # (некоторые значения могут быть не сериализуемы)
-            def make_serializable(obj, is_key=False):
-                if isinstance(obj, dict):
-                    return {make_serializable(k, is_key=True): make_serializable(v) for k, v in obj.items()}
-                elif is_key:
-                    # Ключи словаря должны быть строками
-                    if isinstance(obj, (list, tuple)):
-                        return str(obj)
-                    return str(obj)
-                elif isinstance(obj, (list, tuple)):
-                    return [make_serializable(item) for item in obj]
-                elif isinstance(obj, (int, float, bool, type(None))):
-                    return obj
-                elif isinstance(obj, bytes):
-                    # Python 2: str это bytes
-                    try:
-                        return obj.decode('utf-8')
-                    except UnicodeDecodeError:
-                        try:
-                            return obj.decode('cp1251')
-                        except UnicodeDecodeError:
-                            return obj.decode('latin-1')
-                elif isinstance(obj, (frozenset, set)):
-                    return [make_serializable(item) for item in obj]
-                else:
-                    try:
-                        return str(obj).decode('utf-8')
-                    except:
-                        return repr(obj)
+            # Результаты кодируются в UTF-8 JSON за один проход прямо в outbox кусками,
+            # без полной копии JSON в памяти (несериализуемые значения - строками, как раньше)
+            def raw_json(write):
+                encode_battle_results_to(results, write)
             
-            serializable_results = make_serializable(results)
-            
-        #    with open(file_path, 'w') as f:
-        #        json.dump(serializable_results, f, indent=2, ensure_ascii=False)
+            # Сохраняем сжатую копию в локальный архив; outbox затем получает JSON
+            # распаковкой из архива, без повторного обхода результатов
+            archive = self.battle_archive
+            if archive is not None:
+                try:
+                    if archive.append(arena_id, raw_json) or arena_id in archive:
+                        def archived_json(write):
+                            for chunk in archive.iter_json(arena_id):
+                                write(chunk)
+                        raw_json = archived_json
+                except Exception as e:
+                    err("Error archiving battle results for {}: {}".format(arena_id, e))
             
             # Отправляем сырые данные на API
             if self.api_client:
                 try:
-                    # Сериализуем в JSON строку для отправки
-                    raw_json = json.dumps(serializable_results, ensure_ascii=True)
-                    
                     # Получаем account_id из результатов боя (несколько источников)
                     account_id = 0
                     
@@ -521,13 +861,14 @@ class WinChanceMod(object):
                     else:
                         battle_time = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
                     
-                    self.api_client.send_raw_battle_result(
+                    if self.api_client.send_raw_battle_result(
                         battle_id=int(arena_id) if arena_id else 0,
                         account_id=account_id,
                         battle_time=battle_time,
                         raw_json=raw_json
-                    )
-                    log("Raw battle results sent to API")
+                    ):
+                        log("Raw battle results queued for API upload")
+                        return True
                 except Exception as e:
                     err("Error sending raw results to API: {}".format(e))
                     
@@ -535,6 +876,7 @@ class WinChanceMod(object):
             err("Error saving raw battle results: {}".format(e))
             import traceback
             err(traceback.format_exc())
+        return False
 
     def on_battle_results_callback(self, responseCode, results, arena_id):
         """Callback for battle results request - обрабатывает результаты независимо от текущего Space"""
@@ -542,16 +884,18 @@ class WinChanceMod(object):
             # Check if results are valid
             if results and (responseCode == 0 or responseCode == 1): # Accept success codes
                 log("Battle results retrieved via callback for {} (space={})".format(arena_id, self.current_space_id))
-                self.remove_pending_battle(arena_id)
+                # Из pending бой удаляется только после записи результатов на диск
+                self.pending_scheduler.forget(arena_id)
                 self.on_hangar_battle_results(0, results)
             elif results:
                 # Even if code is weird, if we have results, take them.
                 log("Battle results retrieved (Code {}) for {} (space={})".format(responseCode, arena_id, self.current_space_id))
-                self.remove_pending_battle(arena_id)
+                self.pending_scheduler.forget(arena_id)
                 self.on_hangar_battle_results(0, results)
             else:
-                # No results - will retry on next poll
+                # No results - will retry later (с увеличением задержки)
                 log("No results yet for {} (Code: {}) - will retry".format(arena_id, responseCode))
+                self.pending_scheduler.on_result(arena_id, False)
                  
         except Exception as e:
             err("Error in on_battle_results_callback: {}".format(e))
@@ -564,12 +908,65 @@ class WinChanceMod(object):
         try:
              arena_id = results.get('arenaUniqueID')
              log("Received onBattleResultsReceived for arena {} (space={})".format(arena_id, self.current_space_id))
-             # Обрабатываем результаты независимо от Space - даже если мы уже в новом бою
-             self.remove_pending_battle(arena_id)
+             # Обрабатываем результаты независимо от Space - даже если мы уже в новом бою;
+             # из pending бой удаляется только после записи результатов на диск
+             self.pending_scheduler.forget(arena_id)
              self.on_hangar_battle_results(0, results)
         except Exception as e:
             err("Error in on_battle_results_received: {}".format(e))
 
+    def process_battle_results(self, arena_id, results):
+        """
+        Архивирует результаты боя и ставит их в отправку (фоновая задача).
+        Бой остаётся в pending, пока результаты не записаны на диск (outbox или
+        архив): при падении клиента до этого они запросятся снова в следующей сессии.
+        """
+        if arena_id in self.processed_battles:
+            self.remove_pending_battle(arena_id)
+            return
+        saved = self.save_raw_battle_results(arena_id, results)
+        if saved:
+            self.processed_battles.add(arena_id)
+            self.record_vehicle_types(results)
+            # Контекст больше не нужен - удалится сборкой мусора через processed_ttl
+            self.battle_contexts.mark_processed(arena_id)
+        if saved or (self.battle_archive is not None and arena_id in self.battle_archive):
+            self.remove_pending_battle(arena_id)
+        elif arena_id in self.pending_battles:
+            err("Battle {} results were not saved - will request them again next session".format(arena_id))
+
+    def record_vehicle_types(self, results):
+        """Дополняет таблицу typeCompDescr -> (уровень, класс) техникой из результатов боя"""
+        if self.battle_archive is None:
+            return
+        added = 0
+        for entries in (results.get('vehicles') or {}).values():
+            for entry in (entries if isinstance(entries, (list, tuple)) else (entries,)):
+                type_descr = entry.get('typeCompDescr') if isinstance(entry, dict) else None
+                if not type_descr or type_descr in self.vehicle_types:
+                    continue
+                tier, vehicle_class = get_type_tier_class(type_descr)
+                if tier:
+                    self.vehicle_types[type_descr] = (tier, vehicle_class)
+                    added += 1
+        if added:
+            g_backgroundScheduler.submit(self.save_vehicle_types, priority=IDLE, key='vehicle_types_save')
+
+    def save_vehicle_types(self):
+        try:
+            # Копия: основной поток может дополнять таблицу во время записи
+            save_vehicle_types(dict(self.vehicle_types))
+        except Exception as e:
+            err("Error saving vehicle types: {}".format(e))
+
+    def on_background_mode(self, mode):
+        """В бою отправка на API на паузе, лог пишется в файл реже"""
+        in_battle = mode == MODE_BATTLE
+        g_logWriter.flush_interval = (BACKGROUND_CONFIG['battle_log_flush_interval'] if in_battle
+                                      else self.hangar_log_flush_interval)
+        if self.api_client:
+            self.api_client.set_uploads_paused(in_battle)
+
     def on_hangar_battle_results(self, responseCode, results):
         """Process battle results (from cache or event)"""
         try:
@@ -578,11 +975,19 @@ class WinChanceMod(object):
             if not results:
                 return
 
-            # Сохраняем сырые результаты боя в JSON для анализа
+            # Один бой может прийти и событием, и через battleResultsCache -
+            # проверяем до кодирования, чтобы не обрабатывать и не отправлять его дважды
             arena_id = results.get('arenaUniqueID')
-            self.save_raw_battle_results(arena_id, results)
-
-
+            if arena_id in self.processed_battles:
+                log("Battle {} already processed - skipping".format(arena_id))
+                self.remove_pending_battle(arena_id)
+                return
+            
+            # Кодирование, сжатие и запись результатов - в ангаре; в бою ждут возвращения
+            queued = g_backgroundScheduler.submit(self.process_battle_results, (arena_id, results),
+                                                  priority=IDLE, key=('battle_results', arena_id))
+            if queued and not g_backgroundScheduler.allows(IDLE):
+                log("Battle {} results deferred until hangar".format(arena_id))
                 
         except Exception as e:
             err("Error in on_hangar_battle_results: {}".format(e))
@@ -620,6 +1025,8 @@ class WinChanceMod(object):
         except:
             pass
         
+        self.stop_live_tracking()
+        
         # Уничтожаем overlay
         if self.overlay:
             self.overlay.destroy()
@@ -632,21 +1039,64 @@ class WinChanceMod(object):
         try:
             log("Shutting down mod...")
             self.stop()
+            # Отложенные в бою задачи (результаты боёв) выполняем до остановки клиента API
+            g_backgroundScheduler.flush()
+            g_backgroundScheduler.stop()
+            for name, stats in sorted(g_backgroundScheduler.get_stats().items()):
+                if stats['run'] or stats['deferred']:
+                    log("Background {}: {} tasks run, {} deferred in battle (max wait {:.0f}s, total {:.0f}s)".format(
+                        name, stats['run'], stats['deferred'], stats['max_wait'], stats['deferred_time']))
+            self.pending_battles.flush()
+            self.processed_battles.close()
+            if self.battle_archive:
+                self.battle_archive.close()
+            self.battle_contexts.close()
+            self.stats_fetcher.close()
+            if self.api_client:
+                self.api_client.fini()
+            g_dispatchQueue.stop()
+            stats = g_dispatchQueue.get_stats()
+            log("Main thread queue: {} tasks in {} frames, {} carried over, max queue {}, max {:.1f} ms/frame".format(
+                stats['tasks'], stats['frames'], stats['carried_over'], stats['max_queue'],
+                stats['max_frame_time'] * 1000))
+            for host, stats in g_httpTransport.get_stats().items():
+                log("HTTP {}: {} requests, avg {:.0f} ms, {} reused, {} connects, {} errors".format(
+                    host, stats['requests'], stats['avg_time'] * 1000, stats['reused'],
+                    stats['connects'], stats['errors']))
+            g_httpTransport.close()
             log("Mod shut down successfully")
         except Exception as e:
             err("Error in fini: {}".format(e))
+        # Дописываем в файл всё, что осталось в очереди лога
+        g_logWriter.close()
             
 #        self.stats_fetcher.fetch_stats(all_ids, on_stats_received)
 
 class DraggableWinChanceWindow(object):
     """Перетаскиваемое окно для отображения Win Chance"""
     
+    DRAG_POLL_INTERVAL = 0.05  # Опрос курсора, пока зажат Ctrl (сек)
+    IDLE_POLL_INTERVAL = 0.25  # Опрос Ctrl, если события клавиатуры недоступны (сек)
+    SAVE_DELAY = 2.0  # Задержка сохранения позиции после перетаскивания (сек)
+    
     def __init__(self):
         self.components = []
         self.isDragging = False
         self.lastMousePos = (0, 0)
         self.mouseHandlerActive = False
+        self.inputEventsActive = False
         self.callbackID = None
+        self.saveCallbackID = None
+        # Затраты обработчика ввода (для проверки влияния на кадр)
+        self.inputStats = {'polls': 0, 'events': 0, 'total_time': 0.0, 'max_time': 0.0}
+        
+        # Компоненты создаются при первом apply() и дальше переиспользуются
+        self.chanceComp = None
+        self.wgrComp = None
+        self._chanceColour = None
+        self._state = {'chance': 50.0, 'ally_wgr': 0.0, 'enemy_wgr': 0.0}
+        self._pending = {}  # изменения, ещё не применённые к компонентам
+        self._applyCallbackID = None
         
         # Дефолтная позиция (правый верхний угол)
         self.posX = 0.75
@@ -657,7 +1107,7 @@ class DraggableWinChanceWindow(object):
     def loadConfig(self):
         """Загружает позицию из конфига"""
         try:
-            config_path = './mods/configs/mod_winchance/mod_winchance.json'
+            config_path = MOD_CONFIG_PATH
             if os.path.exists(config_path):
                 import json
                 with open(config_path, 'r') as f:
@@ -677,15 +1127,21 @@ class DraggableWinChanceWindow(object):
         """Сохраняет позицию в конфиг"""
         try:
             import json
-            config_path = './mods/configs/mod_winchance/mod_winchance.json'
+            config_path = MOD_CONFIG_PATH
             config_dir = os.path.dirname(config_path)
             if not os.path.exists(config_dir):
                 os.makedirs(config_dir)
             
-            config = {
-                'posX': self.posX,
-                'posY': self.posY
-            }
+            # Остальные ключи (например, 'model') сохраняем как есть
+            config = {}
+            if os.path.exists(config_path):
+                try:
+                    with open(config_path, 'r') as f:
+                        config = json.load(f)
+                except ValueError:
+                    config = {}
+            config['posX'] = self.posX
+            config['posY'] = self.posY
             
             with open(config_path, 'w') as f:
                 json.dump(config, f, indent=2)
@@ -700,100 +1156,188 @@ class DraggableWinChanceWindow(object):
             err("Error creating window: {}".format(e))
             return False
     
-    def update_text(self, text):
-        """Обновляет текст окна"""
+    def update(self, chance=None, ally_wgr=None, enemy_wgr=None):
+        """
+        Обновляет значения в окне. Несколько вызовов за кадр применяются одним
+        apply() в следующем тике; компоненты создаются один раз и дальше только
+        меняют текст и цвет.
+        
+        Args:
+            chance (float): Шанс победы (%)
+            ally_wgr (float): Средний WGR союзников
+            enemy_wgr (float): Средний WGR противников
+        """
+        if chance is not None:
+            self._pending['chance'] = chance
+        if ally_wgr is not None:
+            self._pending['ally_wgr'] = ally_wgr
+        if enemy_wgr is not None:
+            self._pending['enemy_wgr'] = enemy_wgr
+        if self._pending and self._applyCallbackID is None:
+            self._applyCallbackID = BigWorld.callback(0.0, self._onApplyTimer)
+    
+    def _onApplyTimer(self):
+        self._applyCallbackID = None
+        self.apply()
+    
+    def apply(self):
+        """Применяет накопленные изменения к GUI компонентам"""
+        if self._applyCallbackID is not None:
+            try:
+                BigWorld.cancelCallback(self._applyCallbackID)
+            except:
+                pass
+            self._applyCallbackID = None
+        if not self._pending:
+            return
         try:
-            self.createWindow(text)
+            self._state.update(self._pending)
+            self._pending = {}
+            if not self.components and not self.createComponents():
+                return
+            
+            state = self._state
+            chance_text = "Win Chance: {:.1f}%".format(state['chance'])
+            if chance_text != self.chanceComp.text:
+                self.chanceComp.text = chance_text
+                color = self.getChanceColour(state['chance'])
+                if color != self._chanceColour:
+                    self.chanceComp.colour = self._chanceColour = color
+            
+            wgr_text = "Team WGR: {:.0f} | Enemy WGR: {:.0f}".format(state['ally_wgr'], state['enemy_wgr'])
+            if wgr_text != self.wgrComp.text:
+                self.wgrComp.text = wgr_text
         except Exception as e:
-            err("Update text error: {}".format(e))
+            err("Overlay update error: {}".format(e))
             import traceback
             err(traceback.format_exc())
     
-    def createWindow(self, message):
-        """Создает/обновляет окно с текстом"""
+    @staticmethod
+    def getChanceColour(chance):
+        """Цвет на основе шанса"""
+        if chance >= 60:
+            return (50, 205, 50, 255)  # Зеленый
+        elif chance >= 45:
+            return (255, 215, 0, 255)  # Желтый/золотой
+        return (220, 20, 60, 255)  # Красный
+    
+    def createComponents(self):
+        """Создает компоненты окна (один раз)"""
         try:
-            self.destroyWindow()
-            
             import GUI
             
-            # Парсим сообщение: "Win Chance: 56.5%\nTeam WGR: 5684 | Enemy WGR: 5160"
-            lines = message.split('\n')
-            
-            if len(lines) < 2:
-                return
-            
             # === Win Chance (первая строка) ===
-            chance_line = lines[0]  # "Win Chance: 56.5%"
-            
-            # Извлекаем процент - берем только до '%'
-            try:
-                # Разбиваем по ':' и берем вторую часть, затем по '%' и берем первую
-                parts = chance_line.split(':')
-                if len(parts) >= 2:
-                    percent_part = parts[1].split('%')[0].strip()
-                    chance_value = float(percent_part)
-                else:
-                    chance_value = 50.0
-            except Exception as e:
-                err("Error parsing chance value from '{}': {}".format(chance_line, e))
-                import traceback
-                err(traceback.format_exc())
-                chance_value = 50.0
-            
-            # Цвет на основе шанса
-            if chance_value >= 60:
-                color = (50, 205, 50, 255)  # Зеленый
-            elif chance_value >= 45:
-                color = (255, 215, 0, 255)  # Желтый/золотой
-            else:
-                color = (220, 20, 60, 255)  # Красный
-            
-            chanceComp = GUI.Text(chance_line)
-            chanceComp.font = "default_medium.font"
-            chanceComp.colour = color
-            chanceComp.position = (self.posX, self.posY, 0.95)
-            GUI.addRoot(chanceComp)
-            self.components.append(('text', chanceComp, 0))
+            self.chanceComp = GUI.Text('')
+            self.chanceComp.font = "default_medium.font"
+            self.chanceComp.position = (self.posX, self.posY, 0.95)
+            GUI.addRoot(self.chanceComp)
+            self.components.append(('text', self.chanceComp, 0))
+            self._chanceColour = None
             
             # === WGR (вторая строка) ===
-            if len(lines) >= 2:
-                wgr_line = lines[1]  # "Team WGR: 5684 | Enemy WGR: 5160"
-                
-                wgrText = GUI.Text(wgr_line)
-                wgrText.font = "default_small.font"
-                wgrText.colour = (255, 255, 255, 255)
-                wgrText.position = (self.posX, self.posY + 0.025, 0.95)
-                GUI.addRoot(wgrText)
-                self.components.append(('text', wgrText, 0.025))
+            self.wgrComp = GUI.Text('')
+            self.wgrComp.font = "default_small.font"
+            self.wgrComp.colour = (255, 255, 255, 255)
+            self.wgrComp.position = (self.posX, self.posY + 0.025, 0.95)
+            GUI.addRoot(self.wgrComp)
+            self.components.append(('text', self.wgrComp, 0.025))
             
             self.startMouseHandler()
-            
+            return True
         except Exception as e:
             err("Error creating window: {}".format(e))
+            self.destroyWindow()
+            return False
     
     def destroyWindow(self):
         """Уничтожает окно"""
         try:
             import GUI
             self.stopMouseHandler()
+            if self._applyCallbackID is not None:
+                BigWorld.cancelCallback(self._applyCallbackID)
+                self._applyCallbackID = None
             for _, component, _ in self.components:
                 try:
                     GUI.delRoot(component)
                 except:
                     pass
             self.components = []
+            self.chanceComp = None
+            self.wgrComp = None
         except:
             pass
     
     def startMouseHandler(self):
-        """Запускает обработчик мыши для перетаскивания"""
-        if not self.mouseHandlerActive:
-            self.mouseHandlerActive = True
-            self.checkMouseInput()
+        """
+        Запускает обработчик перетаскивания (Ctrl + ЛКМ). Курсор опрашивается
+        только пока зажат Ctrl: нажатие узнаём из событий клавиатуры
+        gui.InputHandler, а если они недоступны - редким опросом клавиши Ctrl.
+        """
+        if self.mouseHandlerActive:
+            return
+        self.mouseHandlerActive = True
+        self.inputEventsActive = self.subscribeInputEvents()
+        if not self.inputEventsActive:
+            self.schedulePoll(self.IDLE_POLL_INTERVAL)
     
     def stopMouseHandler(self):
         """Останавливает обработчик мыши"""
         self.mouseHandlerActive = False
+        if self.inputEventsActive:
+            self.unsubscribeInputEvents()
+            self.inputEventsActive = False
+        self.cancelPoll()
+        if self.isDragging:
+            self.isDragging = False
+            self.scheduleSaveConfig()
+    
+    def subscribeInputEvents(self):
+        try:
+            from gui import InputHandler
+            InputHandler.g_instance.onKeyDown += self.onKeyEvent
+            InputHandler.g_instance.onKeyUp += self.onKeyEvent
+            return True
+        except Exception as e:
+            debug("InputHandler events unavailable, using polling: {}".format(e))
+            return False
+    
+    def unsubscribeInputEvents(self):
+        try:
+            from gui import InputHandler
+            InputHandler.g_instance.onKeyDown -= self.onKeyEvent
+            InputHandler.g_instance.onKeyUp -= self.onKeyEvent
+        except:
+            pass
+    
+    def onKeyEvent(self, event):
+        """Нажатие/отпускание Ctrl включает/выключает опрос курсора"""
+        try:
+            import Keys
+            if event.key not in (Keys.KEY_LCONTROL, Keys.KEY_RCONTROL):
+                return
+            self.inputStats['events'] += 1
+            if event.isKeyDown():
+                if self.callbackID is None:
+                    self.checkMouseInput()
+            elif not self.isCtrlDown():
+                self.cancelPoll()
+                if self.isDragging:
+                    self.isDragging = False
+                    self.scheduleSaveConfig()
+        except Exception as e:
+            debug("Key event error: {}".format(e))
+    
+    @staticmethod
+    def isCtrlDown():
+        import Keys
+        return BigWorld.isKeyDown(Keys.KEY_LCONTROL) or BigWorld.isKeyDown(Keys.KEY_RCONTROL)
+    
+    def schedulePoll(self, delay):
+        self.cancelPoll()
+        self.callbackID = BigWorld.callback(delay, self.checkMouseInput)
+    
+    def cancelPoll(self):
         if self.callbackID is not None:
             try:
                 BigWorld.cancelCallback(self.callbackID)
@@ -803,22 +1347,24 @@ class DraggableWinChanceWindow(object):
     
     def checkMouseInput(self):
         """Проверяет ввод мыши для перетаскивания (Ctrl + ЛКМ)"""
+        self.callbackID = None
         if not self.mouseHandlerActive:
             return
         
+        started = perf_timer()
+        ctrlPressed = False
         try:
             import GUI
             import Keys
             
-            cursor = GUI.mcursor()
-            if cursor:
-                mouseX, mouseY = cursor.position[0], cursor.position[1]
-                
-                # Проверяем Ctrl + ЛКМ
-                ctrlPressed = BigWorld.isKeyDown(Keys.KEY_LCONTROL) or BigWorld.isKeyDown(Keys.KEY_RCONTROL)
-                leftMouseDown = BigWorld.isKeyDown(Keys.KEY_LEFTMOUSE)
-                
-                if ctrlPressed and leftMouseDown:
+            # Проверяем Ctrl + ЛКМ
+            ctrlPressed = self.isCtrlDown()
+            leftMouseDown = ctrlPressed and BigWorld.isKeyDown(Keys.KEY_LEFTMOUSE)
+            
+            if leftMouseDown:
+                cursor = GUI.mcursor()
+                if cursor:
+                    mouseX, mouseY = cursor.position[0], cursor.position[1]
                     if not self.isDragging:
                         self.isDragging = True
                         self.lastMousePos = (mouseX, mouseY)
@@ -826,19 +1372,59 @@ class DraggableWinChanceWindow(object):
                         deltaX = mouseX - self.lastMousePos[0]
                         deltaY = mouseY - self.lastMousePos[1]
                         
-                        self.posX += deltaX
-                        self.posY += deltaY
-                        self.updateWindowPosition()
+                        if deltaX or deltaY:
+                            self.posX += deltaX
+                            self.posY += deltaY
+                            self.updateWindowPosition()
                         self.lastMousePos = (mouseX, mouseY)
-                else:
-                    if self.isDragging:
-                        self.isDragging = False
-                        self.saveConfig()
+            elif self.isDragging:
+                self.isDragging = False
+                self.scheduleSaveConfig()
         except Exception as e:
             debug("Mouse error: {}".format(e))
         
-        # Следующая проверка
-        self.callbackID = BigWorld.callback(0.05, self.checkMouseInput)
+        elapsed = perf_timer() - started
+        stats = self.inputStats
+        stats['polls'] += 1
+        stats['total_time'] += elapsed
+        stats['max_time'] = max(stats['max_time'], elapsed)
+        
+        # Следующая проверка: часто - пока зажат Ctrl; без него при событиях
+        # клавиатуры опрос не нужен, иначе - редкий опрос клавиши Ctrl
+        if ctrlPressed:
+            self.schedulePoll(self.DRAG_POLL_INTERVAL)
+        elif not self.inputEventsActive:
+            self.schedulePoll(self.IDLE_POLL_INTERVAL)
+    
+    def scheduleSaveConfig(self):
+        """Сохраняет позицию с задержкой (серия перетаскиваний - одна запись)"""
+        if self.saveCallbackID is not None:
+            try:
+                BigWorld.cancelCallback(self.saveCallbackID)
+            except:
+                pass
+        self.saveCallbackID = BigWorld.callback(self.SAVE_DELAY, self.onSaveTimer)
+    
+    def onSaveTimer(self):
+        self.saveCallbackID = None
+        self.saveConfig()
+    
+    def flushConfig(self):
+        """Записывает отложенное сохранение позиции сразу"""
+        if self.saveCallbackID is not None:
+            try:
+                BigWorld.cancelCallback(self.saveCallbackID)
+            except:
+                pass
+            self.saveCallbackID = None
+            self.saveConfig()
+    
+    def logInputStats(self):
+        stats = self.inputStats
+        if stats['polls']:
+            log("Overlay input: {} polls, {} key events, avg {:.1f} us, max {:.1f} us per poll".format(
+                stats['polls'], stats['events'], stats['total_time'] / stats['polls'] * 1e6,
+                stats['max_time'] * 1e6))
     
     def updateWindowPosition(self):
         """Обновляет позицию всех компонентов"""
@@ -856,6 +1442,8 @@ class DraggableWinChanceWindow(object):
         """Уничтожает окно"""
         try:
             self.destroyWindow()
+            self.flushConfig()
+            self.logInputStats()
         except Exception as e:
             err("Error destroying window: {}".format(e))
     
@@ -863,6 +1451,8 @@ class DraggableWinChanceWindow(object):
 g_winChanceMod = WinChanceMod()
 
 def init():
+    load_model_config()
+    
     # Инициализация API клиента на уровне глобального объекта
     if API_CONFIG['enabled']:
         g_winChanceMod.api_client = BattleAPIClient(
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Планировщик опроса результатов pending боёв: у каждого боя своё время следующей
+попытки (экспоненциальная задержка с разбросом), ограничение одновременных
+запросов battleResultsCache.get и отказ от слишком старых боёв.
+"""
+
+import time
+import heapq
+import random
+
+from journal_store import normalize_arena_id
+
+
+class PendingPollScheduler(object):
+    """Расписание запросов результатов; работает в основном потоке игры"""
+
+    def __init__(self, store, base_delay=5.0, max_delay=600.0, max_age=3 * 24 * 3600,
+                 max_in_flight=2, request_timeout=60.0):
+        """
+        Args:
+            store (PendingBattleStore): Список pending боёв (first_seen берётся из него)
+            base_delay (float): Задержка после первой неудачной попытки (сек)
+            max_delay (float): Максимальная задержка между попытками (сек)
+            max_age (float): Через сколько секунд после боя перестаём ждать результаты
+            max_in_flight (int): Максимум одновременных запросов результатов
+            request_timeout (float): Через сколько секунд запрос без ответа считается неудачным
+        """
+        self.store = store
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_age = max_age
+        self.max_in_flight = max_in_flight
+        self.request_timeout = request_timeout
+        self._next_attempt = {}  # arena_id -> время следующей попытки
+        self._attempts = {}      # arena_id -> неудачных попыток в этой сессии
+        self._in_flight = {}     # arena_id -> время запроса
+        self._heap = []          # (время, arena_id); устаревшие записи пропускаются
+        for arena_id in store.ids():
+            self.track(arena_id)
+
+    def track(self, arena_id, delay=0.0):
+        """Добавляет бой в расписание (первая попытка через delay секунд)"""
+        arena_id = normalize_arena_id(arena_id)
+        if arena_id in self._next_attempt or arena_id in self._in_flight:
+            return
+        self._schedule(arena_id, time.time() + delay)
+
+    def forget(self, arena_id):
+        """Убирает бой из расписания (результаты получены или бой удалён)"""
+        arena_id = normalize_arena_id(arena_id)
+        self._next_attempt.pop(arena_id, None)
+        self._attempts.pop(arena_id, None)
+        self._in_flight.pop(arena_id, None)
+
+    def _schedule(self, arena_id, at):
+        self._next_attempt[arena_id] = at
+        heapq.heappush(self._heap, (at, arena_id))
+
+    def _backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    def take_due(self, now=None):
+        """
+        Выбирает бои, которые пора запросить (не больше свободных слотов)
+
+        Returns:
+            tuple: (due, expired) - запросить сейчас / больше не ждать
+        """
+        if now is None:
+            now = time.time()
+        for arena_id, started in self._in_flight.items():
+            if now - started > self.request_timeout:
+                self.on_result(arena_id, False, now)
+
+        due = []
+        expired = []
+        free = self.max_in_flight - len(self._in_flight)
+        while self._heap and self._heap[0][0] <= now and free > 0:
+            at, arena_id = heapq.heappop(self._heap)
+            if self._next_attempt.get(arena_id) != at:
+                continue  # перепланирован или удалён
+            del self._next_attempt[arena_id]
+            meta = self.store.get(arena_id)
+            if meta is None:
+                self._attempts.pop(arena_id, None)
+                continue
+            if now - meta['first_seen'] > self.max_age:
+                self._attempts.pop(arena_id, None)
+                expired.append(arena_id)
+                continue
+            self._in_flight[arena_id] = now
+            due.append(arena_id)
+            free -= 1
+        return due, expired
+
+    def on_result(self, arena_id, found, now=None):
+        """
+        Результат запроса: found=False - результатов ещё нет, следующая попытка
+        с увеличенной задержкой
+        """
+        arena_id = normalize_arena_id(arena_id)
+        if self._in_flight.pop(arena_id, None) is None:
+            return  # ответ после таймаута - попытка уже учтена
+        if found:
+            self.forget(arena_id)
+            return
+        attempts = self._attempts.get(arena_id, 0) + 1
+        self._attempts[arena_id] = attempts
+        self._schedule(arena_id, (now or time.time()) + self._backoff(attempts))
+
+    def cancel(self, arena_id):
+        """Запрос не был отправлен (не в ангаре) - повтор без увеличения задержки"""
+        arena_id = normalize_arena_id(arena_id)
+        if self._in_flight.pop(arena_id, None) is not None:
+            self._schedule(arena_id, time.time() + self.base_delay)
+
+    def next_delay(self, now=None):
+        """
+        Returns:
+            float: сколько секунд до следующей попытки (None если расписание пусто)
+        """
+        if now is None:
+            now = time.time()
+        while self._heap and self._next_attempt.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        candidates = []
+        if self._heap:
+            candidates.append(self._heap[0][0] - now)
+        if self._in_flight:
+            candidates.append(min(self._in_flight.values()) + self.request_timeout - now)
+        return max(0.0, min(candidates)) if candidates else None
+
+    def get_stats(self):
+        return {
+            'scheduled': len(self._next_attempt),
+            'in_flight': len(self._in_flight),
+            'retrying': len(self._attempts),
+        }
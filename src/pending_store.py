@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Список боёв, результаты которых ещё не получены (pending).
+Хранится в памяти, на диск сбрасывается с задержкой (несколько изменений -
+одна запись) через временный файл и атомарную замену.
+"""
+
+import os
+import json
+import time
+import BigWorld
+
+from journal_store import replace_file, normalize_arena_id
+from background_scheduler import NORMAL
+
+
+PENDING_BATTLES_PATH = os.path.abspath('./mods/configs/mod_winchance/pending_battles.json')
+
+
+class PendingBattleStore(object):
+    """Pending бои с метаданными (first_seen, attempts, last_attempt)"""
+
+    def __init__(self, path=PENDING_BATTLES_PATH, save_delay=2.0, scheduler=None, log_error=None):
+        """
+        Args:
+            path (str): Путь к файлу
+            save_delay (float): Задержка записи на диск после изменения (сек)
+            scheduler (BackgroundScheduler): Если задан - запись идёт через него
+                                             (в бою с ограничением по времени)
+            log_error (callable): Функция логирования ошибок
+        """
+        self.path = path
+        self.save_delay = save_delay
+        self.scheduler = scheduler
+        self._log_error = log_error
+        self._battles = {}  # arena_id -> {'first_seen', 'attempts', 'last_attempt'}
+        self._dirty = False
+        self._save_callback = None
+        self._load()
+
+    def err(self, msg):
+        if self._log_error:
+            self._log_error(msg)
+
+    def _load(self):
+        try:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except Exception as e:
+            self.err("Error loading pending battles: {}".format(e))
+            return
+
+        now = time.time()
+        if isinstance(data, list):
+            # Старый формат - просто список arena_id
+            for arena_id in data:
+                self._battles[normalize_arena_id(arena_id)] = {'first_seen': now, 'attempts': 0, 'last_attempt': 0}
+            return
+        for entry in data.get('battles', []):
+            self._battles[normalize_arena_id(entry.get('arenaId'))] = {
+                'first_seen': entry.get('firstSeen', now),
+                'attempts': entry.get('attempts', 0),
+                'last_attempt': entry.get('lastAttempt', 0),
+            }
+
+    def __contains__(self, arena_id):
+        return normalize_arena_id(arena_id) in self._battles
+
+    def __len__(self):
+        return len(self._battles)
+
+    def ids(self):
+        """
+        Returns:
+            list: arena_id в порядке появления (самые старые первыми)
+        """
+        return sorted(self._battles, key=lambda arena_id: self._battles[arena_id]['first_seen'])
+
+    def get(self, arena_id):
+        """
+        Returns:
+            dict: метаданные боя или None
+        """
+        return self._battles.get(normalize_arena_id(arena_id))
+
+    def add(self, arena_id):
+        """
+        Returns:
+            bool: True если бой добавлен (False - уже был в списке)
+        """
+        arena_id = normalize_arena_id(arena_id)
+        if arena_id in self._battles:
+            return False
+        self._battles[arena_id] = {'first_seen': time.time(), 'attempts': 0, 'last_attempt': 0}
+        self._schedule_save()
+        return True
+
+    def remove(self, arena_id):
+        """
+        Returns:
+            bool: True если бой был в списке
+        """
+        if self._battles.pop(normalize_arena_id(arena_id), None) is None:
+            return False
+        self._schedule_save()
+        return True
+
+    def note_attempt(self, arena_id):
+        """Отмечает запрос результатов боя"""
+        meta = self._battles.get(normalize_arena_id(arena_id))
+        if meta is not None:
+            meta['attempts'] += 1
+            meta['last_attempt'] = time.time()
+            self._schedule_save()
+
+    def _schedule_save(self):
+        self._dirty = True
+        if self._save_callback is None:
+            self._save_callback = BigWorld.callback(self.save_delay, self._on_save_timer)
+
+    def _on_save_timer(self):
+        self._save_callback = None
+        if self.scheduler is not None:
+            self.scheduler.submit(self.flush, priority=NORMAL, key='pending_battles_save')
+        else:
+            self.flush()
+
+    def flush(self):
+        """Записывает изменения на диск (если есть)"""
+        if self._save_callback is not None:
+            try:
+                BigWorld.cancelCallback(self._save_callback)
+            except Exception:
+                pass
+            self._save_callback = None
+        if not self._dirty:
+            return
+        self._dirty = False
+        battles = [{'arenaId': arena_id, 'firstSeen': meta['first_seen'],
+                    'attempts': meta['attempts'], 'lastAttempt': meta['last_attempt']}
+                   for arena_id, meta in self._battles.items()]
+        tmp_path = self.path + '.tmp'
+        try:
+            config_dir = os.path.dirname(self.path)
+            if not os.path.exists(config_dir):
+                os.makedirs(config_dir)
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': 2, 'battles': battles}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            replace_file(tmp_path, self.path)
+        except Exception as e:
+            self._dirty = True
+            self.err("Error saving pending battles: {}".format(e))
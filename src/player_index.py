@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Локальный индекс рейтингов игроков (SQLite), переживает перезапуск клиента
+"""
+
+import os
+import time
+import threading
+import Queue
+
+try:
+    import sqlite3
+except ImportError:
+    # В некоторых сборках клиента sqlite3 отсутствует - индекс просто отключается
+    sqlite3 = None
+
+
+PLAYER_INDEX_PATH = os.path.abspath('./mods/configs/mod_winchance/player_index.db')
+
+# SQLite ограничивает количество параметров в одном запросе (999 в старых версиях)
+MAX_QUERY_PARAMS = 500
+
+_SCHEMA = (
+    # Последний известный рейтинг игрока
+    "CREATE TABLE IF NOT EXISTS players ("
+    " account_id INTEGER PRIMARY KEY,"
+    " global_rating INTEGER,"
+    " fetched_at REAL NOT NULL)",
+    # История изменений рейтинга (новый снимок только если рейтинг изменился)
+    "CREATE TABLE IF NOT EXISTS rating_snapshots ("
+    " account_id INTEGER NOT NULL,"
+    " global_rating INTEGER,"
+    " fetched_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_snapshots_account ON rating_snapshots (account_id, fetched_at)",
+)
+
+
+class PlayerIndex(object):
+    """Персистентный индекс рейтингов по accountDBID с пакетной записью в фоне"""
+
+    def __init__(self, db_path=PLAYER_INDEX_PATH, flush_interval=2.0, batch_size=200, log_error=None):
+        """
+        Args:
+            db_path (str): Путь к файлу базы
+            flush_interval (float): Максимальная задержка записи накопленного пакета (сек)
+            batch_size (int): Размер пакета, при котором запись выполняется сразу
+            log_error (callable): Функция логирования ошибок
+        """
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.log_error = log_error
+        self._conn = None
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._writer = None
+        self._open()
+
+    @property
+    def enabled(self):
+        return self._conn is not None
+
+    def _err(self, msg):
+        if self.log_error:
+            self.log_error("[PlayerIndex] {}".format(msg))
+
+    def _open(self):
+        if sqlite3 is None:
+            self._err("sqlite3 is not available - player index disabled")
+            return
+        try:
+            db_dir = os.path.dirname(self.db_path)
+            if not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+
+            conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self._conn = conn
+        except Exception as e:
+            self._err("Failed to open {}: {}".format(self.db_path, e))
+            self._conn = None
+            return
+
+        self._writer = threading.Thread(target=self._writer_loop)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def lookup_many(self, account_ids):
+        """
+        Получает последние рейтинги для всего состава одним запросом
+
+        Args:
+            account_ids (list): Список accountDBID
+
+        Returns:
+            dict: str(acc_id) -> (data, fetched_at), где data в формате WG API ({'global_rating': N})
+        """
+        result = {}
+        if not self.enabled or not account_ids:
+            return result
+
+        ids = [int(acc_id) for acc_id in account_ids]
+        try:
+            with self._lock:
+                for start in range(0, len(ids), MAX_QUERY_PARAMS):
+                    chunk = ids[start:start + MAX_QUERY_PARAMS]
+                    rows = self._conn.execute(
+                        "SELECT account_id, global_rating, fetched_at FROM players "
+                        "WHERE account_id IN ({})".format(",".join("?" * len(chunk))),
+                        chunk).fetchall()
+                    for account_id, rating, fetched_at in rows:
+                        data = {'global_rating': rating} if rating is not None else None
+                        result[str(account_id)] = (data, fetched_at)
+        except Exception as e:
+            self._err("Lookup failed: {}".format(e))
+        return result
+
+    def store_many(self, data_by_id, fetched_at=None):
+        """
+        Ставит рейтинги в очередь на запись (не блокирует вызывающий поток)
+
+        Args:
+            data_by_id (dict): str(acc_id) -> data в формате WG API (или None)
+            fetched_at (float): Время получения данных (по умолчанию - сейчас)
+        """
+        if not self.enabled or not data_by_id:
+            return
+        if fetched_at is None:
+            fetched_at = time.time()
+        for key, data in data_by_id.items():
+            rating = data.get('global_rating') if data else None
+            self._queue.put((int(key), rating, fetched_at))
+
+    def _writer_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.time() + self.flush_interval
+            # Собираем пакет: до batch_size записей или до истечения flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except Queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write_batch(batch)
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        try:
+            with self._lock:
+                conn = self._conn
+                ids = list(set(account_id for account_id, _, _ in batch))
+                previous = {}
+                for start in range(0, len(ids), MAX_QUERY_PARAMS):
+                    chunk = ids[start:start + MAX_QUERY_PARAMS]
+                    rows = conn.execute(
+                        "SELECT account_id, global_rating FROM players "
+                        "WHERE account_id IN ({})".format(",".join("?" * len(chunk))),
+                        chunk).fetchall()
+                    previous.update(rows)
+
+                snapshots = []
+                for account_id, rating, fetched_at in batch:
+                    if account_id not in previous or previous[account_id] != rating:
+                        snapshots.append((account_id, rating, fetched_at))
+                        previous[account_id] = rating
+
+                conn.executemany(
+                    "INSERT OR REPLACE INTO players (account_id, global_rating, fetched_at) VALUES (?, ?, ?)",
+                    batch)
+                conn.executemany(
+                    "INSERT INTO rating_snapshots (account_id, global_rating, fetched_at) VALUES (?, ?, ?)",
+                    snapshots)
+                conn.commit()
+        except Exception as e:
+            self._err("Batch write failed ({} rows): {}".format(len(batch), e))
+
+    def close(self):
+        """Дописывает очередь и закрывает базу"""
+        if not self.enabled:
+            return
+        self._queue.put(None)
+        if self._writer:
+            self._writer.join(5.0)
+        try:
+            with self._lock:
+                self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
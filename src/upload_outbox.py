@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Устойчивая к падениям очередь отправки результатов боёв (outbox).
+Записи хранятся в append-only журнале и отправляются фоновым потоком пакетами
+с экспоненциальной задержкой между попытками, в том числе в следующих сессиях.
+"""
+
+import os
+import time
+import random
+import threading
+
+from journal_store import JournalStore
+
+
+OUTBOX_PATH = os.path.abspath('./mods/configs/mod_winchance/upload_outbox.journal')
+
+# Результат попытки отправки
+SEND_OK = 'ok'              # доставлено - запись удаляется
+SEND_REJECTED = 'rejected'  # сервер окончательно отклонил - запись удаляется
+SEND_RETRY = 'retry'        # временная ошибка - повтор позже
+
+
+class UploadOutbox(object):
+    """Журналируемая очередь отправки с фоновым отправителем"""
+
+    def __init__(self, send_fn, path=OUTBOX_PATH, max_in_flight=2,
+                 base_delay=5.0, max_delay=600.0, batch_max_items=50,
+                 batch_max_bytes=4 * 1024 * 1024, linger=2.0, log=None, log_error=None):
+        """
+        Args:
+            send_fn (callable): send_fn([(entry_id, reader), ...]) -> Future,
+                                результат которого dict entry_id -> SEND_*;
+                                reader() возвращает итератор кусков payload из журнала
+            path (str): Путь к файлу журнала
+            max_in_flight (int): Максимум одновременно отправляемых пакетов
+            base_delay (float): Задержка перед первым повтором (сек)
+            max_delay (float): Максимальная задержка между повторами (сек)
+            batch_max_items (int): Максимум записей в одном пакете
+            batch_max_bytes (int): Максимальный суммарный размер пакета (байт)
+            linger (float): Сколько новая запись ждёт попутчиков перед отправкой (сек)
+            log (callable): Функция логирования
+            log_error (callable): Функция логирования ошибок
+        """
+        self.send_fn = send_fn
+        self.max_in_flight = max_in_flight
+        self.batch_max_items = batch_max_items
+        self.batch_max_bytes = batch_max_bytes
+        self.linger = linger
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._log = log
+        self._log_error = log_error
+        self._cond = threading.Condition(threading.Lock())
+        self._attempts = {}      # entry_id -> количество неудачных попыток в этой сессии
+        self._next_attempt = {}  # entry_id -> время следующей попытки
+        self._in_flight = set()   # entry_id в отправляемых пакетах
+        # entry_id -> номер последней записи payload: пакет удаляет запись из журнала,
+        # только если её не перезаписали, пока он отправлялся
+        self._generation = {}
+        self._seq = 0
+        self._batches_in_flight = 0
+        self._pause_reasons = set()  # пока не пусто, новые пакеты не отправляются ('battle', 'bootstrap')
+        self._stopped = False
+        self._thread = None
+
+        self.store = JournalStore(path)
+        if self.store.dropped_bytes:
+            self.err("Outbox journal had {} corrupt trailing bytes, truncated".format(self.store.dropped_bytes))
+        now = time.time()
+        for entry_id in self.store.keys():
+            self._next_attempt[entry_id] = now
+        if self._next_attempt:
+            self.log("Outbox restored {} pending uploads".format(len(self._next_attempt)))
+
+    def log(self, msg):
+        if self._log:
+            self._log("[Outbox] {}".format(msg))
+
+    def err(self, msg):
+        if self._log_error:
+            self._log_error("[Outbox] {}".format(msg))
+
+    def start(self):
+        """Запускает фоновый отправитель"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._drain_loop, name='UploadOutbox')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def enqueue(self, entry_id, payload):
+        """
+        Сохраняет payload в журнал (fsync) и будит отправитель
+
+        Args:
+            entry_id (str): Уникальный ID записи (повторная запись с тем же ID заменяет старую)
+            payload (str): Сериализованное тело запроса
+        """
+        entry_id = str(entry_id)
+        self._bump(entry_id)
+        self.store.put(entry_id, payload)
+        self._wake(entry_id)
+
+    def enqueue_stream(self, entry_id, produce):
+        """
+        Как enqueue, но payload пишется в журнал кусками и не собирается в памяти
+
+        Args:
+            entry_id (str): Уникальный ID записи
+            produce (callable): produce(write) - вызывает write(data) для каждого куска payload
+        """
+        entry_id = str(entry_id)
+        self._bump(entry_id)
+        self.store.put_stream(entry_id, produce)
+        self._wake(entry_id)
+
+    def _bump(self, entry_id):
+        """Новый номер записи до записи в журнал: отправляемый пакет со старым payload её не удалит"""
+        with self._cond:
+            self._seq += 1
+            self._generation[entry_id] = self._seq
+
+    def _wake(self, entry_id):
+        with self._cond:
+            self._attempts.pop(entry_id, None)
+            self._next_attempt[entry_id] = time.time() + self.linger
+            self._cond.notify()
+
+    def set_paused(self, paused, reason='paused'):
+        """
+        Пауза отправки (уже отправляемые пакеты завершаются); записи остаются в журнале.
+        Отправка возобновляется, когда сняты паузы по всем причинам.
+        """
+        with self._cond:
+            if paused:
+                self._pause_reasons.add(reason)
+            else:
+                self._pause_reasons.discard(reason)
+            self._cond.notify()
+
+    def pending_count(self):
+        return len(self.store)
+
+    def _backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        # Разброс, чтобы после восстановления сервера клиенты не приходили одновременно
+        return delay * random.uniform(0.8, 1.2)
+
+    def _next_batch(self, now):
+        """Собирает пакет из наступивших записей (самые старые первыми) с учётом лимитов"""
+        due = [entry_id for entry_id, at in self._next_attempt.items()
+               if at <= now and entry_id not in self._in_flight]
+        due.sort(key=lambda entry_id: self._next_attempt[entry_id])
+        batch = []
+        batch_bytes = 0
+        for entry_id in due:
+            size = self.store.size_of(entry_id)
+            if batch and batch_bytes + size > self.batch_max_bytes:
+                break
+            batch.append(entry_id)
+            batch_bytes += size
+            if len(batch) >= self.batch_max_items:
+                break
+        return batch
+
+    def _drain_loop(self):
+        with self._cond:
+            while not self._stopped:
+                free = self.max_in_flight - self._batches_in_flight
+                now = time.time()
+                paused = bool(self._pause_reasons)
+                batch = self._next_batch(now) if free > 0 and not paused else []
+                if not batch:
+                    waiting = [at for entry_id, at in self._next_attempt.items()
+                               if entry_id not in self._in_flight]
+                    timeout = (max(0.05, min(waiting) - now)
+                               if waiting and free > 0 and not paused else None)
+                    self._cond.wait(timeout)
+                    continue
+
+                self._in_flight.update(batch)
+                self._batches_in_flight += 1
+                generations = dict((entry_id, self._generation.get(entry_id, 0)) for entry_id in batch)
+                self._cond.release()
+                try:
+                    self._dispatch(batch, generations)
+                finally:
+                    self._cond.acquire()
+
+    def _dispatch(self, batch, generations):
+        try:
+            entries = []
+            statuses = {}
+            for entry_id in batch:
+                if entry_id in self.store:
+                    entries.append((entry_id, self._reader(entry_id)))
+                else:
+                    statuses[entry_id] = SEND_OK
+            if not entries:
+                self._finish(batch, generations, statuses)
+                return
+
+            def _on_done(future):
+                if future.error() is None:
+                    statuses.update(future.result() or {})
+                self._finish(batch, generations, statuses)
+
+            self.send_fn(entries).add_done_callback(_on_done)
+        except Exception as e:
+            self.err("Dispatch error for {} entries: {}".format(len(batch), e))
+            self._finish(batch, generations, {})
+
+    def _reader(self, entry_id):
+        """Повторяемое чтение payload с диска (для повтора запроса при переподключении)"""
+        def _read():
+            chunks = self.store.iter_value(entry_id)
+            return chunks if chunks is not None else iter(())
+        return _read
+
+    def _finish(self, batch, generations, statuses):
+        """
+        Применяет результаты пакета: записи без статуса считаются SEND_RETRY.
+        Записи, перезаписанные во время отправки, остаются в журнале с новым payload.
+        """
+        retried = []
+        with self._cond:
+            self._batches_in_flight -= 1
+            for entry_id in batch:
+                self._in_flight.discard(entry_id)
+                if self._generation.get(entry_id, 0) != generations[entry_id]:
+                    continue  # новый payload уже запланирован в _wake
+                if statuses.get(entry_id) in (SEND_OK, SEND_REJECTED):
+                    # Под блокировкой: enqueue того же ID дождётся удаления и запишет payload после него
+                    try:
+                        self.store.delete(entry_id)
+                    except Exception as e:
+                        self.err("Failed to remove {} from journal: {}".format(entry_id, e))
+                    self._generation.pop(entry_id, None)
+                    self._attempts.pop(entry_id, None)
+                    self._next_attempt.pop(entry_id, None)
+                    continue
+                attempts = self._attempts.get(entry_id, 0) + 1
+                self._attempts[entry_id] = attempts
+                delay = self._backoff(attempts)
+                if entry_id in self._next_attempt:
+                    self._next_attempt[entry_id] = time.time() + delay
+                retried.append((entry_id, attempts, delay))
+            self._cond.notify()
+
+        try:
+            self.store.maybe_compact()
+        except Exception as e:
+            self.err("Journal compaction failed: {}".format(e))
+
+        for entry_id, attempts, delay in retried:
+            self.log("Upload {} failed (attempt {}), next try in {:.0f}s".format(entry_id, attempts, delay))
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: pending (в журнале), in_flight, retrying (с неудачными попытками)
+        """
+        with self._cond:
+            return {
+                'pending': len(self.store),
+                'in_flight': len(self._in_flight),
+                'batches_in_flight': self._batches_in_flight,
+                'retrying': len(self._attempts),
+            }
+
+    def stop(self, timeout=2.0):
+        """Останавливает отправитель; неотправленные записи остаются в журнале до следующей сессии"""
+        with self._cond:
+            self._stopped = True
+            thread, self._thread = self._thread, None
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+
+    def close(self):
+        self.stop()
+        self.store.close()
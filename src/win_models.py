@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Модели шанса победы. Все модели работают с агрегатами команд (TeamAggregate)
+и возвращают шанс в процентах; тяжёлые части (логистическая кривая, веса
+уровней и классов техники) считаются в таблицы при загрузке модели.
+
+Активная модель выбирается ключом 'model' в mod_winchance.json, параметры
+берутся из model_params.json (см. tools/calibrate_model.py).
+"""
+
+import os
+import json
+import math
+
+from journal_store import replace_file
+
+
+MODEL_PARAMS_PATH = os.path.abspath('./mods/configs/mod_winchance/model_params.json')
+# Уровень и класс техники по typeCompDescr: в результатах боя есть только typeCompDescr,
+# а калибровка весов модели 'weighted' идёт вне игры, без данных о технике
+VEHICLE_TYPES_PATH = os.path.abspath('./mods/configs/mod_winchance/vehicle_types.json')
+DEFAULT_MODEL = 'average'
+
+VEHICLE_CLASSES = ('lightTank', 'mediumTank', 'heavyTank', 'AT-SPG', 'SPG')
+
+MODEL_REGISTRY = {}
+
+
+def register_model(cls):
+    """Декоратор: регистрирует модель под cls.name"""
+    MODEL_REGISTRY[cls.name] = cls
+    return cls
+
+
+def load_model_params(path=MODEL_PARAMS_PATH):
+    """
+    Returns:
+        dict: имя модели -> параметры ({} если файла нет)
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f).get('models', {})
+
+
+def load_vehicle_types(path=VEHICLE_TYPES_PATH):
+    """
+    Returns:
+        dict: typeCompDescr -> (уровень, класс) ({} если файла нет)
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return dict((int(type_descr), (tier, vehicle_class)) for type_descr, (tier, vehicle_class) in data.items())
+
+
+def save_vehicle_types(vehicle_types, path=VEHICLE_TYPES_PATH):
+    """Записывает таблицу typeCompDescr -> (уровень, класс) через временный файл"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(dict((str(type_descr), list(value)) for type_descr, value in vehicle_types.items()),
+                  f, sort_keys=True)
+    replace_file(tmp_path, path)
+
+
+def create_model(name=DEFAULT_MODEL, params=None):
+    """
+    Создаёт модель по имени (неизвестное имя - модель по умолчанию)
+
+    Returns:
+        WinChanceModel
+    """
+    cls = MODEL_REGISTRY.get(name) or MODEL_REGISTRY[DEFAULT_MODEL]
+    return cls(params)
+
+
+def _clamp_percent(value):
+    return max(0.0, min(100.0, value))
+
+
+class WinChanceModel(object):
+    """Общий интерфейс моделей"""
+
+    name = None
+    DEFAULT_PARAMS = {}
+
+    def __init__(self, params=None):
+        self.params = dict(self.DEFAULT_PARAMS)
+        if params:
+            self.params.update((key, value) for key, value in params.items() if key in self.DEFAULT_PARAMS)
+        self._build()
+
+    def _build(self):
+        """Предрасчёт таблиц по параметрам"""
+
+    def vehicle_weight(self, tier, vehicle_class):
+        """Вес техники в агрегатах команды"""
+        return 1.0
+
+    def predict(self, ally, enemy):
+        """
+        Args:
+            ally (TeamAggregate): союзники
+            enemy (TeamAggregate): противники
+
+        Returns:
+            float: шанс победы союзников (%)
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _ratio(team_strength, enemy_strength, ally, enemy):
+        total = team_strength + enemy_strength
+        if total == 0:
+            if ally.alive and not enemy.alive:
+                return 100.0
+            if enemy.alive and not ally.alive:
+                return 0.0
+            return 50.0
+        return _clamp_percent(team_strength / total * 100.0)
+
+
+@register_model
+class AverageRatioModel(WinChanceModel):
+    """
+    Отношение средних рейтингов (исходная формула мода). Сила команды -
+    средний рейтинг живых, умноженный на долю живой техники
+    """
+
+    name = 'average'
+
+    def predict(self, ally, enemy):
+        return self._ratio(ally.avg_rating() * ally.alive_fraction(),
+                           enemy.avg_rating() * enemy.alive_fraction(), ally, enemy)
+
+
+@register_model
+class LogisticModel(WinChanceModel):
+    """
+    Логистическая (Elo-подобная) модель:
+    P = 1 / (1 + exp(-(rating_diff / scale + alive_coef * alive_diff + bias)))
+    Сигмоида берётся из таблицы, построенной при загрузке.
+    """
+
+    name = 'logistic'
+    DEFAULT_PARAMS = {
+        'scale': 1000.0,       # разница средних WGR, дающая z = 1 (~73%)
+        'alive_coef': 0.35,    # вклад каждой единицы перевеса в живой технике
+        'bias': 0.0,
+        'table_range': 8.0,    # таблица сигмоиды на z в [-range, range]
+        'table_step': 0.01,
+    }
+
+    def _build(self):
+        z_range = float(self.params['table_range'])
+        step = float(self.params['table_step'])
+        size = int(round(z_range / step))
+        self._step = step
+        self._offset = size
+        self._table = [100.0 / (1.0 + math.exp(-(i - size) * step)) for i in range(2 * size + 1)]
+        self._inv_scale = 1.0 / float(self.params['scale'])
+        self._alive_coef = float(self.params['alive_coef'])
+        self._bias = float(self.params['bias'])
+
+    def probability(self, z):
+        index = int(round(z / self._step)) + self._offset
+        if index < 0:
+            return self._table[0]
+        if index >= len(self._table):
+            return self._table[-1]
+        return self._table[index]
+
+    def predict(self, ally, enemy):
+        if not enemy.alive and ally.alive:
+            return 100.0
+        if not ally.alive and enemy.alive:
+            return 0.0
+        z = ((ally.avg_rating() - enemy.avg_rating()) * self._inv_scale +
+             self._alive_coef * (ally.alive - enemy.alive) + self._bias)
+        return self.probability(z)
+
+
+@register_model
+class WeightedModel(WinChanceModel):
+    """
+    Отношение средних рейтингов с весами по уровню и классу техники:
+    вес = tier_weights[уровень] * class_weights[класс]
+    """
+
+    name = 'weighted'
+    DEFAULT_PARAMS = {
+        # Уровень относительно максимального в бою не известен заранее, поэтому
+        # вес растёт с абсолютным уровнем техники
+        'tier_weights': [0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 1.0],
+        'class_weights': {'lightTank': 0.8, 'mediumTank': 1.0, 'heavyTank': 1.1, 'AT-SPG': 1.0, 'SPG': 0.6},
+    }
+
+    def _build(self):
+        tier_weights = self.params['tier_weights']
+        class_weights = self.params['class_weights']
+        self._weights = {}
+        for tier in range(1, len(tier_weights) + 1):
+            for vehicle_class in VEHICLE_CLASSES + (None,):
+                self._weights[(tier, vehicle_class)] = (
+                    float(tier_weights[tier - 1]) * float(class_weights.get(vehicle_class, 1.0)))
+
+    def vehicle_weight(self, tier, vehicle_class):
+        return self._weights.get((tier, vehicle_class), 1.0)
+
+    def predict(self, ally, enemy):
+        return self._ratio(ally.weighted_avg_rating() * ally.alive_weight_fraction(),
+                           enemy.weighted_avg_rating() * enemy.alive_weight_fraction(), ally, enemy)
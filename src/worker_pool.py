@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Небольшой пул рабочих потоков и Future для фоновых задач мода
+"""
+
+import sys
+import time
+import threading
+from collections import deque
+
+
+class Future(object):
+    """Результат фоновой задачи (аналог concurrent.futures.Future для Python 2.7)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._result = None
+        self._error = None
+        self._callbacks = []
+
+    def done(self):
+        return self._event.is_set()
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_error(self, error):
+        self._finish(None, error)
+
+    def _finish(self, result, error):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._result = result
+            self._error = error
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            self._invoke(fn)
+
+    def _invoke(self, fn):
+        try:
+            fn(self)
+        except Exception:
+            # Ошибка в callback не должна ломать поток, завершивший задачу
+            sys.excepthook(*sys.exc_info())
+
+    def add_done_callback(self, fn):
+        """Вызывает fn(future) после завершения (сразу, если задача уже завершена)"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        self._invoke(fn)
+
+    def error(self):
+        return self._error
+
+    def result(self, timeout=None):
+        """Ожидает результат; пробрасывает исключение задачи"""
+        if not self._event.wait(timeout):
+            raise RuntimeError("Future timed out")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+def when_all(futures, callback):
+    """Вызывает callback(futures) после завершения всех futures, не блокируя поток"""
+    futures = list(futures)
+    if not futures:
+        callback(futures)
+        return
+
+    state = {'remaining': len(futures)}
+    lock = threading.Lock()
+
+    def _on_done(_):
+        with lock:
+            state['remaining'] -= 1
+            last = state['remaining'] == 0
+        if last:
+            callback(futures)
+
+    for future in futures:
+        future.add_done_callback(_on_done)
+
+
+class QueueFullError(Exception):
+    """Очередь пула заполнена, новая задача отклонена"""
+
+
+class WorkerPool(object):
+    """
+    Фиксированный пул daemon-потоков с ограниченной очередью.
+    Потоки создаются при первой задаче.
+    """
+
+    def __init__(self, size, name='WorkerPool', max_queue=0):
+        """
+        Args:
+            size (int): Количество рабочих потоков
+            name (str): Префикс имени потоков
+            max_queue (int): Максимум задач в очереди (0 - без ограничения), сверх него
+                             новые задачи отклоняются с QueueFullError
+        """
+        self.size = size
+        self.name = name
+        self.max_queue = max_queue
+        self._cond = threading.Condition(threading.Lock())
+        self._tasks = deque()   # (future, fn, args, kwargs)
+        self._threads = []
+        self._in_flight = 0
+        self._stopped = False
+        self._stats = {'completed': 0, 'failed': 0, 'rejected': 0}
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Ставит задачу в очередь
+
+        Returns:
+            Future: результат fn(*args, **kwargs); при переполнении - ошибка QueueFullError
+        """
+        future = Future()
+        with self._cond:
+            if self._stopped:
+                future.set_error(RuntimeError("{} is stopped".format(self.name)))
+                return future
+
+            if self.max_queue and len(self._tasks) >= self.max_queue:
+                self._stats['rejected'] += 1
+                future.set_error(QueueFullError("{} queue is full".format(self.name)))
+                return future
+
+            self._tasks.append((future, fn, args, kwargs))
+            self._ensure_threads()
+            self._cond.notify_all()
+        return future
+
+    def _ensure_threads(self):
+        # Вызывается под self._cond
+        while len(self._threads) < self.size:
+            t = threading.Thread(target=self._worker_loop,
+                                 name="{}-{}".format(self.name, len(self._threads)))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._tasks and not self._stopped:
+                    self._cond.wait()
+                if not self._tasks:
+                    return
+                future, fn, args, kwargs = self._tasks.popleft()
+                self._in_flight += 1
+            try:
+                future.set_result(fn(*args, **kwargs))
+                ok = True
+            except Exception as e:
+                future.set_error(e)
+                ok = False
+            with self._cond:
+                self._in_flight -= 1
+                self._stats['completed' if ok else 'failed'] += 1
+                self._cond.notify_all()
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: queued, in_flight, workers и счётчики completed/failed/rejected
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['queued'] = len(self._tasks)
+            stats['in_flight'] = self._in_flight
+            stats['workers'] = len(self._threads)
+        return stats
+
+    def drain(self, timeout=3.0):
+        """
+        Выполняет уже поставленные задачи не дольше timeout, затем останавливает пул
+
+        Returns:
+            int: количество задач, которые не успели выполниться
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            while self._tasks or self._in_flight:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(min(remaining, 0.1))
+        return self.stop(0)
+
+    def stop(self, timeout=2.0):
+        """
+        Останавливает потоки: очередь дорабатывается (при timeout=0 - отменяется)
+
+        Returns:
+            int: количество отменённых задач
+        """
+        with self._cond:
+            self._stopped = True
+            cancelled = []
+            if not timeout:
+                cancelled, self._tasks = list(self._tasks), deque()
+            threads, self._threads = self._threads, []
+            self._cond.notify_all()
+        for future, _, _, _ in cancelled:
+            future.set_error(RuntimeError("{} is stopped".format(self.name)))
+        for t in threads:
+            t.join(timeout)
+        return len(cancelled)
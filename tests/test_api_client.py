@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+BattleAPIClient upload format negotiation (Python 2.7)
+
+Run from the repository root:
+  python -m unittest discover -s tests
+"""
+import os
+import sys
+import json
+import zlib
+import types
+import shutil
+import tempfile
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+try:
+    import BigWorld
+except ImportError:
+    # Outside the game client: only callbacks are used by the code under test
+    BigWorld = types.ModuleType('BigWorld')
+    BigWorld.callback = lambda delay, fn: None
+    BigWorld.cancelCallback = lambda callback_id: None
+    BigWorld.player = lambda: None
+    sys.modules['BigWorld'] = BigWorld
+
+import api_client
+from api_client import BattleAPIClient, UPLOAD_FORMAT_GZIP, UPLOAD_FORMAT_LEGACY
+from http_transport import HttpResponse, HTTPError
+from upload_outbox import UploadOutbox, SEND_OK, SEND_REJECTED
+
+ENTRY = '{"battleId":1,"rawJson":{"winnerTeam":1}}'
+LEGACY_ENTRY = '{"battleId":1,"rawJson":"{\\"winnerTeam\\":1}"}'
+
+
+class FakeApi(object):
+    """_request stand-in: records what was sent and answers with scripted codes"""
+
+    def __init__(self, codes):
+        self.codes = list(codes)
+        self.requests = []  # [(endpoint, content_encoding, body)]
+
+    def __call__(self, method, endpoint, body, extra_headers=None):
+        if callable(body):
+            body = ''.join(body())
+        encoding = (extra_headers or {}).get('Content-Encoding')
+        if encoding == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        self.requests.append((endpoint, encoding, body))
+        code = self.codes.pop(0) if self.codes else 200
+        if code >= 400:
+            raise HTTPError(code, 'Error', '{"message":"error"}')
+        return HttpResponse(code, 'OK', {}, '{"message":"ok"}', 0.0)
+
+
+class UploadFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        outbox_path = os.path.join(self.dir, 'outbox.journal')
+        self._outbox_class = api_client.UploadOutbox
+        api_client.UploadOutbox = lambda send_fn, **kwargs: UploadOutbox(send_fn, path=outbox_path, **kwargs)
+        self.client = BattleAPIClient('http://api.local')
+        self.messages = []
+        self.client.log = self.client.err = self.messages.append
+
+    def tearDown(self):
+        api_client.UploadOutbox = self._outbox_class
+        self.client.outbox.close()
+        self.client.upload_pool.stop()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def send(self, codes):
+        self.client._request = api = FakeApi(codes)
+        statuses = self.client._send_each([('1', lambda: iter([ENTRY]))])
+        return statuses['1'], [(encoding, body) for _, encoding, body in api.requests]
+
+    def test_compressed_format_is_confirmed(self):
+        status, requests = self.send([200])
+        self.assertEqual(status, SEND_OK)
+        self.assertEqual(requests, [('gzip', ENTRY)])
+        self.assertEqual(self.client.upload_format, UPLOAD_FORMAT_GZIP)
+
+    def test_400_then_legacy_ok_switches_format(self):
+        status, requests = self.send([400, 200])
+        self.assertEqual(status, SEND_OK)
+        self.assertEqual(requests, [('gzip', ENTRY), (None, LEGACY_ENTRY)])
+        self.assertEqual(self.client.upload_format, UPLOAD_FORMAT_LEGACY)
+        self.assertEqual(json.loads(json.loads(requests[1][1])['rawJson']), {'winnerTeam': 1})
+        # Further uploads go straight to the legacy format
+        status, requests = self.send([200])
+        self.assertEqual(requests, [(None, LEGACY_ENTRY)])
+
+    def test_415_then_legacy_ok_switches_format(self):
+        status, requests = self.send([415, 200])
+        self.assertEqual(status, SEND_OK)
+        self.assertEqual(self.client.upload_format, UPLOAD_FORMAT_LEGACY)
+
+    def test_failed_legacy_retry_keeps_format_unconfirmed(self):
+        status, requests = self.send([400, 400])
+        self.assertEqual(status, SEND_REJECTED)
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(self.client.upload_format, None)
+        status, requests = self.send([200])
+        self.assertEqual(requests, [('gzip', ENTRY)])
+
+    def test_400_after_confirmed_format_rejects_entry(self):
+        self.send([200])
+        status, requests = self.send([400])
+        self.assertEqual(status, SEND_REJECTED)
+        self.assertEqual(requests, [('gzip', ENTRY)])
+        self.assertEqual(self.client.upload_format, UPLOAD_FORMAT_GZIP)
+
+    def test_415_after_confirmed_format_falls_back(self):
+        self.send([200])
+        status, requests = self.send([415, 200])
+        self.assertEqual(status, SEND_OK)
+        self.assertEqual([encoding for encoding, _ in requests], ['gzip', None])
+        self.assertEqual(self.client.upload_format, UPLOAD_FORMAT_LEGACY)
+
+
+if __name__ == '__main__':
+    unittest.main()
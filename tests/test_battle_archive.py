@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+BattleArchive segments, crash recovery, index validation and retention
+(Python 2.7)
+
+Run from the repository root:
+  python -m unittest discover -s tests
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from battle_archive import BattleArchive
+
+
+def results_json(arena_id):
+    return json.dumps({'arenaUniqueID': arena_id, 'common': {'winnerTeam': 1}, 'pad': 'x' * 200})
+
+
+class BattleArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'battle_archive')
+        self.archive = None
+
+    def tearDown(self):
+        if self.archive is not None:
+            self.archive.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def open(self, **kwargs):
+        if self.archive is not None:
+            self.archive.close()
+        self.archive = BattleArchive(self.path, **kwargs)
+        return self.archive
+
+    def add(self, *arena_ids):
+        for arena_id in arena_ids:
+            data = results_json(arena_id)
+            self.assertTrue(self.archive.append(arena_id, lambda write: (write(data[:50]), write(data[50:]))))
+
+    def segment(self, number, ext='dat'):
+        return os.path.join(self.path, 'seg_{:06d}.{}'.format(number, ext))
+
+    def assertStored(self, *arena_ids):
+        for arena_id in arena_ids:
+            self.assertEqual(self.archive.get(arena_id), results_json(arena_id))
+
+    def test_battles_survive_reopen(self):
+        self.open(segment_max_battles=2)
+        self.add(101, 102, 103)
+        self.assertFalse(self.archive.append(101, lambda write: write('{}')))
+        archive = self.open(segment_max_battles=2)
+        self.assertEqual(len(archive), 3)
+        self.assertTrue('102' in archive)
+        self.assertStored(101, 102, 103)
+        self.assertEqual([arena_id for arena_id, _ in archive.scan()], [101, 102, 103])
+        self.assertEqual(archive.dropped_bytes, 0)
+
+    def test_torn_write_is_dropped_on_reopen(self):
+        self.open()
+        self.add(101, 102)
+        self.archive.close()
+        size = os.path.getsize(self.segment(1))
+        with open(self.segment(1), 'r+b') as f:
+            f.truncate(size - 10)
+
+        archive = self.open()
+        # The torn record is cut off the active segment
+        self.assertEqual(archive.dropped_bytes, size - 10 - os.path.getsize(self.segment(1)))
+        self.assertTrue(archive.dropped_bytes > 0)
+        self.assertTrue(101 in archive)
+        self.assertFalse(102 in archive)
+        self.assertStored(101)
+        # New records go after the last intact one and survive the next reopen
+        self.add(103)
+        archive = self.open()
+        self.assertEqual(archive.dropped_bytes, 0)
+        self.assertStored(101, 103)
+
+    def test_unfinished_header_and_bad_crc_are_dropped(self):
+        self.open()
+        self.add(101, 102)
+        self.archive.close()
+        with open(self.segment(1), 'r+b') as f:
+            # Flip a byte inside the last record's compressed data
+            f.seek(-5, os.SEEK_END)
+            byte = f.read(1)
+            f.seek(-5, os.SEEK_END)
+            f.write(chr(ord(byte) ^ 0xff))
+            # A crash between the placeholder header and its fix-up leaves arena_id 0
+            f.seek(0, os.SEEK_END)
+            f.write('\0' * 16 + 'partial data')
+
+        archive = self.open()
+        self.assertTrue(archive.dropped_bytes > 16)
+        self.assertEqual(len(archive), 1)
+        self.assertStored(101)
+
+    def test_stale_index_is_rebuilt_from_segment(self):
+        self.open(segment_max_battles=3)
+        self.add(101, 102, 103, 104)
+        self.archive.close()
+        self.assertTrue(os.path.exists(self.segment(1, 'idx')))
+        # An index written before the last record does not match the segment size
+        with open(self.segment(1, 'idx'), 'r+b') as f:
+            f.truncate(2 * 16)
+
+        archive = self.open(segment_max_battles=3)
+        self.assertEqual(len(archive), 4)
+        self.assertStored(101, 102, 103, 104)
+
+    def test_broken_or_missing_index_is_rebuilt(self):
+        self.open(segment_max_battles=2)
+        self.add(101, 102, 103, 104, 105)
+        self.archive.close()
+        with open(self.segment(1, 'idx'), 'ab') as f:
+            f.write('torn')
+        os.remove(self.segment(2, 'idx'))
+
+        archive = self.open(segment_max_battles=2)
+        self.assertEqual(len(archive), 5)
+        self.assertStored(101, 102, 103, 104, 105)
+
+    def test_retention_by_size_deletes_oldest_segments(self):
+        archive = self.open(segment_max_battles=1, max_total_bytes=0, max_age_days=0)
+        self.add(101, 102, 103, 104)
+        segment_bytes = archive.total_bytes() // 4
+        archive.max_total_bytes = 2 * segment_bytes
+        # Segments 1-4 are sealed, the active segment 5 is empty
+        self.assertEqual(archive.enforce_retention(), 2)
+        self.assertFalse(os.path.exists(self.segment(1)))
+        self.assertFalse(os.path.exists(self.segment(2, 'idx')))
+        self.assertTrue(os.path.exists(self.segment(3)))
+        self.assertEqual(sorted(arena_id for arena_id, _ in archive.scan()), [103, 104])
+        self.assertFalse(101 in archive)
+        self.assertEqual(archive.get(101), None)
+
+        archive = self.open(segment_max_battles=1, max_total_bytes=0, max_age_days=0)
+        self.assertEqual(len(archive), 2)
+        self.assertStored(103, 104)
+
+    def test_retention_on_rotation(self):
+        archive = self.open(segment_max_battles=1, max_total_bytes=1, max_age_days=0)
+        self.add(101, 102, 103)
+        # Each rotation leaves only the active segment
+        self.assertEqual(len(archive), 0)
+        self.assertEqual(os.listdir(self.path), ['seg_000004.dat'])
+
+    def test_retention_by_age_keeps_active_segment(self):
+        archive = self.open(segment_max_battles=2, max_total_bytes=0, max_age_days=30)
+        self.add(101, 102, 103)
+        self.assertEqual(archive.enforce_retention(), 0)
+        self.assertEqual(archive.enforce_retention(now=time.time() + 31 * 86400), 1)
+        self.assertEqual(len(archive), 1)
+        self.assertStored(103)
+
+    def test_read_only_does_not_modify_files(self):
+        self.open()
+        self.add(101, 102)
+        self.archive.close()
+        with open(self.segment(1), 'ab') as f:
+            f.write('torn tail')
+        size = os.path.getsize(self.segment(1))
+
+        archive = self.open(read_only=True)
+        self.assertStored(101, 102)
+        self.assertEqual(archive.enforce_retention(now=time.time() + 1000 * 86400), 0)
+        self.assertRaises(IOError, archive.append, 103, lambda write: write('{}'))
+        self.assertEqual(os.path.getsize(self.segment(1)), size)
+
+
+if __name__ == '__main__':
+    unittest.main()
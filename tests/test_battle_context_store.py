@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+BattleContextStore persistence, crash recovery and garbage collection
+(Python 2.7)
+
+Run from the repository root:
+  python -m unittest discover -s tests
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from battle_context_store import BattleContextStore
+
+
+class BattleContextStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'battle_context.journal')
+        self.legacy_dir = os.path.join(self.dir, 'battle_context')
+        self.store = None
+        self.errors = []
+
+    def tearDown(self):
+        if self.store is not None:
+            self.store.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def open(self, **kwargs):
+        if self.store is not None:
+            self.store.close()
+        options = dict(legacy_dir=self.legacy_dir, log_error=self.errors.append)
+        options.update(kwargs)
+        self.store = BattleContextStore(self.path, **options)
+        return self.store
+
+    def test_contexts_survive_reopen(self):
+        store = self.open()
+        self.assertTrue(store.put(101, {'map': 'himmelsdorf', 'winChance': 55.5}))
+        self.assertTrue(store.put('102', {'map': 'prokhorovka'}))
+        self.assertFalse(store.put('not an id', {}))
+        store.put(101, {'map': 'himmelsdorf', 'winChance': 60.0})
+        store.delete(102)
+
+        store = self.open()
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.get('101')['winChance'], 60.0)
+        self.assertEqual(store.get(102), {})
+
+    def test_torn_write_is_dropped_on_reopen(self):
+        store = self.open()
+        store.put(101, {'map': 'kept'})
+        store.put(102, {'map': 'torn', 'pad': 'x' * 100})
+        store.close()
+        self.store = None
+        size = os.path.getsize(self.path)
+        with open(self.path, 'r+b') as f:
+            f.truncate(size - 10)
+
+        store = self.open()
+        self.assertTrue(store.store.dropped_bytes > 0)
+        self.assertEqual(len(self.errors), 1)
+        self.assertEqual(store.get(101)['map'], 'kept')
+        self.assertFalse(102 in store)
+        # New contexts go after the last intact record
+        store.put(103, {'map': 'after recovery'})
+        store = self.open()
+        self.assertEqual(sorted(int(key) for key in store.store.keys()), [101, 103])
+
+    def test_garbage_collection_by_ttl_and_age(self):
+        store = self.open(processed_ttl=100, max_age=1000)
+        now = time.time()
+        store.put(101, {'savedAt': now})
+        store.put(102, {'savedAt': now})
+        store.put(103, {'savedAt': now - 2000})
+        self.assertTrue(store.mark_processed(101, now=now))
+        self.assertFalse(store.mark_processed(101, now=now))
+
+        # Only the context without results older than max_age expires now
+        self.assertEqual(store.collect_garbage(now=now), 1)
+        self.assertEqual(sorted(int(key) for key in store.store.keys()), [101, 102])
+        # Processed state survives reopen
+        store = self.open(processed_ttl=100, max_age=1000)
+        self.assertEqual(store.get(101)['processedAt'], now)
+        self.assertEqual(store.collect_garbage(now=now + 101), 1)
+        self.assertFalse(101 in store)
+        self.assertTrue(102 in store)
+
+    def test_legacy_files_are_imported(self):
+        os.makedirs(self.legacy_dir)
+        with open(os.path.join(self.legacy_dir, '101.json'), 'w') as f:
+            json.dump({'map': 'legacy'}, f)
+        with open(os.path.join(self.legacy_dir, 'broken.json'), 'w') as f:
+            f.write('{')
+
+        store = self.open()
+        self.assertEqual(store.get(101)['map'], 'legacy')
+        self.assertTrue(store.get(101)['savedAt'] > 0)
+        self.assertFalse(os.path.exists(self.legacy_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
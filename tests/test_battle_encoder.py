@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+BattleResultsEncoder output parity with the previous make_serializable + json.dumps
+(Python 2.7)
+
+Run from the repository root:
+  python -m unittest discover -s tests
+"""
+import os
+import sys
+import json
+import unittest
+from collections import OrderedDict, namedtuple
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'tools'))
+
+from battle_encoder import BattleResultsEncoder
+from bench_battle_encoder import legacy_encode
+
+
+class Vehicle(object):
+    def __str__(self):
+        return 'Vehicle(R04_T-34)'
+
+
+VehicleKey = namedtuple('VehicleKey', 'team vehicleID')
+
+
+def sample_results():
+    return {
+        'arenaUniqueID': 3112348790185543L,
+        'common': {
+            'arenaTypeID': 5,
+            'duration': 423.5,
+            'winnerTeam': 1,
+            'bonusType': 1,
+            'finishReason': None,
+            'isPremium': True,
+            'gasAttack': False,
+        },
+        'players': {
+            1001: {'name': 'Игрок', 'clanAbbrev': '', 'team': 1, 'realm': 'RU'},
+            1002: {'name': 'user_2', 'clanAbbrev': 'KOPM', 'team': 2, 'realm': 'RU'},
+        },
+        'vehicles': {
+            (1, 15): [{'damageDealt': 1500, 'xp': 800, 'achievements': (1, 2, 3)}],
+            (2, 16): [{'damageDealt': 0, 'xp': 120, 'achievements': ()}],
+        },
+        'avatars': {1001: {'avatarDamageDealt': 0, 'fairplayViolations': (0, 0, 0)}},
+    }
+
+
+class BattleEncoderParityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.encoder = BattleResultsEncoder()
+
+    def assertParity(self, obj):
+        encoded = self.encoder.encode(obj)
+        self.assertTrue(isinstance(encoded, str))
+        self.assertEqual(json.loads(encoded), json.loads(legacy_encode(obj)))
+        return encoded
+
+    def test_battle_results(self):
+        self.assertParity(sample_results())
+
+    def test_repeated_encoding_uses_cache_consistently(self):
+        first = self.encoder.encode(sample_results())
+        self.assertEqual(self.encoder.encode(sample_results()), first)
+
+    def test_scalars(self):
+        for value in (0, -7, 2 ** 31 - 1, 0.1, 1e-7, 123456789.125, -0.0, True, False, None):
+            self.assertEqual(self.assertParity([value]), legacy_encode([value]))
+
+    def test_long_is_string(self):
+        encoded = self.assertParity({'id': 12345678901234567890L, 'small': 5L})
+        self.assertEqual(json.loads(encoded), {'id': '12345678901234567890', 'small': '5'})
+
+    def test_non_string_keys(self):
+        self.assertParity({1: 'a', (1, 2): 'b', None: 'c', 2.5: 'd', True: 'e', VehicleKey(1, 2): 'f'})
+
+    def test_byte_strings(self):
+        self.assertParity({
+            'utf8': 'Танк',
+            'cp1251': u'Танк'.encode('cp1251'),
+            'latin1': '\xe9\xff\x00',
+            'escapes': 'quote " backslash \\ newline \n tab \t bell \x07',
+        })
+
+    def test_non_ascii_byte_keys(self):
+        # json.dumps in the previous converter failed on these keys next to non-ASCII values
+        encoded = self.encoder.encode({'Ключ': 'Танк'})
+        self.assertEqual(json.loads(encoded), {u'Ключ': u'Танк'})
+
+    def test_ascii_unicode(self):
+        self.assertParity({u'key': u'value', 'list': [u'a', u'b']})
+
+    def test_non_ascii_unicode(self):
+        # The previous converter failed on such keys and wrote such values as repr() text
+        encoded = self.encoder.encode({u'Ключ': u'Значение'})
+        self.assertEqual(json.loads(encoded), {u'Ключ': u'Значение'})
+
+    def test_containers(self):
+        self.assertParity({
+            'set': set([3]),
+            'frozenset': frozenset(['x']),
+            'tuple': (1, (2, 3), []),
+            'empty': [{}, [], (), set()],
+            'nested': [[[{'a': [1]}]]],
+            'ordered': OrderedDict([('b', 1), ('a', 2)]),
+            'namedtuple': VehicleKey(2, 16),
+        })
+
+    def test_ordered_dict_keeps_order(self):
+        self.assertEqual(self.encoder.encode(OrderedDict([('b', 1), ('a', 2)])), '{"b":1,"a":2}')
+
+    def test_custom_objects(self):
+        self.assertParity({'vehicle': Vehicle(), 'type': int})
+
+    def test_encode_to_matches_encode(self):
+        results = sample_results()
+        results['players'].update((2000 + i, {'name': 'p%d' % i, 'team': i % 2}) for i in range(200))
+        chunks = []
+        self.encoder.encode_to(results, chunks.append, flush_fragments=16)
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join(chunks), self.encoder.encode(results))
+
+    def test_string_cache_limit(self):
+        encoder = BattleResultsEncoder(max_cached_strings=4)
+        values = ['s%d' % i for i in range(10)]
+        self.assertEqual(json.loads(encoder.encode(values)), values)
+        self.assertTrue(len(encoder._strings) <= 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
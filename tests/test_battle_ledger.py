@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+BattleLedger ring persistence, eviction and recovery of damaged files
+(Python 2.7)
+
+Run from the repository root:
+  python -m unittest discover -s tests
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from battle_ledger import BattleLedger
+
+
+class BattleLedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'processed_battles.ledger')
+        self.ledger = None
+        self.errors = []
+
+    def tearDown(self):
+        if self.ledger is not None:
+            self.ledger.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def open(self, capacity=4):
+        if self.ledger is not None:
+            self.ledger.close()
+        self.ledger = BattleLedger(self.path, capacity=capacity, log_error=self.errors.append)
+        return self.ledger
+
+    def test_battles_survive_reopen(self):
+        ledger = self.open()
+        self.assertTrue(ledger.add(101))
+        self.assertTrue(ledger.add('102'))
+        self.assertFalse(ledger.add(101))
+        self.assertFalse(ledger.add('not an id'))
+
+        ledger = self.open()
+        self.assertEqual(len(ledger), 2)
+        self.assertTrue('101' in ledger)
+        self.assertTrue(102 in ledger)
+        self.assertEqual(os.path.getsize(self.path), 8 + 4 * 8)
+
+    def test_oldest_battles_are_evicted(self):
+        ledger = self.open()
+        for arena_id in range(101, 107):
+            ledger.add(arena_id)
+        self.assertEqual(sorted(ledger._ids), [103, 104, 105, 106])
+
+        # The ring order survives reopen: the next eviction drops the oldest
+        ledger = self.open()
+        ledger.add(107)
+        self.assertEqual(sorted(ledger._ids), [104, 105, 106, 107])
+
+    def test_torn_file_keeps_readable_slots(self):
+        ledger = self.open()
+        for arena_id in (101, 102, 103):
+            ledger.add(arena_id)
+        ledger.close()
+        self.ledger = None
+        with open(self.path, 'r+b') as f:
+            f.truncate(8 + 2 * 8 + 3)
+
+        ledger = self.open()
+        self.assertEqual(sorted(ledger._ids), [101, 102])
+        self.assertEqual(os.path.getsize(self.path), 8 + 4 * 8)
+        ledger.add(104)
+        ledger = self.open()
+        self.assertEqual(sorted(ledger._ids), [101, 102, 104])
+        self.assertEqual(self.errors, [])
+
+    def test_capacity_change_keeps_latest(self):
+        ledger = self.open(capacity=4)
+        for arena_id in range(101, 105):
+            ledger.add(arena_id)
+
+        ledger = self.open(capacity=2)
+        self.assertEqual(sorted(ledger._ids), [103, 104])
+        ledger.add(105)
+        self.assertEqual(sorted(ledger._ids), [104, 105])
+        self.assertEqual(os.path.getsize(self.path), 8 + 2 * 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Logistic and weighted fits and evaluation of tools/calibrate_model.py on
+synthetic battles (Python 2.7)
+
+Run from the repository root:
+  python -m unittest discover -s tests
+"""
+import os
+import sys
+import math
+import random
+import unittest
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'tools'))
+
+from battle_tracker import TeamAggregate
+from win_models import LogisticModel, WeightedModel, VEHICLE_CLASSES
+from calibrate_model import BattleColumns, extract_battle, fit_logistic, fit_weighted, evaluate
+
+CLASS_WEIGHTS = {'heavyTank': 2.0, 'SPG': 0.5}
+TIER_WEIGHTS = {8: 1.0, 9: 1.0, 10: 1.5}
+
+
+def team(avg_rating, size=15):
+    aggregate = TeamAggregate()
+    for _ in range(size):
+        aggregate.add(avg_rating)
+    return aggregate
+
+
+def synthetic_columns(count, scale, bias, seed=1):
+    """Battles whose outcome follows sigmoid((ally_avg - enemy_avg) / scale + bias)"""
+    rng = random.Random(seed)
+    columns = BattleColumns()
+    for _ in range(count):
+        ally_avg = rng.uniform(3000, 7000)
+        enemy_avg = rng.uniform(3000, 7000)
+        p = 1.0 / (1.0 + math.exp(-((ally_avg - enemy_avg) / scale + bias)))
+        columns.append(team(ally_avg), team(enemy_avg), rng.random() < p)
+    return columns
+
+
+def synthetic_vehicle_columns(count, seed=1):
+    """Battles of one vehicle per class whose outcome follows the weighted model with known weights"""
+    rng = random.Random(seed)
+    columns = BattleColumns()
+    for _ in range(count):
+        vehicles = []
+        averages = []
+        for is_ally in (True, False):
+            weighted_sum = weight_sum = 0.0
+            for vehicle_class in VEHICLE_CLASSES:
+                tier = rng.choice(sorted(TIER_WEIGHTS))
+                rating = rng.uniform(100, 10000)
+                weight = CLASS_WEIGHTS.get(vehicle_class, 1.0) * TIER_WEIGHTS[tier]
+                weighted_sum += weight * rating
+                weight_sum += weight
+                vehicles.append((is_ally, rating, tier, vehicle_class))
+            averages.append(weighted_sum / weight_sum)
+        ally = TeamAggregate()
+        enemy = TeamAggregate()
+        for is_ally, rating, _, _ in vehicles:
+            (ally if is_ally else enemy).add(rating)
+        won = rng.random() < averages[0] / (averages[0] + averages[1])
+        columns.append(ally, enemy, won, vehicles)
+    return columns
+
+
+class CalibrateModelTest(unittest.TestCase):
+
+    def test_columns_round_trip(self):
+        columns = BattleColumns()
+        columns.append(team(5000.0), team(4500.0, size=14), True)
+        self.assertEqual(len(columns), 1)
+        ally, enemy = columns.aggregates(0)
+        self.assertAlmostEqual(ally.avg_rating(), 5000.0)
+        self.assertAlmostEqual(enemy.avg_rating(), 4500.0)
+        self.assertEqual((ally.total, enemy.total, ally.rated, enemy.rated), (15, 14, 15, 14))
+
+    def test_fit_recovers_known_scale(self):
+        columns = synthetic_columns(4000, scale=600.0, bias=0.2)
+        scale, bias = fit_logistic(columns)
+        self.assertTrue(abs(scale - 600.0) < 60.0, scale)
+        self.assertTrue(abs(bias - 0.2) < 0.15, bias)
+
+    def test_no_signal_keeps_default_scale(self):
+        columns = BattleColumns()
+        for i in range(200):
+            # The stronger team always loses
+            diff = 100.0 * (i % 10 + 1)
+            columns.append(team(5000.0 + diff), team(5000.0), False)
+            columns.append(team(5000.0), team(5000.0 + diff), True)
+        scale, _ = fit_logistic(columns)
+        self.assertEqual(scale, LogisticModel.DEFAULT_PARAMS['scale'])
+
+    def test_fitted_model_scores_better_than_default(self):
+        columns = synthetic_columns(2000, scale=400.0, bias=0.0, seed=2)
+        scale, bias = fit_logistic(columns)
+        fitted = evaluate(LogisticModel({'scale': scale, 'bias': bias, 'alive_coef': 0.0}), columns, 10)
+        default = evaluate(LogisticModel({'alive_coef': 0.0}), columns, 10)
+        self.assertTrue(fitted['log_loss'] < default['log_loss'])
+        self.assertTrue(fitted['brier'] < default['brier'])
+        self.assertEqual(sum(count for _, _, count in fitted['calibration']), len(columns))
+        # A well-fitted model is calibrated: observed win rate follows the prediction per bin
+        for predicted, observed, count in fitted['calibration']:
+            if count >= 100:
+                self.assertTrue(abs(predicted - observed) < 0.1, (predicted, observed, count))
+
+    def test_extract_battle_resolves_vehicle_types(self):
+        results = {
+            'common': {'winnerTeam': 1},
+            'personal': {'avatar': {'accountDBID': 1001}},
+            'players': {'1001': {'team': 1}, '1002': {'team': 2}, '1003': {'team': 2}},
+            'vehicles': {'15': [{'accountDBID': 1001, 'typeCompDescr': 7425}],
+                         '16': [{'accountDBID': 1002, 'typeCompDescr': 5137}]},
+        }
+        battle = extract_battle(results, {7425: (10, 'heavyTank'), 5137: (8, 'SPG')})
+        self.assertEqual(battle[3], {1001: (1, 10, 'heavyTank'), 1002: (2, 8, 'SPG'), 1003: (2, None, None)})
+
+    def test_vehicle_columns_use_model_weights(self):
+        columns = BattleColumns()
+        columns.append(team(5000.0), team(5000.0), True,
+                       [(True, 6000.0, 10, 'heavyTank'), (True, 4000.0, 8, 'SPG'),
+                        (False, 5000.0, 10, 'heavyTank'), (False, 5000.0, 8, None)])
+        self.assertEqual(list(columns.vehicles(0))[3], (False, 5000.0, 8, None))
+        model = WeightedModel({'tier_weights': [1.0] * 11, 'class_weights': {'heavyTank': 3.0, 'SPG': 1.0}})
+        ally, enemy = columns.aggregates(0, model)
+        self.assertAlmostEqual(ally.weighted_avg_rating(), (3 * 6000.0 + 4000.0) / 4)
+        self.assertAlmostEqual(enemy.weighted_avg_rating(), 5000.0)
+        self.assertEqual(ally.total_weight, 4.0)
+
+    def test_weighted_fit_without_vehicle_types(self):
+        self.assertEqual(fit_weighted(synthetic_columns(100, scale=400.0, bias=0.0)), None)
+
+    def test_weighted_fit_recovers_weight_order(self):
+        columns = synthetic_vehicle_columns(4000)
+        params = fit_weighted(columns)
+        tier_weights = params['tier_weights']
+        class_weights = params['class_weights']
+        self.assertEqual(class_weights['mediumTank'], 1.0)
+        self.assertTrue(class_weights['heavyTank'] > 1.5, class_weights)
+        self.assertTrue(class_weights['SPG'] < 0.75, class_weights)
+        self.assertTrue(tier_weights[9] / tier_weights[7] > 1.2, tier_weights)
+        fitted = evaluate(WeightedModel(params), columns, 10)
+        default = evaluate(WeightedModel(), columns, 10)
+        self.assertTrue(fitted['log_loss'] < default['log_loss'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+HttpTransport against a local stand-in server (Python 2.7)
+
+Run from the repository root:
+  python -m unittest discover -s tests
+"""
+import os
+import sys
+import json
+import threading
+import unittest
+import BaseHTTPServer
+import SocketServer
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from http_transport import HttpTransport, HTTPError, BodyError
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Echo handler: answers with what it received as JSON"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    raise IOError('client closed mid-body')
+                size = int(line.strip().split(';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return ''.join(chunks), len(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length', 0))), 0
+
+    def do_POST(self):
+        try:
+            body, chunk_count = self.read_body()
+        except (IOError, ValueError):
+            self.server.aborted.append(self.path)
+            self.close_connection = True
+            return
+        code = self.status_code()
+        if code != 200:
+            self.respond(code, {'error': 'rejected', 'length': len(body)})
+            return
+        self.server.received.append(body)
+        self.respond(200, {
+            'path': self.path,
+            'length': len(body),
+            'chunks': chunk_count,
+            'content_length': self.headers.get('Content-Length'),
+        })
+        # Server-side idle close without "Connection: close" - the client finds out on reuse
+        if self.path == '/close-after':
+            self.close_connection = True
+
+    def do_GET(self):
+        self.respond(self.status_code(), {'path': self.path})
+
+    def status_code(self):
+        """/status/<code> answers with that code, everything else with 200"""
+        if self.path.startswith('/status/'):
+            return int(self.path[len('/status/'):])
+        return 200
+
+    def respond(self, code, payload):
+        data = json.dumps(payload)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.received = []
+        self.aborted = []
+
+
+class HttpTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer()
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.base = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.transport = HttpTransport(timeout=5)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        return self.transport.get_stats()[self.base]
+
+    def test_streamed_body_arrives_intact(self):
+        parts = ['part %d;' % i * 100 for i in range(50)]
+        response = self.transport.request('POST', self.base + '/upload', body=lambda: iter(parts))
+        self.assertEqual(response.status, 200)
+        result = response.json()
+        self.assertEqual(result['chunks'], 50)
+        self.assertEqual(result['content_length'], None)
+        self.assertEqual(self.server.received, [''.join(parts)])
+
+    def test_empty_chunks_are_skipped(self):
+        response = self.transport.request('POST', self.base + '/upload', body=lambda: iter(['', 'a', '', 'b']))
+        self.assertEqual(response.json()['chunks'], 2)
+        self.assertEqual(self.server.received, ['ab'])
+
+    def test_string_body_uses_content_length(self):
+        response = self.transport.request('POST', self.base + '/upload', body='{"a":1}',
+                                          headers={'Content-Type': 'application/json'})
+        self.assertEqual(response.json(), {'path': '/upload', 'length': 7, 'chunks': 0, 'content_length': '7'})
+
+    def test_keep_alive_connection_is_reused(self):
+        for _ in range(3):
+            self.transport.request('GET', self.base + '/ping')
+        stats = self.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['connects'], 1)
+        self.assertEqual(stats['reused'], 2)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_reconnects_when_server_closed_idle_connection(self):
+        self.transport.request('POST', self.base + '/close-after', body='x')
+        response = self.transport.request('POST', self.base + '/upload', body=lambda: iter(['payload']))
+        self.assertEqual(response.status, 200)
+        stats = self.stats()
+        self.assertEqual(stats['reconnects'], 1)
+        self.assertEqual(stats['connects'], 2)
+        self.assertEqual(self.server.received, ['x', 'payload'])
+
+    def test_body_error_aborts_request(self):
+        def body():
+            yield 'first'
+            raise ValueError('encoder failed')
+
+        try:
+            self.transport.request('POST', self.base + '/upload', body=body)
+            self.fail('BodyError expected')
+        except BodyError as e:
+            self.assertTrue(isinstance(e.error, ValueError))
+        self.assertEqual(self.server.received, [])
+        stats = self.stats()
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['idle'], 0)
+        # The broken connection is not reused
+        self.assertEqual(self.transport.request('GET', self.base + '/ping').status, 200)
+        self.assertEqual(self.stats()['connects'], 2)
+
+    def test_error_status_raises_http_error(self):
+        try:
+            self.transport.request('POST', self.base + '/status/413', body=lambda: iter(['abc', 'de']))
+            self.fail('HTTPError expected')
+        except HTTPError as e:
+            self.assertEqual(e.code, 413)
+            self.assertEqual(e.json(), {'error': 'rejected', 'length': 5})
+        try:
+            self.transport.request('GET', self.base + '/status/415')
+            self.fail('HTTPError expected')
+        except HTTPError as e:
+            self.assertEqual(e.code, 415)
+        self.assertEqual(self.stats()['errors'], 2)
+        # The connection stays usable after an error response
+        self.assertEqual(self.stats()['connects'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
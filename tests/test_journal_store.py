@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+JournalStore persistence and crash recovery (Python 2.7)
+
+Run from the repository root:
+  python -m unittest discover -s tests
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from journal_store import JournalStore
+
+
+class JournalStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'store.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def reopen(self, store=None, path=None):
+        if store is not None:
+            store.close()
+        return JournalStore(path or self.path, sync=False)
+
+    def test_values_survive_reopen(self):
+        store = self.reopen()
+        store.put('a', 'first')
+        store.put('b', 'second')
+        store.put('a', 'replaced')
+        store.delete('b')
+        store = self.reopen(store)
+        self.assertEqual(store.keys(), ['a'])
+        self.assertEqual(store.get('a'), 'replaced')
+        self.assertEqual(store.dropped_bytes, 0)
+        store.close()
+
+    def test_truncated_tail_is_dropped(self):
+        store = self.reopen()
+        store.put('a', 'kept')
+        store.put('b', 'x' * 100)
+        store.close()
+        size = os.path.getsize(self.path)
+        with open(self.path, 'r+b') as f:
+            f.truncate(size - 10)
+
+        store = self.reopen()
+        self.assertEqual(store.keys(), ['a'])
+        self.assertEqual(store.get('a'), 'kept')
+        self.assertTrue(store.dropped_bytes > 0)
+        # New records go after the last intact one and survive the next reopen
+        store.put('c', 'after recovery')
+        store = self.reopen(store)
+        self.assertEqual(sorted(store.keys()), ['a', 'c'])
+        self.assertEqual(store.get('c'), 'after recovery')
+        self.assertEqual(store.dropped_bytes, 0)
+        store.close()
+
+    def test_corrupt_record_stops_replay(self):
+        store = self.reopen()
+        store.put('a', 'kept')
+        store.put('b', 'damaged value')
+        store.close()
+        with open(self.path, 'r+b') as f:
+            f.seek(-3, os.SEEK_END)
+            f.write('XYZ')
+
+        store = self.reopen()
+        self.assertEqual(store.keys(), ['a'])
+        self.assertIsNone(store.get('b'))
+        store.close()
+
+    def test_crash_during_put_stream(self):
+        store = self.reopen()
+        store.put('a', 'kept')
+        snapshot = os.path.join(self.dir, 'crashed.journal')
+
+        def produce(write):
+            write('partial ')
+            # State of the file if the client died here: header still has zero length/CRC
+            store._file.flush()
+            shutil.copy(self.path, snapshot)
+            write('payload')
+
+        store.put_stream('b', produce)
+        self.assertEqual(''.join(store.iter_value('b')), 'partial payload')
+        store.close()
+
+        crashed = self.reopen(path=snapshot)
+        self.assertEqual(crashed.keys(), ['a'])
+        self.assertTrue(crashed.dropped_bytes > 0)
+        crashed.close()
+
+    def test_failed_put_stream_is_rolled_back(self):
+        store = self.reopen()
+        store.put('a', 'kept')
+
+        def produce(write):
+            write('half')
+            raise ValueError('encoder failed')
+
+        self.assertRaises(ValueError, store.put_stream, 'b', produce)
+        self.assertNotIn('b', store)
+        store.put('c', 'next')
+        store = self.reopen(store)
+        self.assertEqual(sorted(store.keys()), ['a', 'c'])
+        self.assertEqual(store.dropped_bytes, 0)
+        store.close()
+
+    def test_iter_value_detects_corruption(self):
+        store = self.reopen()
+        store.put('a', 'v' * 1000)
+        with open(self.path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write('!')
+        chunks = store.iter_value('a', chunk_size=100)
+        self.assertRaises(IOError, list, chunks)
+        store.close()
+
+    def test_compaction_keeps_live_records(self):
+        store = JournalStore(self.path, sync=False, compact_min_bytes=0, compact_ratio=0.1)
+        for i in range(20):
+            store.put('k%d' % i, 'value %d' % i)
+        for i in range(15):
+            store.delete('k%d' % i)
+        size_before = os.path.getsize(self.path)
+        self.assertTrue(store.maybe_compact())
+        self.assertTrue(os.path.getsize(self.path) < size_before)
+        store = self.reopen(store)
+        self.assertEqual(sorted(store.keys()), ['k%d' % i for i in range(15, 20)])
+        self.assertEqual(store.get('k19'), 'value 19')
+        store.close()
+
+    def test_interrupted_compaction_restores_backup(self):
+        store = self.reopen()
+        store.put('a', 'kept')
+        store.close()
+        # replace_file on Windows moves the old journal to .bak before the rename
+        os.rename(self.path, self.path + '.bak')
+        store = self.reopen()
+        self.assertEqual(store.get('a'), 'kept')
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
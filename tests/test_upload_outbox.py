@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+UploadOutbox batching and retry state machine (Python 2.7)
+
+Run from the repository root:
+  python -m unittest discover -s tests
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from worker_pool import Future
+from upload_outbox import UploadOutbox, SEND_OK, SEND_REJECTED, SEND_RETRY
+
+
+class FakeSender(object):
+    """send_fn stand-in: records batches and answers with scripted statuses"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches = []   # [[(entry_id, payload), ...], ...]
+        self.replies = []   # callable(entry_ids) -> statuses, or Exception; then self.default
+        self.default = lambda entry_ids: dict((entry_id, SEND_OK) for entry_id in entry_ids)
+
+    def __call__(self, entries):
+        batch = [(entry_id, ''.join(reader())) for entry_id, reader in entries]
+        with self.lock:
+            self.batches.append(batch)
+            reply = self.replies.pop(0) if self.replies else self.default
+        future = Future()
+        if isinstance(reply, Exception):
+            future.set_error(reply)
+        else:
+            future.set_result(reply([entry_id for entry_id, _ in batch]))
+        return future
+
+    def sent_ids(self):
+        with self.lock:
+            return [[entry_id for entry_id, _ in batch] for batch in self.batches]
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+class UploadOutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'outbox.journal')
+        self.sender = FakeSender()
+        self.outbox = None
+
+    def tearDown(self):
+        if self.outbox is not None:
+            self.outbox.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def open(self, **kwargs):
+        options = dict(base_delay=0.05, max_delay=0.2, linger=0)
+        options.update(kwargs)
+        self.outbox = UploadOutbox(self.sender, path=self.path, **options)
+        return self.outbox
+
+    def test_entries_queued_while_paused_go_in_one_batch(self):
+        outbox = self.open()
+        outbox.set_paused(True, 'battle')
+        outbox.start()
+        for i in range(5):
+            outbox.enqueue('e%d' % i, 'payload %d' % i)
+        time.sleep(0.1)
+        self.assertEqual(self.sender.sent_ids(), [])
+
+        outbox.set_paused(False, 'battle')
+        self.assertTrue(wait_for(lambda: outbox.pending_count() == 0))
+        self.assertEqual(self.sender.sent_ids(), [['e0', 'e1', 'e2', 'e3', 'e4']])
+        self.assertEqual(dict(self.sender.batches[0])['e3'], 'payload 3')
+
+    def test_batch_limits_split_batches(self):
+        outbox = self.open(batch_max_items=2)
+        outbox.set_paused(True, 'battle')
+        outbox.start()
+        for i in range(5):
+            outbox.enqueue('e%d' % i, 'x')
+        outbox.set_paused(False, 'battle')
+        self.assertTrue(wait_for(lambda: outbox.pending_count() == 0))
+        sent = self.sender.sent_ids()
+        self.assertEqual([len(batch) for batch in sent], [2, 2, 1])
+        self.assertEqual(sorted(sum(sent, [])), ['e%d' % i for i in range(5)])
+
+    def test_all_pause_reasons_must_be_cleared(self):
+        outbox = self.open()
+        outbox.set_paused(True, 'battle')
+        outbox.set_paused(True, 'bootstrap')
+        outbox.start()
+        outbox.enqueue('e0', 'x')
+        outbox.set_paused(False, 'battle')
+        time.sleep(0.1)
+        self.assertEqual(self.sender.sent_ids(), [])
+        outbox.set_paused(False, 'bootstrap')
+        self.assertTrue(wait_for(lambda: outbox.pending_count() == 0))
+
+    def test_partial_statuses(self):
+        # e0 delivered, e1 rejected, e2 retry, e3 missing from the reply - retried too
+        self.sender.replies.append(lambda ids: {'e0': SEND_OK, 'e1': SEND_REJECTED, 'e2': SEND_RETRY})
+        outbox = self.open()
+        outbox.set_paused(True, 'battle')
+        outbox.start()
+        for i in range(4):
+            outbox.enqueue('e%d' % i, 'x')
+        outbox.set_paused(False, 'battle')
+
+        self.assertTrue(wait_for(lambda: outbox.pending_count() == 0))
+        sent = self.sender.sent_ids()
+        self.assertEqual(sent[0], ['e0', 'e1', 'e2', 'e3'])
+        self.assertEqual(sorted(sum(sent[1:], [])), ['e2', 'e3'])
+        self.assertTrue(wait_for(lambda: outbox.get_stats()['retrying'] == 0))
+
+    def test_failed_batch_backs_off_and_retries(self):
+        self.sender.replies.extend([IOError('connection refused'), IOError('connection refused')])
+        outbox = self.open(base_delay=0.1, max_delay=1.0)
+        outbox.start()
+        started = time.time()
+        outbox.enqueue('e0', 'x')
+
+        self.assertTrue(wait_for(lambda: outbox.pending_count() == 0))
+        elapsed = time.time() - started
+        self.assertEqual(self.sender.sent_ids(), [['e0'], ['e0'], ['e0']])
+        # Two failures: ~0.1s then ~0.2s (+-20% jitter)
+        self.assertTrue(elapsed >= 0.24, elapsed)
+
+    def test_retrying_entries_are_reported(self):
+        self.sender.default = lambda ids: {}
+        outbox = self.open(base_delay=10.0, max_delay=10.0)
+        outbox.start()
+        outbox.enqueue('e0', 'x')
+        self.assertTrue(wait_for(lambda: outbox.get_stats()['retrying'] == 1))
+        stats = outbox.get_stats()
+        self.assertEqual(stats['pending'], 1)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(len(self.sender.sent_ids()), 1)
+
+    def test_unsent_entries_survive_reopen(self):
+        outbox = self.open()
+        outbox.enqueue('e0', 'first')
+        outbox.enqueue_stream('e1', lambda write: (write('sec'), write('ond')))
+        outbox.close()
+        self.assertEqual(self.sender.sent_ids(), [])
+
+        outbox = self.open()
+        self.assertEqual(outbox.pending_count(), 2)
+        outbox.start()
+        self.assertTrue(wait_for(lambda: outbox.pending_count() == 0))
+        sent = dict(sum(self.sender.batches, []))
+        self.assertEqual(sent, {'e0': 'first', 'e1': 'second'})
+
+    def test_reenqueue_replaces_payload(self):
+        outbox = self.open()
+        outbox.enqueue('e0', 'old')
+        outbox.enqueue('e0', 'new')
+        outbox.start()
+        self.assertTrue(wait_for(lambda: outbox.pending_count() == 0))
+        self.assertEqual(self.sender.batches, [[('e0', 'new')]])
+
+    def test_reenqueue_during_send_keeps_new_payload(self):
+        sending = threading.Event()
+        release = threading.Event()
+
+        def blocked(entry_ids):
+            sending.set()
+            release.wait(5.0)
+            return dict((entry_id, SEND_OK) for entry_id in entry_ids)
+
+        self.sender.replies.append(blocked)
+        outbox = self.open()
+        outbox.start()
+        outbox.enqueue('e0', 'old')
+        self.assertTrue(sending.wait(5.0))
+        outbox.enqueue('e0', 'new')
+        release.set()
+
+        # The old batch's success must not delete the new payload
+        self.assertTrue(wait_for(lambda: len(self.sender.batches) == 2))
+        self.assertTrue(wait_for(lambda: outbox.pending_count() == 0))
+        self.assertEqual(self.sender.batches, [[('e0', 'old')], [('e0', 'new')]])
+        self.assertEqual(outbox.get_stats()['retrying'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
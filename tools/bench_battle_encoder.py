@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmark for battle_encoder (Python 2.7)
+
+Compares the single-pass encoder with the previous converter
+(make_serializable + json.dumps) on captured battle results.
+
+Captured payloads are read from files or directories given on the command line:
+  *.pickle / *.pkl - results dict as received by the mod, saved with
+                     cPickle.dump(results, f, 2) (keeps byte strings, tuples, longs)
+  *.json           - results already converted to JSON (types are approximate)
+
+Usage:
+  python bench_battle_encoder.py <captured_dir_or_file> [...] [--repeat N]
+"""
+import os
+import sys
+import json
+import time
+import cPickle
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from battle_encoder import BattleResultsEncoder
+
+
+def legacy_make_serializable(obj, is_key=False):
+    """Previous converter from save_raw_battle_results (baseline)"""
+    if isinstance(obj, dict):
+        return {legacy_make_serializable(k, is_key=True): legacy_make_serializable(v) for k, v in obj.items()}
+    elif is_key:
+        return str(obj)
+    elif isinstance(obj, (list, tuple)):
+        return [legacy_make_serializable(item) for item in obj]
+    elif isinstance(obj, (int, float, bool, type(None))):
+        return obj
+    elif isinstance(obj, bytes):
+        try:
+            return obj.decode('utf-8')
+        except UnicodeDecodeError:
+            try:
+                return obj.decode('cp1251')
+            except UnicodeDecodeError:
+                return obj.decode('latin-1')
+    elif isinstance(obj, (frozenset, set)):
+        return [legacy_make_serializable(item) for item in obj]
+    else:
+        try:
+            return str(obj).decode('utf-8')
+        except:
+            return repr(obj)
+
+
+def legacy_encode(results):
+    raw_json = json.dumps(legacy_make_serializable(results), ensure_ascii=False, separators=(',', ':'))
+    if isinstance(raw_json, unicode):
+        raw_json = raw_json.encode('utf-8')
+    return raw_json
+
+
+def iter_payload_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(('.pickle', '.pkl', '.json')):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def load_payload(path):
+    if path.endswith('.json'):
+        with open(path, 'rb') as f:
+            return json.load(f)
+    with open(path, 'rb') as f:
+        return cPickle.load(f)
+
+
+def measure(encode, payloads, repeat):
+    total_bytes = 0
+    started = time.clock()
+    for _ in range(repeat):
+        for payload in payloads:
+            total_bytes += len(encode(payload))
+    return time.clock() - started, total_bytes
+
+
+def main(argv):
+    repeat = 5
+    if '--repeat' in argv:
+        pos = argv.index('--repeat')
+        repeat = int(argv[pos + 1])
+        del argv[pos:pos + 2]
+    if not argv:
+        print(__doc__)
+        return 1
+
+    payloads = [load_payload(path) for path in iter_payload_files(argv)]
+    if not payloads:
+        print("ERROR: no captured payloads found")
+        return 1
+
+    encoder = BattleResultsEncoder()
+
+    # Проверка совместимости формата с прежним конвертером
+    mismatches = 0
+    for payload in payloads:
+        if json.loads(encoder.encode(payload)) != json.loads(legacy_encode(payload)):
+            mismatches += 1
+
+    print("=" * 70)
+    print("Battle results encoder benchmark")
+    print("=" * 70)
+    print("Payloads: %d, repeat: %d, output mismatches vs legacy: %d" % (len(payloads), repeat, mismatches))
+
+    results = []
+    for name, encode in (('legacy (make_serializable + json.dumps)', legacy_encode),
+                         ('battle_encoder (single pass)', encoder.encode)):
+        elapsed, total_bytes = measure(encode, payloads, repeat)
+        battles = len(payloads) * repeat
+        results.append(elapsed)
+        print("\n%s" % name)
+        print("  %.3f s total, %.2f ms/battle, %.1f MB/s" % (
+            elapsed, elapsed * 1000.0 / battles, total_bytes / (1024.0 * 1024.0) / max(elapsed, 1e-9)))
+
+    print("\nSpeedup: %.2fx" % (results[0] / max(results[1], 1e-9)))
+    print("=" * 70)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,525 @@
+# -*- coding: utf-8 -*-
+"""
+Offline calibration of the win chance models (Python 2.7)
+
+Streams archived battle results one payload at a time, extracts the team
+rosters (with vehicle tier and class) and the outcome, looks up player ratings
+in player_index.db and keeps only compact per-battle and per-vehicle columns
+(array module) in memory. Then fits the logistic model and the tier/class
+weights of the weighted model, reports Brier score, log loss and a calibration
+table for every model and writes the parameter file the mod loads
+(mods/configs/mod_winchance/model_params.json).
+
+Battle results are read from the mod's battle archive (--archive, segments are
+scanned sequentially) and/or from files or directories given on the command line:
+  *.pickle / *.pkl - results dict as received by the mod (cPickle.dump(results, f, 2))
+  *.json           - results converted to JSON (raw_battle_results dumps)
+
+Ratings come from the mod's player index: the latest snapshot taken before the
+battle, otherwise the nearest one after it, otherwise the current rating.
+Battle results only carry typeCompDescr; tier and class come from
+vehicle_types.json, which the mod fills in for every archived battle.
+
+Usage:
+  python calibrate_model.py [<results_dir_or_file> ...] [--archive battle_archive]
+                            [--index player_index.db] [--vehicle-types vehicle_types.json]
+                            [--out model_params.json] [--bins 10]
+"""
+import os
+import sys
+import json
+import math
+import time
+import sqlite3
+import cPickle
+from array import array
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from battle_tracker import TeamAggregate
+from win_models import create_model, load_vehicle_types, LogisticModel, WeightedModel, VEHICLE_CLASSES
+from battle_archive import BattleArchive
+
+DEFAULT_INDEX_PATH = os.path.join('mods', 'configs', 'mod_winchance', 'player_index.db')
+DEFAULT_ARCHIVE_PATH = os.path.join('mods', 'configs', 'mod_winchance', 'battle_archive')
+DEFAULT_VEHICLE_TYPES_PATH = os.path.join('mods', 'configs', 'mod_winchance', 'vehicle_types.json')
+DEFAULT_PARAMS_PATH = os.path.join('mods', 'configs', 'mod_winchance', 'model_params.json')
+
+# Vehicle class codes in the per-vehicle columns (0 - unknown)
+CLASS_NAMES = (None,) + VEHICLE_CLASSES
+CLASS_CODES = dict((vehicle_class, code) for code, vehicle_class in enumerate(CLASS_NAMES))
+
+
+def iter_payload_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(('.pickle', '.pkl', '.json')):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def load_payload(path):
+    if path.endswith('.json'):
+        with open(path, 'rb') as f:
+            return json.load(f)
+    with open(path, 'rb') as f:
+        return cPickle.load(f)
+
+
+def iter_archive(archive_path):
+    """Yields battle results dicts from the battle archive in write order"""
+    archive = BattleArchive(archive_path, read_only=True,
+                            log_error=lambda msg: sys.stderr.write(msg + "\n"))
+    try:
+        for arena_id, data in archive.scan():
+            try:
+                yield json.loads(data)
+            except ValueError as e:
+                sys.stderr.write("skip archived battle %s: %s\n" % (arena_id, e))
+    finally:
+        archive.close()
+
+
+def iter_results(paths, archive_path=None):
+    """Yields battle results dicts one at a time (only one payload in memory)"""
+    if archive_path:
+        for results in iter_archive(archive_path):
+            yield results
+    for path in iter_payload_files(paths):
+        try:
+            yield load_payload(path)
+        except Exception as e:
+            sys.stderr.write("skip %s: %s\n" % (path, e))
+
+
+class RatingLookup(object):
+    """Player rating at battle time from player_index.db"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+
+    def rating_at(self, account_id, timestamp):
+        cur = self.conn.cursor()
+        row = cur.execute(
+            "SELECT global_rating FROM rating_snapshots WHERE account_id = ? AND fetched_at <= ? "
+            "ORDER BY fetched_at DESC LIMIT 1", (account_id, timestamp)).fetchone()
+        if row is None:
+            row = cur.execute(
+                "SELECT global_rating FROM rating_snapshots WHERE account_id = ? "
+                "ORDER BY fetched_at ASC LIMIT 1", (account_id,)).fetchone()
+        if row is None:
+            row = cur.execute("SELECT global_rating FROM players WHERE account_id = ?", (account_id,)).fetchone()
+        return row[0] if row and row[0] else 0
+
+    def close(self):
+        self.conn.close()
+
+
+def extract_vehicles(results):
+    """
+    Returns:
+        dict: account_id -> typeCompDescr from results['vehicles']
+    """
+    vehicles = {}
+    for entries in (results.get('vehicles') or {}).values():
+        for entry in (entries if isinstance(entries, list) else [entries]):
+            if isinstance(entry, dict) and entry.get('accountDBID') and entry.get('typeCompDescr'):
+                vehicles[int(entry['accountDBID'])] = int(entry['typeCompDescr'])
+    return vehicles
+
+
+def extract_battle(results, vehicle_types=None):
+    """
+    Args:
+        vehicle_types (dict): typeCompDescr -> (tier, class), see win_models.load_vehicle_types
+
+    Returns:
+        tuple: (player_team, winner_team, battle_time, {account_id: (team, tier, class)}) or None;
+               tier and class are None when the vehicle type is unknown
+    """
+    common = results.get('common') or {}
+    winner_team = common.get('winnerTeam')
+    players = results.get('players') or {}
+    if not winner_team or not players:
+        return None  # draw or incomplete results
+
+    vehicles = extract_vehicles(results)
+    vehicle_types = vehicle_types or {}
+    roster = {}
+    for account_id, info in players.items():
+        if isinstance(info, dict) and info.get('team'):
+            account_id = int(account_id)
+            tier, vehicle_class = vehicle_types.get(vehicles.get(account_id), (None, None))
+            roster[account_id] = (info['team'], tier, vehicle_class)
+
+    player_team = None
+    personal = results.get('personal') or {}
+    avatar = personal.get('avatar') or {}
+    account_id = avatar.get('accountDBID')
+    if account_id is None:
+        for data in personal.values():
+            if isinstance(data, dict) and 'accountDBID' in data:
+                account_id = data['accountDBID']
+                break
+    if account_id is not None and int(account_id) in roster:
+        player_team = roster[int(account_id)][0]
+    if player_team is None:
+        player_team = 1
+
+    battle_time = common.get('arenaCreateTime') or time.time()
+    return player_team, winner_team, battle_time, roster
+
+
+class BattleColumns(object):
+    """Per-battle and per-vehicle features kept as compact typed arrays"""
+
+    def __init__(self):
+        self.ally_avg = array('d')
+        self.enemy_avg = array('d')
+        self.ally_count = array('H')
+        self.enemy_count = array('H')
+        self.ally_rated = array('H')
+        self.enemy_rated = array('H')
+        self.won = array('b')
+        # Rows with known vehicle types: vehicles vehicle_start[i]..+vehicle_count[i]
+        self.vehicle_start = array('L')
+        self.vehicle_count = array('H')
+        self.vehicle_ally = array('b')
+        self.vehicle_rating = array('d')
+        self.vehicle_tier = array('B')   # 0 - unknown
+        self.vehicle_class = array('B')  # CLASS_CODES
+
+    def __len__(self):
+        return len(self.won)
+
+    def append(self, ally, enemy, won, vehicles=None):
+        """
+        Args:
+            ally, enemy (TeamAggregate): start-of-battle team aggregates
+            won (bool): the ally team won
+            vehicles (list): [(is_ally, rating, tier, class), ...] or None if vehicle types are unknown
+        """
+        self.ally_avg.append(ally.avg_rating())
+        self.enemy_avg.append(enemy.avg_rating())
+        self.ally_count.append(ally.total)
+        self.enemy_count.append(enemy.total)
+        self.ally_rated.append(ally.rated)
+        self.enemy_rated.append(enemy.rated)
+        self.won.append(1 if won else 0)
+        self.vehicle_start.append(len(self.vehicle_rating))
+        self.vehicle_count.append(len(vehicles) if vehicles else 0)
+        for is_ally, rating, tier, vehicle_class in vehicles or ():
+            self.vehicle_ally.append(1 if is_ally else 0)
+            self.vehicle_rating.append(rating)
+            self.vehicle_tier.append(tier or 0)
+            self.vehicle_class.append(CLASS_CODES.get(vehicle_class, 0))
+
+    def vehicles(self, i):
+        """Yields (is_ally, rating, tier, class) of row i (nothing if vehicle types are unknown)"""
+        start = self.vehicle_start[i]
+        for j in range(start, start + self.vehicle_count[i]):
+            yield (bool(self.vehicle_ally[j]), self.vehicle_rating[j],
+                   self.vehicle_tier[j] or None, CLASS_NAMES[self.vehicle_class[j]])
+
+    def aggregates(self, i, model=None):
+        """
+        Rebuilds start-of-battle TeamAggregate pair for row i; with a model and
+        known vehicle types the vehicles are weighted by model.vehicle_weight
+        """
+        if model is not None and self.vehicle_count[i]:
+            ally = TeamAggregate()
+            enemy = TeamAggregate()
+            for is_ally, rating, tier, vehicle_class in self.vehicles(i):
+                (ally if is_ally else enemy).add(rating, model.vehicle_weight(tier, vehicle_class))
+            return ally, enemy
+        teams = []
+        for avg, total, rated in ((self.ally_avg[i], self.ally_count[i], self.ally_rated[i]),
+                                  (self.enemy_avg[i], self.enemy_count[i], self.enemy_rated[i])):
+            team = TeamAggregate()
+            team.total = team.alive = total
+            team.total_weight = team.weight_sum = float(total)
+            team.rated = rated
+            team.rating_sum = avg * rated
+            team.rated_weight = float(rated)
+            team.weighted_sum = avg * rated
+            teams.append(team)
+        return teams
+
+
+def collect(paths, ratings, min_rated, archive_path=None, vehicle_types=None):
+    columns = BattleColumns()
+    skipped = 0
+    for results in iter_results(paths, archive_path):
+        battle = extract_battle(results, vehicle_types)
+        del results
+        if battle is None:
+            skipped += 1
+            continue
+        player_team, winner_team, battle_time, roster = battle
+        ally = TeamAggregate()
+        enemy = TeamAggregate()
+        vehicles = []
+        for account_id, (team, tier, vehicle_class) in roster.items():
+            rating = ratings.rating_at(account_id, battle_time)
+            (ally if team == player_team else enemy).add(rating)
+            vehicles.append((team == player_team, rating, tier, vehicle_class))
+        if ally.rated < min_rated or enemy.rated < min_rated:
+            skipped += 1
+            continue
+        known = any(tier for _, _, tier, _ in vehicles)
+        columns.append(ally, enemy, winner_team == player_team, vehicles if known else None)
+    return columns, skipped
+
+
+def fit_logistic(columns, iterations=50):
+    """
+    Newton-Raphson for P(win) = sigmoid(w * (ally_avg - enemy_avg) + b)
+
+    Returns:
+        tuple: (scale = 1 / w, bias)
+    """
+    w, b = 1.0 / LogisticModel.DEFAULT_PARAMS['scale'], 0.0
+    n = len(columns)
+    for _ in range(iterations):
+        g_w = g_b = h_ww = h_wb = h_bb = 0.0
+        for i in range(n):
+            x = columns.ally_avg[i] - columns.enemy_avg[i]
+            z = w * x + b
+            p = 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, z))))
+            r = p - columns.won[i]
+            g_w += r * x
+            g_b += r
+            s = p * (1.0 - p)
+            h_ww += s * x * x
+            h_wb += s * x
+            h_bb += s
+        # Tiny ridge term keeps the Hessian invertible on small samples
+        h_ww += 1e-6
+        h_bb += 1e-6
+        det = h_ww * h_bb - h_wb * h_wb
+        if det <= 0:
+            break
+        d_w = (h_bb * g_w - h_wb * g_b) / det
+        d_b = (h_ww * g_b - h_wb * g_w) / det
+        w -= d_w
+        b -= d_b
+        if abs(d_w) < 1e-12 and abs(d_b) < 1e-9:
+            break
+    if w <= 0:
+        # Rating does not predict the outcome on this data - keep the default
+        return LogisticModel.DEFAULT_PARAMS['scale'], b
+    return 1.0 / w, b
+
+
+def fit_weighted(columns, rounds=4, min_vehicles=50):
+    """
+    Coordinate descent on log loss over the tier and class weights of the weighted
+    model: P(win) = ally_avg / (ally_avg + enemy_avg) with weighted team averages.
+    Only relative weights matter, so the result is normalized to mediumTank = 1.0
+    and the largest tier weight = 1.0. Tiers and classes seen on fewer than
+    min_vehicles rated vehicles keep their default weights.
+
+    Returns:
+        dict: {'tier_weights': [...], 'class_weights': {...}} or None without vehicle types
+    """
+    defaults = WeightedModel.DEFAULT_PARAMS
+    weights = {'tier': dict((tier, float(w)) for tier, w in enumerate(defaults['tier_weights'], 1)),
+               'class': dict((vehicle_class, float(w)) for vehicle_class, w in defaults['class_weights'].items())}
+    tier_weights = weights['tier']
+    class_weights = weights['class']
+
+    # Per row and team: rated vehicles grouped by (tier, class) -> [rating sum, count]
+    rows = []
+    seen = {}
+    for i in range(len(columns)):
+        groups = ({}, {})
+        for is_ally, rating, tier, vehicle_class in columns.vehicles(i):
+            if rating <= 0 or tier not in tier_weights:
+                continue
+            group = groups[0 if is_ally else 1].setdefault((tier, vehicle_class), [0.0, 0])
+            group[0] += rating
+            group[1] += 1
+            seen[('tier', tier)] = seen.get(('tier', tier), 0) + 1
+            seen[('class', vehicle_class)] = seen.get(('class', vehicle_class), 0) + 1
+        if groups[0] and groups[1]:
+            rows.append((columns.won[i], groups[0].items(), groups[1].items()))
+    if not rows:
+        return None
+
+    def team_avg(groups):
+        weighted_sum = weight_sum = 0.0
+        for (tier, vehicle_class), (rating_sum, count) in groups:
+            weight = tier_weights[tier] * class_weights.get(vehicle_class, 1.0)
+            weighted_sum += weight * rating_sum
+            weight_sum += weight * count
+        return weighted_sum / weight_sum
+
+    def loss():
+        total = 0.0
+        for won, ally, enemy in rows:
+            ally_avg = team_avg(ally)
+            p = ally_avg / (ally_avg + team_avg(enemy))
+            p = min(max(p, 1e-6), 1.0 - 1e-6)
+            total -= math.log(p) if won else math.log(1.0 - p)
+        return total / len(rows)
+
+    # mediumTank is the reference class
+    params = [key for key, count in sorted(seen.items())
+              if count >= min_vehicles and key[1] in weights[key[0]] and key != ('class', 'mediumTank')]
+    best = loss()
+    step = 0.5
+    for _ in range(rounds):
+        for kind, key in params:
+            for factor in (1.0 + step, 1.0 / (1.0 + step)):
+                improved = False
+                while True:
+                    current = weights[kind][key]
+                    candidate = min(20.0, max(0.05, current * factor))
+                    if candidate == current:
+                        break
+                    weights[kind][key] = candidate
+                    value = loss()
+                    if value >= best:
+                        weights[kind][key] = current
+                        break
+                    best = value
+                    improved = True
+                if improved:
+                    break
+        step /= 2.0
+
+    top_tier = max(tier_weights.values())
+    medium = class_weights.get('mediumTank') or 1.0
+    return {
+        'tier_weights': [round(tier_weights[tier] / top_tier, 4) for tier in sorted(tier_weights)],
+        'class_weights': dict((vehicle_class, round(w / medium, 4)) for vehicle_class, w in class_weights.items()),
+    }
+
+
+def evaluate(model, columns, bins):
+    """
+    Returns:
+        dict: brier, log_loss and calibration table [(predicted, observed, count), ...]
+    """
+    n = len(columns)
+    brier = 0.0
+    log_loss = 0.0
+    bin_pred = [0.0] * bins
+    bin_won = [0] * bins
+    bin_count = [0] * bins
+    for i in range(n):
+        ally, enemy = columns.aggregates(i, model)
+        p = model.predict(ally, enemy) / 100.0
+        won = columns.won[i]
+        brier += (p - won) ** 2
+        q = min(max(p, 1e-6), 1.0 - 1e-6)
+        log_loss -= math.log(q) if won else math.log(1.0 - q)
+        k = min(bins - 1, int(p * bins))
+        bin_pred[k] += p
+        bin_won[k] += won
+        bin_count[k] += 1
+    table = [(bin_pred[k] / bin_count[k], float(bin_won[k]) / bin_count[k], bin_count[k])
+             for k in range(bins) if bin_count[k]]
+    return {'brier': brier / n, 'log_loss': log_loss / n, 'calibration': table}
+
+
+def print_report(name, report):
+    print("%-10s Brier %.4f  log loss %.4f" % (name, report['brier'], report['log_loss']))
+    for predicted, observed, count in report['calibration']:
+        print("    predicted %5.1f%%  observed %5.1f%%  (%d)" % (predicted * 100, observed * 100, count))
+
+
+def main(argv):
+    paths = []
+    archive_path = None
+    index_path = DEFAULT_INDEX_PATH
+    vehicle_types_path = DEFAULT_VEHICLE_TYPES_PATH
+    out_path = DEFAULT_PARAMS_PATH
+    bins = 10
+    min_rated = 5
+    args = iter(argv)
+    for arg in args:
+        if arg == '--archive':
+            archive_path = next(args)
+        elif arg == '--index':
+            index_path = next(args)
+        elif arg == '--vehicle-types':
+            vehicle_types_path = next(args)
+        elif arg == '--out':
+            out_path = next(args)
+        elif arg == '--bins':
+            bins = int(next(args))
+        elif arg == '--min-rated':
+            min_rated = int(next(args))
+        else:
+            paths.append(arg)
+    if not paths and archive_path is None and os.path.isdir(DEFAULT_ARCHIVE_PATH):
+        archive_path = DEFAULT_ARCHIVE_PATH
+    if not paths and not archive_path:
+        print(__doc__)
+        return 1
+    if archive_path and not os.path.isdir(archive_path):
+        print("battle archive not found: %s" % archive_path)
+        return 1
+    if not os.path.exists(index_path):
+        print("player index not found: %s" % index_path)
+        return 1
+
+    vehicle_types = load_vehicle_types(vehicle_types_path)
+    if not vehicle_types:
+        print("vehicle types not found: %s - the weighted model is evaluated with default weights only"
+              % vehicle_types_path)
+
+    ratings = RatingLookup(index_path)
+    started = time.time()
+    try:
+        columns, skipped = collect(paths, ratings, min_rated, archive_path, vehicle_types)
+    finally:
+        ratings.close()
+    typed = sum(1 for count in columns.vehicle_count if count)
+    print("%d battles (%d with vehicle types), %d skipped (draws, incomplete or too few rated players), %.1fs" % (
+        len(columns), typed, skipped, time.time() - started))
+    if not len(columns):
+        return 1
+
+    scale, bias = fit_logistic(columns)
+    print("logistic fit: scale %.1f, bias %.4f" % (scale, bias))
+    fitted = {'logistic': {'scale': scale, 'bias': bias}}
+
+    weighted = fit_weighted(columns)
+    if weighted is not None:
+        print("weighted fit: tier weights %s" % ', '.join('%.2f' % w for w in weighted['tier_weights']))
+        print("              class weights %s" % ', '.join(
+            '%s %.2f' % (vehicle_class, weighted['class_weights'][vehicle_class])
+            for vehicle_class in VEHICLE_CLASSES if vehicle_class in weighted['class_weights']))
+        fitted['weighted'] = weighted
+
+    reports = {}
+    for name, params in (('average', None), ('logistic', None), ('logistic*', fitted['logistic']),
+                         ('weighted', None), ('weighted*', fitted.get('weighted'))):
+        if name.endswith('*') and params is None:
+            continue
+        report = evaluate(create_model(name.rstrip('*'), params), columns, bins)
+        print_report(name, report)
+        reports[name] = report
+
+    out_dir = os.path.dirname(out_path)
+    if out_dir and not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    with open(out_path, 'w') as f:
+        json.dump({
+            'models': fitted,
+            'battles': len(columns),
+            'generated_at': int(time.time()),
+            'report': dict((name, {'brier': r['brier'], 'log_loss': r['log_loss']})
+                           for name, r in reports.items()),
+        }, f, indent=2)
+    print("parameters written to %s" % out_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))